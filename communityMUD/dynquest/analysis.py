@@ -0,0 +1,133 @@
+from twisted.internet import threads
+from evennia import create_script, search_object, search_script
+from evennia.scripts.scripts import DefaultScript
+from evennia.utils.logger import log_info, log_trace
+from dynquest.genpc import ModelServiceBusy, model_breaker
+from dynquest.models import QuestEntry
+
+ANALYSIS_SCRIPT_KEY = "quest_analysis_script"
+
+
+def analysis_script():
+    """
+    Returns the QuestAnalysisScript, creating it if this database does not have one yet
+    (at_initial_setup only runs on a fresh database). None if it could not be created.
+    """
+    scripts = search_script(ANALYSIS_SCRIPT_KEY)
+    if scripts:
+        return scripts[0]
+
+    log_info(f"[QuestAnalysis] Creating {ANALYSIS_SCRIPT_KEY}")
+    return create_script(QuestAnalysisScript)
+
+
+def retry_analysis(entry: QuestEntry):
+    """
+    Puts a quest whose analysis failed back in the queue, with a fresh set of attempts.
+    """
+    job = dict(entry.raw_data)
+    job.update({"attempts": 0, "last_error": None})
+    entry.raw_data = job
+    entry.status = "analyzing"
+    entry.save()
+
+
+class QuestAnalysisScript(DefaultScript):
+    """
+    Drains the quest analysis queue: extracts a quest from each "analyzing" QuestEntry with the
+    LLM, then hands it to QuestBuilderScript by marking it "pending".
+
+    At most CONCURRENCY extractions run at once, each in a worker thread, so quest givers never
+    hold up dialogue. The queue lives in the database: jobs that were running when the server
+    stopped are simply picked up again. A job that fails MAX_ATTEMPTS times is marked
+    "analysis_failed" and can be queued again with retry_analysis (see @questqueue).
+    """
+
+    CONCURRENCY = 2         # Quest extractions running at once
+    MAX_ATTEMPTS = 3        # Failed extractions before a job is given up
+
+    def at_script_creation(self):
+        self.key = ANALYSIS_SCRIPT_KEY
+        self.desc = "Extracts quests from quest-like NPC dialogue."
+        self.interval = 10  # Picks up jobs queued while all slots were busy; GenPC also calls drain()
+        self.persistent = True
+        self.start_delay = True
+
+    @property
+    def in_flight(self):
+        if self.ndb.in_flight is None:
+            self.ndb.in_flight = set()
+        return self.ndb.in_flight
+
+    def at_repeat(self):
+        self.drain()
+
+    def drain(self):
+        """
+        Starts the oldest queued jobs, up to the concurrency limit. Jobs wait while the LLM
+        service's circuit breaker is open.
+
+        Returns:
+            list[Deferred]: One per job started, firing once its result is saved.
+        """
+        free = QuestAnalysisScript.CONCURRENCY - len(self.in_flight)
+        if free <= 0 or not model_breaker().allow():
+            return []
+
+        jobs = QuestEntry.objects.filter(status="analyzing").exclude(
+            id__in=self.in_flight).order_by("timestamp_created")[:free]
+
+        return [d for d in (self.start_analysis(entry) for entry in jobs) if d]
+
+    def start_analysis(self, entry: QuestEntry):
+        job = entry.raw_data
+        found = search_object(job.get("npc")) if job.get("npc") else []
+        if not found:
+            self.at_analysis_complete(None, entry, error="NPC no longer exists", final=True)
+            return None
+
+        log_info(f"[QuestAnalysis] Analyzing {entry.quest_id} (attempt {job.get('attempts', 0) + 1})")
+        self.in_flight.add(entry.id)
+
+        d = threads.deferToThread(found[0].analyze_response_for_quest, job["originating_response"], persona=job.get("persona"))
+        d.addCallback(self.at_analysis_complete, entry)
+        d.addErrback(self.at_analysis_failed, entry)
+        d.addErrback(lambda failure: log_trace(f"[QuestAnalysis] Failed to save analysis of {entry.quest_id}"))
+        d.addBoth(lambda _: self.in_flight.discard(entry.id))
+        return d
+
+    def at_analysis_failed(self, failure, entry: QuestEntry):
+        """
+        An extraction raised. If the LLM service was only busy, the job stays queued without
+        using up an attempt; drain() starts it again later.
+        """
+        if failure.check(ModelServiceBusy):
+            log_info(f"[QuestAnalysis] LLM service busy; {entry.quest_id} stays queued")
+            return
+        self.at_analysis_complete(None, entry, error=failure.getErrorMessage())
+
+    def at_analysis_complete(self, quest, entry: QuestEntry, error=None, final=False):
+        """
+        Saves the outcome of one extraction, on the reactor thread.
+        """
+        if entry.status != "analyzing":
+            return
+
+        if quest:
+            entry.title = quest["title"][:255]
+            entry.raw_data = quest
+            entry.status = "pending"
+            entry.save()
+            log_info(f"[QuestAnalysis] Queued quest for building: {entry}")
+            return
+
+        job = dict(entry.raw_data)
+        job["attempts"] = job.get("attempts", 0) + 1
+        job["last_error"] = error or "No quest could be extracted"
+        entry.raw_data = job
+
+        if final or job["attempts"] >= QuestAnalysisScript.MAX_ATTEMPTS:
+            entry.status = "analysis_failed"
+            log_info(f"[QuestAnalysis] Gave up on {entry.quest_id}: {job['last_error']}")
+
+        entry.save()
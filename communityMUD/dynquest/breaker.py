@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"           # Calls go through
+OPEN = "open"               # Calls are refused until a health probe succeeds
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome and latency of recent calls to a service and stops calling it while it is failing.
+
+    The breaker opens once failure_threshold of the last `window` calls failed; a call that
+    succeeded but took longer than slow_call_seconds counts as a failure, so a wedged service
+    trips the breaker as well as a dead one. While open, allow() refuses calls at once. After
+    `cooldown` seconds a cheap health probe runs in a background thread (never in the caller),
+    and the breaker closes again when it passes.
+
+    A service that is up but at capacity can ask callers to back off for a while instead; see back_off().
+
+    Thread safe; one breaker is shared by every caller of the service.
+
+    Args:
+        probe (callable): Returns True if the service is healthy. May raise.
+        failure_threshold (int): Failed calls within the window that open the breaker.
+        window (int): Number of most recent calls considered.
+        slow_call_seconds (float): Latency above which a successful call counts as failed.
+        cooldown (float): Seconds to stay open before probing the service again.
+    """
+
+    def __init__(self, probe=None, failure_threshold=3, window=10, slow_call_seconds=20, cooldown=10):
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.cooldown = cooldown
+
+        self.state = CLOSED
+        self.outcomes = deque(maxlen=window)    # (succeeded, latency in seconds) of recent calls
+        self.opened_at = 0.0
+        self.probing = False
+        self.retry_at = 0.0         # While closed, refuse calls until this monotonic time (see back_off)
+        self.times_opened = 0
+        self.refused = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        Returns True if a call may be made now. Never blocks on the service.
+        """
+        with self.lock:
+            if self.state == CLOSED:
+                if time.monotonic() < self.retry_at:
+                    self.refused += 1
+                    return False
+                return True
+
+            self.refused += 1
+            if not self.probing and time.monotonic() - self.opened_at >= self.cooldown:
+                self.probing = True
+                threading.Thread(target=self.run_probe, name="circuit-breaker-probe", daemon=True).start()
+            return False
+
+    def record_success(self, latency=None):
+        """
+        Records a call that completed, taking latency seconds (or to its first output, if streamed).
+        Calls expected to be slow, such as long extractions, can be recorded without a latency.
+        """
+        self.record(latency is None or latency <= self.slow_call_seconds, latency)
+
+    def back_off(self, seconds):
+        """
+        Refuses calls for the next `seconds`, without opening the breaker or counting a failure:
+        the service answered, but asked callers to retry later.
+        """
+        with self.lock:
+            self.retry_at = max(self.retry_at, time.monotonic() + seconds)
+
+    def record_failure(self, latency=None):
+        self.record(False, latency)
+
+    def record(self, succeeded, latency):
+        with self.lock:
+            self.outcomes.append((succeeded, latency))
+            failures = sum(1 for ok, _ in self.outcomes if not ok)
+
+            if self.state == CLOSED and failures >= self.failure_threshold:
+                self.trip()
+
+    def trip(self):
+        """Opens the breaker. Caller holds the lock."""
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        print(f"[CircuitBreaker] Open: {self.failure_threshold} of the last {len(self.outcomes)} calls failed or were slow")
+
+    def run_probe(self):
+        try:
+            healthy = bool(self.probe()) if self.probe else True
+        except Exception as e:
+            print(f"[CircuitBreaker] Health probe failed: {e}")
+            healthy = False
+
+        with self.lock:
+            self.probing = False
+            if healthy:
+                self.state = CLOSED
+                self.outcomes.clear()
+                print("[CircuitBreaker] Closed: health probe passed")
+            else:
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self.lock:
+            latencies = [latency for _, latency in self.outcomes if latency is not None]
+            return {
+                "state": self.state,
+                "backing_off": self.state == CLOSED and time.monotonic() < self.retry_at,
+                "recent_calls": len(self.outcomes),
+                "recent_failures": sum(1 for ok, _ in self.outcomes if not ok),
+                "recent_mean_latency": round(sum(latencies) / len(latencies), 3) if latencies else None,
+                "times_opened": self.times_opened,
+                "refused": self.refused,
+            }
@@ -1,41 +1,99 @@
 import numpy as np
 from evennia.objects.models import ObjectDB
-from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
 import traceback
+from twisted.internet.defer import maybeDeferred
 from evennia import create_script, create_object
 from evennia.scripts.scripts import DefaultScript
-from evennia.utils.logger import log_info
+from evennia.utils.logger import log_info, log_trace
 from evennia.utils.utils import make_iter
 from dynquest.models import QuestEntry
+from dynquest.embeddings import EMBEDDING_CACHE, EMBEDDING_MODEL, EMBEDDING_MODELS
+from dynquest.embedding_worker import embedding_worker
+from dynquest.lore import normalize_rows
 import json
 
-TRANSFORMER = SentenceTransformer("all-MiniLM-L6-v2")
+TRANSFORMER = EMBEDDING_MODELS.proxy(EMBEDDING_MODEL)      # Loaded on first use
 LOCATION_SIMILARITY_THRESHOLD = 0.70
 
 
-def get_similar_locations(description, transformer, threshold=0.85, top_n=3):
+def embed(texts, transformer=None, model_name=EMBEDDING_MODEL):
+    """
+    Embeds texts through the shared embedding cache, so repeated text is only encoded once.
+    Misses are encoded by the embedding worker process if it is running (blocking until it
+    answers), else in this process.
+
+    Args:
+        texts (list[str]): Texts to embed.
+        transformer (SentenceTransformer, optional): Model to use instead of TRANSFORMER.
+        model_name (str): Name of that model, used to key the cache.
+
+    Returns:
+        np.ndarray: One embedding row per text.
+    """
+    if transformer is None:
+        worker = embedding_worker()
+        transformer = worker if worker and worker.model_name == model_name else TRANSFORMER
+    return EMBEDDING_CACHE.encode(transformer, texts, model_name)
+
+
+def embed_async(texts, model_name=EMBEDDING_MODEL):
+    """
+    Embeds texts without blocking the reactor: misses go to the embedding worker process and
+    the result comes back on the reactor thread. Without a running worker, this encodes in
+    this process before returning.
+
+    Returns:
+        Deferred: Fires with one embedding row per text.
+    """
+    worker = embedding_worker()
+    if worker is None or worker.model_name != model_name:
+        return maybeDeferred(embed, texts, None, model_name)
+    return EMBEDDING_CACHE.encode_async(worker.encode_async, texts, model_name)
+
+
+def location_candidates():
+    """
+    Existing rooms with a description, which new quest locations may reuse.
+    """
+    rooms = ObjectDB.objects.filter(
+        db_typeclass_path__icontains="Room"
+    )
+    return [room for room in rooms if room.db.desc]
+
+
+def get_similar_locations_async(description, threshold=0.85, top_n=3, model_name=EMBEDDING_MODEL):
+    """
+    get_similar_locations() with every embedding it needs computed off the reactor first.
+
+    Returns:
+        Deferred: Fires with the (room, similarity_score) list.
+    """
+    texts = [room.db.desc for room in location_candidates() if not room.db.embedding] + [description]
+    d = embed_async(texts, model_name)
+    d.addCallback(lambda _: get_similar_locations(description, None, threshold, top_n, model_name))
+    return d
+
+
+def get_similar_locations(description, transformer=None, threshold=0.85, top_n=3, model_name=EMBEDDING_MODEL):
     """
     Finds existing in-game locations that are semantically similar to a new description.
 
     Args:
         description (str): The new location description to compare.
-        transformer (SentenceTransformer): Your embedding model instance.
+        transformer (SentenceTransformer, optional): Your embedding model instance. Defaults to
+            the shared model (see embed()).
         threshold (float): Similarity threshold for "close enough" matches.
         top_n (int): Number of top matches to return.
+        model_name (str): Name of the transformer's model, used to key the embedding cache.
 
     Returns:
         List of tuples: (room, similarity_score), sorted by descending score.
     """
     # Get all rooms that might be reusable (e.g., tagged or with a desc)
-    candidates = ObjectDB.objects.filter(
-        db_typeclass_path__icontains="Room"
-    )
+    candidates = location_candidates()
 
     print(f"Candidates: {candidates}")
 
-    candidates = [room for room in candidates if room.db.desc]
-
     if len(candidates) == 0:
         return []
 
@@ -58,18 +116,17 @@ def get_similar_locations(description, transformer, threshold=0.85, top_n=3):
         if room.db.embedding:
             room_embeddings.append(np.array(room.db.embedding))
         else:
-            embedding = transformer.encode([desc])[0]
+            embedding = embed([desc], transformer, model_name)[0]
             room.db.embedding = embedding.tolist()
             room_embeddings.append(embedding)
 
     # Embed the query
-    query_embedding = transformer.encode([description])[0]
+    query_embedding = embed([description], transformer, model_name)[0]
     query_embedding = np.array(query_embedding)
 
-    similarities = cosine_similarity(
-        [query_embedding],  # type: ignore 
-        room_embeddings          # type: ignore
-    )[0]
+    room_matrix = normalize_rows(np.array(room_embeddings, dtype=np.float32))
+    query_norm = np.linalg.norm(query_embedding)
+    similarities = room_matrix @ (query_embedding / query_norm) if query_norm else np.zeros(len(rooms))
 
     scored = list(zip(rooms, similarities))
 
@@ -116,24 +173,7 @@ class QuestBuilderScript(DefaultScript):
             # --------------------------
             # Parse goals to infer assets
             # --------------------------
-            goals = data.get("goals", [])
-            goal_targets = {
-                "findlocation": set(),
-                "findnpc": set(),
-                "findobject": set(),
-                "giveto": set(),
-            }
-
-            for goal in goals:
-                goal_type = goal.get("type")
-                target = goal.get("target")
-                obj = goal.get("object")
-
-                if goal_type in ("findlocation", "findnpc", "findobject") and target:
-                    goal_targets[goal_type].add(target)
-                elif goal_type == "giveto" and target and obj:
-                    goal_targets["findnpc"].add(target)
-                    goal_targets["findobject"].add(obj)
+            goal_targets = self.goal_targets(data.get("goals", []))
 
             # Build fast-lookup sets from declared quest elements
             existing_location_keys = {loc["key"] for loc in data.get("locations", [])}
@@ -145,7 +185,7 @@ class QuestBuilderScript(DefaultScript):
                 if key not in existing_location_keys:
                     data.setdefault("locations", []).append({
                         "key": key,
-                        "desc": f"A mysterious place called {key}."
+                        "desc": self.inferred_location_desc(key)
                     })
                     existing_location_keys.add(key)
 
@@ -174,7 +214,7 @@ class QuestBuilderScript(DefaultScript):
             # --------------------------
             for loc in data.get("locations", []):
                 loc_desc = loc["desc"]
-                existing_matches = get_similar_locations(loc_desc, transformer=TRANSFORMER, threshold=LOCATION_SIMILARITY_THRESHOLD)
+                existing_matches = get_similar_locations(loc_desc, threshold=LOCATION_SIMILARITY_THRESHOLD)
 
                 if existing_matches:
                     chosen_room = existing_matches[0][0]
@@ -248,11 +288,72 @@ class QuestBuilderScript(DefaultScript):
         "failed", otherwise, it is marked as "built" upon successful completion.
         """
 
+        if self.ndb.building:
+            return
+
         pending = QuestEntry.objects.filter(status="pending").order_by("timestamp_created").first()
         if not pending:
             print("No pending quests found.")
             log_info("No pending quests found.")
             return
 
-        self.do_build(pending)
+        # Embed the quest's locations and any new rooms off the reactor, so matching them
+        # during the build only reads the embedding cache.
+        self.ndb.building = True
+        d = embed_async(self.location_texts(pending))
+        d.addErrback(lambda failure: log_trace("[QuestBuilderScript] Could not embed locations ahead of the build"))
+        d.addCallback(lambda _: self.do_build(pending))
+
+        def done(result):
+            self.ndb.building = False
+            return result
+
+        d.addBoth(done)
+        return d
+
+    @staticmethod
+    def goal_targets(goals):
+        """
+        Targets the quest's goals need, by goal type. A "giveto" goal needs both its NPC and its object.
+        """
+        goal_targets = {
+            "findlocation": set(),
+            "findnpc": set(),
+            "findobject": set(),
+            "giveto": set(),
+        }
+
+        for goal in goals:
+            goal_type = goal.get("type")
+            target = goal.get("target")
+            obj = goal.get("object")
+
+            if goal_type in ("findlocation", "findnpc", "findobject") and target:
+                goal_targets[goal_type].add(target)
+            elif goal_type == "giveto" and target and obj:
+                goal_targets["findnpc"].add(target)
+                goal_targets["findobject"].add(obj)
+
+        return goal_targets
+
+    @staticmethod
+    def inferred_location_desc(key):
+        """Description of a location a goal names but the quest does not declare."""
+        return f"A mysterious place called {key}."
+
+    @staticmethod
+    def location_texts(pending: QuestEntry):
+        """
+        Descriptions the build will embed: the quest's locations, those inferred from its goals,
+        and rooms without a stored embedding.
+        """
+        quest = (pending.raw_data or {}).get("quest") or {}
+        locations = [loc for loc in quest.get("locations", []) if isinstance(loc, dict)]
+        texts = [loc["desc"] for loc in locations if loc.get("desc")]
+
+        declared = {loc.get("key") for loc in locations}
+        goals = [goal for goal in quest.get("goals", []) if isinstance(goal, dict)]
+        texts += [QuestBuilderScript.inferred_location_desc(key)
+                  for key in sorted(QuestBuilderScript.goal_targets(goals)["findlocation"] - declared)]
+        return texts + [room.db.desc for room in location_candidates() if not room.db.embedding]
 
@@ -0,0 +1,330 @@
+import re
+import threading
+
+import numpy as np
+from twisted.internet.defer import maybeDeferred, succeed
+
+from dynquest.builder import embed, embed_async
+from dynquest.helpers import QuestEval
+from dynquest.lore import normalize_rows
+
+# Words one of which a response must contain before it is embedded: QuestEval.is_quest_worthy's
+# keywords, plus the imperative verbs and asks that list lacks ("bring", "seek", "escort",
+# "clear", "must", "take this", ...). The extra words were picked while reading
+# QUEST_LABELED_SET, so measure the list on QUEST_HELDOUT_SET (see report()): there it lets
+# through only 2 of the 10 quests (precision 0.25), against none for keyword_is_quest. A quest
+# stopped here is lost, so QUEST_CLASSIFIER does not use it (see QuestClassifier's prefilter).
+PREFILTER_KEYWORDS = [
+    "quest", "mission", "task", "assignment",
+    "retrieve", "deliver", "investigate", "slay", "find",
+    "explore", "track", "hunt", "recover", "return",
+    "search", "follow", "protect", "solve", "convince", "negotiate",
+    "objective", "reclaim", "uncover", "discover",
+    "bring", "seek", "escort", "clear", "must", "reward", "need someone", "need you",
+    "take this", "go and"
+]
+
+# Matches anywhere in a word ("finding", "tasked"), like QuestEval.is_quest_worthy
+PREFILTER_PATTERN = re.compile("|".join(re.escape(word).replace(r"\ ", r"\s+") for word in PREFILTER_KEYWORDS), re.IGNORECASE)
+
+
+def passes_prefilter(text):
+    """True if text contains one of PREFILTER_KEYWORDS, so it is worth embedding."""
+    return PREFILTER_PATTERN.search(text) is not None
+
+
+# Responses that hand the listener a quest
+QUEST_EXEMPLARS = [
+    "You must travel to the old mill and bring back the miller's ledger.",
+    "Your mission is to find the missing caravan before the week is out.",
+    "Slay the beast haunting the northern pass, and I will reward you well.",
+    "Deliver this sealed letter to the captain of the guard at the eastern gate.",
+    "Go to the abandoned chapel and discover what became of the priest.",
+    "I need someone to recover the stolen relic from the bandits in the hills.",
+    "Track down the smuggler who fled into the marsh and return with his map.",
+    "Speak with the harbormaster and convince her to release our ship.",
+    "Protect the pilgrims on their road to the shrine until they reach the gate.",
+    "Investigate the strange lights over the quarry and report back to me.",
+    "Find my daughter's lost locket in the ruins; she has not slept since it vanished.",
+    "Hunt the wolves that have been taking our sheep and bring me their pelts.",
+]
+
+# Responses that only mention quest-like words: stories, advice, small talk and refusals
+NON_QUEST_EXEMPLARS = [
+    "I found this hat at the market years ago, and it has served me well.",
+    "The train returns to the station every evening at six.",
+    "Many have searched the hills for gold, but I never had the patience for it.",
+    "My grandfather hunted these woods when he was a boy.",
+    "I'm afraid I can't speak on such matters.",
+    "Good day to you, traveler. The weather has been kind this week.",
+    "You will find the tavern just down the road, past the well.",
+    "Once, a knight came through here on some quest of his own. We never saw him again.",
+    "I have no task for you today. Perhaps ask the blacksmith.",
+    "Explorers used to pass through often, before the bridge collapsed.",
+    "The guard will protect you well enough inside the city walls.",
+    "Thank you for returning my cup. Few people are so honest.",
+]
+
+# Hand-labeled responses for measuring precision and recall (see QuestClassifier.evaluate). The
+# exemplars and PREFILTER_KEYWORDS were written with this set in view.
+QUEST_LABELED_SET = [
+    ("Bring back three bundles of moonpetal from the glade, and the cure is yours.", True),
+    ("You must find the engineer before the next train departs.", True),
+    ("Seek out the hermit on the cliffs and ask him what he saw that night.", True),
+    ("Retrieve the ledger from the stationmaster's office without being seen.", True),
+    ("The lighthouse keeper has gone silent. Go and learn why, then come back to me.", True),
+    ("Clear the rats from my cellar and I'll pour you a drink on the house.", True),
+    ("Escort my son to the market town; the roads are not safe.", True),
+    ("Uncover who has been poisoning the wells, and you will have the council's thanks.", True),
+    ("Return the stolen bell to the chapel before the festival.", True),
+    ("Take this medicine to the widow at the end of the lane.", True),
+    ("I found my first silver coin on this very platform.", False),
+    ("The ghost train returns every winter, or so they say.", False),
+    ("You'll find no better stew in all the realm.", False),
+    ("A quest? Ha! I'm too old for such things now.", False),
+    ("The guards track every traveler who enters the city.", False),
+    ("I have nothing to say on that just now.", False),
+    ("My brother went exploring the caves once and came back with a limp.", False),
+    ("Protecting the station has been my duty for thirty years.", False),
+    ("The hunt was poor this season; the deer have moved north.", False),
+    ("Ticket, please. The eastbound leaves in ten minutes.", False),
+]
+
+# Responses not used to pick the exemplars or PREFILTER_KEYWORDS, to measure them fairly
+QUEST_HELDOUT_SET = [
+    ("Fetch the midwife from the valley farms; my wife's time has come.", True),
+    ("Carry this lantern oil to the shepherds on the ridge before nightfall.", True),
+    ("Guard the granary tonight and catch whoever has been stealing our grain.", True),
+    ("Rescue the ferryman's boy from the river caves and the village will owe you.", True),
+    ("Collect ten wolf fangs for the alchemist, and she will pay in silver.", True),
+    ("Someone must warn the outlying farms that raiders are coming.", True),
+    ("Ask the old miner where the collapsed shaft leads, and tell me what he says.", True),
+    ("Light the three beacons on the hills so the fleet can find the harbor.", True),
+    ("Get the stolen payroll back from the bandits at the crossroads.", True),
+    ("Climb the bell tower and mend the rope before the festival bells are rung.", True),
+    ("The miller's daughter found a ring in the river last spring.", False),
+    ("Hunting is forbidden in the duke's forest, as everyone knows.", False),
+    ("You must be tired from the road; sit by the fire.", False),
+    ("We searched for the lost sheep all night and found it asleep in the barn.", False),
+    ("The bridge was rebuilt after the flood, stronger than before.", False),
+    ("Return? I'll never return to that cursed city.", False),
+    ("Bread is two coppers a loaf, three if you want it warm.", False),
+    ("The captain keeps his own counsel; I know nothing of his mission.", False),
+    ("My knees ache when the rain comes, and it is coming.", False),
+    ("Travelers bring news from the capital now and then, mostly gossip.", False),
+]
+
+
+class QuestClassifier:
+    """
+    Decides whether an NPC response hands out a quest, so only real quests are sent for the
+    expensive LLM extraction.
+
+    If a `prefilter` is given, the response must first pass it. It is then embedded once and
+    compared to two precomputed matrices of unit-length exemplar embeddings;
+    its score is the mean similarity of its top_k closest quest exemplars minus that of its top_k
+    closest non-quest exemplars. It counts as a quest when the score is above `margin`.
+
+    is_quest() embeds in the calling thread; is_quest_async() is for the reactor thread.
+
+    Args:
+        quest_exemplars (list[str]): Responses that are quests.
+        other_exemplars (list[str]): Quest-sounding responses that are not.
+        margin (float): Score above which a response is a quest.
+        top_k (int): Number of closest exemplars of each kind averaged.
+        embed_fn (callable): Embeds a list of texts; defaults to the shared cached embed().
+        embed_async_fn (callable): Embeds a list of texts, returning a Deferred; defaults to
+            embed_async(), or to embed_fn if only that is given.
+        prefilter (callable): Cheap test a response must pass to be embedded at all, such as
+            passes_prefilter. None (the default) embeds every response.
+    """
+
+    def __init__(self, quest_exemplars=None, other_exemplars=None, margin=0.0, top_k=3, embed_fn=None, embed_async_fn=None,
+                 prefilter=None):
+        self.quest_exemplars = list(quest_exemplars or QUEST_EXEMPLARS)
+        self.other_exemplars = list(other_exemplars or NON_QUEST_EXEMPLARS)
+        self.margin = margin
+        self.top_k = top_k
+        self.embed_fn = embed_fn or embed
+        if embed_async_fn is None:
+            embed_async_fn = embed_async if embed_fn is None else lambda texts: maybeDeferred(embed_fn, texts)
+        self.embed_async_fn = embed_async_fn
+        self.prefilter = prefilter
+
+        self.quest_matrix = None
+        self.other_matrix = None
+        self.lock = threading.Lock()
+
+    def exemplar_matrices(self):
+        """
+        Embeds the exemplars on first use (so importing this module does not run the model).
+        """
+        with self.lock:
+            if self.quest_matrix is None:
+                self.set_exemplar_embeddings(self.embed_fn(self.quest_exemplars + self.other_exemplars))
+
+        return self.quest_matrix, self.other_matrix
+
+    def exemplar_matrices_async(self):
+        """
+        exemplar_matrices() without blocking the reactor on the first call.
+
+        Returns:
+            Deferred: Fires with the (quest, other) matrices.
+        """
+        if self.quest_matrix is not None:
+            return succeed((self.quest_matrix, self.other_matrix))
+
+        def store(embeddings):
+            with self.lock:
+                if self.quest_matrix is None:
+                    self.set_exemplar_embeddings(embeddings)
+            return self.quest_matrix, self.other_matrix
+
+        return self.embed_async_fn(self.quest_exemplars + self.other_exemplars).addCallback(store)
+
+    def set_exemplar_embeddings(self, embeddings):
+        """Splits the exemplar embeddings into the two unit-length matrices. Caller holds the lock."""
+        matrix = normalize_rows(np.array(embeddings, dtype=np.float32))
+        self.quest_matrix = np.ascontiguousarray(matrix[:len(self.quest_exemplars)])
+        self.other_matrix = np.ascontiguousarray(matrix[len(self.quest_exemplars):])
+
+    def score(self, text):
+        """
+        Returns how much closer text is to the quest exemplars than to the others (-2 to 2).
+        """
+        quest_matrix, other_matrix = self.exemplar_matrices()
+        return self.score_embedding(self.embed_fn([text])[0], quest_matrix, other_matrix)
+
+    def score_embedding(self, query, quest_matrix, other_matrix):
+        """score() for a response that is already embedded."""
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return 0.0
+        query = query / norm
+
+        return float(self.top_mean(quest_matrix @ query) - self.top_mean(other_matrix @ query))
+
+    def top_mean(self, similarities):
+        k = min(self.top_k, len(similarities))
+        return np.partition(similarities, -k)[-k:].mean()
+
+    def is_quest(self, text):
+        """
+        True if text passes the pre-filter (if any) and scores above the margin.
+        """
+        return self.passes(text) and self.score(text) > self.margin
+
+    def passes(self, text):
+        return self.prefilter is None or self.prefilter(text)
+
+    def is_quest_async(self, text):
+        """
+        is_quest() for the reactor thread: the exemplars and the response are embedded with
+        embed_async_fn.
+
+        Returns:
+            Deferred: Fires with True if text is a quest.
+        """
+        if not self.passes(text):
+            return succeed(False)
+
+        d = self.exemplar_matrices_async()
+
+        def embed_text(matrices):
+            return self.embed_async_fn([text]).addCallback(
+                lambda rows: self.score_embedding(rows[0], *matrices) > self.margin)
+
+        return d.addCallback(embed_text)
+
+    def separation(self, labeled=None, score=None):
+        """
+        How well a score separates quests from the rest: the lowest score of a quest and the
+        highest score of a response that is not one. They overlap when quest_min <= other_max,
+        and then no decision margin classifies the set without errors.
+
+        Args:
+            labeled (list[tuple[str, bool]]): (response, is a quest) pairs. Defaults to QUEST_HELDOUT_SET.
+            score (callable): Scores a response. Defaults to score.
+        """
+        labeled = labeled or QUEST_HELDOUT_SET
+        score = score or self.score
+        scores = [(score(text), is_quest) for text, is_quest in labeled]
+        return {
+            "quest_min": min((value for value, is_quest in scores if is_quest), default=None),
+            "other_max": max((value for value, is_quest in scores if not is_quest), default=None),
+        }
+
+    def evaluate(self, labeled=None, predict=None):
+        """
+        Measures a quest predictor on labeled responses.
+
+        Args:
+            labeled (list[tuple[str, bool]]): (response, is a quest) pairs. Defaults to QUEST_LABELED_SET.
+            predict (callable): Predicts whether a response is a quest. Defaults to is_quest.
+
+        Returns:
+            dict: Confusion counts, precision, recall, and the number of extractions a
+                predictor would trigger on the set.
+        """
+        labeled = labeled or QUEST_LABELED_SET
+        predict = predict or self.is_quest
+        counts = {"tp": 0, "fp": 0, "fn": 0, "tn": 0}
+
+        for text, is_quest in labeled:
+            predicted = bool(predict(text))
+            counts[("t" if predicted == is_quest else "f") + ("p" if predicted else "n")] += 1
+
+        predicted_positive = counts["tp"] + counts["fp"]
+        positive = counts["tp"] + counts["fn"]
+        return dict(
+            counts,
+            precision=round(counts["tp"] / predicted_positive, 3) if predicted_positive else 0.0,
+            recall=round(counts["tp"] / positive, 3) if positive else 0.0,
+            extractions=predicted_positive
+        )
+
+
+KEYWORD_MARGIN = 2      # Quest phrases keyword_is_quest requires
+
+
+def keyword_is_quest(text):
+    """
+    The previous keyword heuristic, kept unchanged as the baseline for evaluate().
+    """
+    return keyword_score(text) >= KEYWORD_MARGIN
+
+
+def keyword_score(text):
+    """The baseline's score: its count of quest phrases, or 0 without a quest keyword."""
+    dq = QuestEval(text)
+    return dq.quest_confidence_score() if dq.is_quest_worthy() else 0
+
+
+QUEST_CLASSIFIER = QuestClassifier()
+
+
+def report(labeled=None):
+    """
+    Prints precision and recall on a labeled set (by default QUEST_HELDOUT_SET) of the keyword
+    heuristic, of the classifier's pre-filter alone, and of QUEST_CLASSIFIER. For the keyword
+    heuristic and the classifier it also prints the decision margin next to the lowest quest
+    score and the highest non-quest score (see QuestClassifier.separation).
+    Run it from `evennia shell`: from dynquest.classifier import report; report()
+    """
+    labeled = labeled or QUEST_HELDOUT_SET
+    rows = (
+        ("keywords", keyword_is_quest, keyword_score, KEYWORD_MARGIN),
+        ("prefilter", passes_prefilter, None, None),
+        ("embeddings", QUEST_CLASSIFIER.is_quest, QUEST_CLASSIFIER.score, QUEST_CLASSIFIER.margin),
+    )
+    for name, predict, score, margin in rows:
+        result = QUEST_CLASSIFIER.evaluate(labeled, predict=predict)
+        line = (f"{name:<10} precision {result['precision']:.3f}  recall {result['recall']:.3f}  "
+                f"extractions {result['extractions']}/{len(labeled)}  "
+                f"(tp {result['tp']}, fp {result['fp']}, fn {result['fn']}, tn {result['tn']})")
+        if score:
+            spread = QUEST_CLASSIFIER.separation(labeled, score=score)
+            line += f"  margin {margin:.2f}, quests >= {spread['quest_min']:.2f}, others <= {spread['other_max']:.2f}"
+        print(line)
@@ -1,6 +1,7 @@
 from evennia import default_cmds
 from evennia.utils.utils import inherits_from
 from dynquest.models import QuestEntry
+from dynquest.analysis import analysis_script, retry_analysis
 
 class CmdQuestStatus(default_cmds.MuxCommand):
     """
@@ -39,3 +40,67 @@ class CmdQuestStatus(default_cmds.MuxCommand):
             lines.append(f"{quest.quest_id:<12} |c{quest.title}|n ({quest.status}) by {triggered} on {quest.last_updated.strftime('%Y-%m-%d %H:%M:%S')}")
 
         self.msg("\n".join(lines))
+
+
+class CmdQuestQueue(default_cmds.MuxCommand):
+    """
+    Inspect and retry the quest analysis queue.
+
+    Usage:
+      @questqueue
+      @questqueue/retry <quest_id>
+      @questqueue/retry all
+
+    Lists quests waiting for analysis and quests whose analysis failed, with the
+    number of attempts and the last error. /retry queues failed analyses again.
+    """
+
+    key = "@questqueue"
+    switch_options = ("retry",)
+    locks = "cmd:perm(Builders)"
+    help_category = "Building"
+
+    def func(self):
+        if "retry" in self.switches:
+            self.retry()
+            return
+
+        quests = QuestEntry.objects.filter(status__in=["analyzing", "analysis_failed"]).order_by("timestamp_created")
+
+        if not quests:
+            self.msg("The quest analysis queue is empty.")
+            return
+
+        lines = ["|wQuest Analysis Queue|n:"]
+        for quest in quests:
+            attempts = quest.raw_data.get("attempts", 0)
+            error = quest.raw_data.get("last_error")
+            line = f"{quest.quest_id:<12} |c{quest.title}|n ({quest.status}, {attempts} attempts) queued {quest.timestamp_created.strftime('%Y-%m-%d %H:%M:%S')}"
+            if error:
+                line += f"\n    last error: {error}"
+            lines.append(line)
+
+        self.msg("\n".join(lines))
+
+    def retry(self):
+        target = self.args.strip()
+        if not target:
+            self.msg("Usage: @questqueue/retry <quest_id>|all")
+            return
+
+        failed = QuestEntry.objects.filter(status="analysis_failed")
+        if target != "all":
+            failed = failed.filter(quest_id=target)
+
+        if not failed:
+            self.msg(f"No failed quest analysis matches '{target}'.")
+            return
+
+        for quest in failed:
+            retry_analysis(quest)
+
+        self.msg(f"Queued {len(failed)} quest(s) for analysis again.")
+
+        script = analysis_script()
+        if script:
+            script.drain()
@@ -0,0 +1,262 @@
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+
+from twisted.internet.defer import Deferred
+
+# The worker process is started with "spawn", so this module must stay importable without Django,
+# Evennia or torch: the model is only imported inside the worker.
+MP_CONTEXT = multiprocessing.get_context("spawn")
+
+
+def worker_main(model_name: str, batch_window: float, max_batch: int, inbox, outbox):
+    """
+    Embedding worker process. Loads the model, then encodes jobs from the inbox.
+
+    Jobs are (job id, texts). After the first job arrives, further jobs are collected for up to
+    batch_window seconds (or until max_batch texts), and all their texts are encoded in one
+    forward pass. Results go to the outbox as ("done", job id, embeddings) or
+    ("error", job id, message), followed by ("batch", job count, text count) for stats.
+    A None job stops the worker.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name)
+    outbox.put(("ready", None, None))
+
+    while True:
+        job = inbox.get()
+        if job is None:
+            return
+
+        jobs = [job]
+        count = len(job[1])
+        stopping = False
+        deadline = time.monotonic() + batch_window
+
+        while count < max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = inbox.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                stopping = True
+                break
+            jobs.append(job)
+            count += len(job[1])
+
+        try:
+            texts = [text for _, job_texts in jobs for text in job_texts]
+            embeddings = model.encode(texts, convert_to_numpy=True, batch_size=max(32, len(texts)))
+
+            start = 0
+            for job_id, job_texts in jobs:
+                outbox.put(("done", job_id, embeddings[start:start + len(job_texts)]))
+                start += len(job_texts)
+        except Exception as e:
+            traceback.print_exc()
+            for job_id, _ in jobs:
+                outbox.put(("error", job_id, str(e)))
+
+        outbox.put(("batch", len(jobs), count))
+        if stopping:
+            return
+
+
+class _Waiter:
+    """A job whose caller blocks on the result instead of taking a Deferred."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class EmbeddingWorker:
+    """
+    Runs the embedding model in a separate process, so encoding never holds the server's GIL
+    or stalls the reactor. Concurrent requests arriving within batch_window seconds share a
+    forward pass.
+
+    encode_async() returns a Deferred fired on the reactor thread. encode() blocks the calling
+    thread and quacks like SentenceTransformer.encode, so the worker can stand in for a model.
+    A worker process that dies is restarted, failing the jobs it held.
+
+    Args:
+        model_name (str): SentenceTransformer model to load in the worker.
+        batch_window (float): Seconds to wait for more requests before encoding.
+        max_batch (int): Texts per forward pass.
+    """
+
+    def __init__(self, model_name, batch_window=0.005, max_batch=64):
+        self.model_name = model_name
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+
+        self.inbox = None
+        self.outbox = MP_CONTEXT.Queue()
+        self.process = None
+        self.ready = False
+        self.running = False
+
+        self.jobs = {}              # job id -> Deferred or _Waiter
+        self.job_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.reader = threading.Thread(target=self.read_results, name="embedding-worker-results", daemon=True)
+
+        self.requests = 0
+        self.batches = 0
+        self.batched_texts = 0
+
+    def start(self):
+        self.running = True
+        self.spawn()
+        self.reader.start()
+
+    def spawn(self):
+        print(f"[EmbeddingWorker] Starting worker for {self.model_name}")
+        self.ready = False
+        self.inbox = MP_CONTEXT.Queue()
+        self.process = MP_CONTEXT.Process(
+            target=worker_main,
+            args=(self.model_name, self.batch_window, self.max_batch, self.inbox, self.outbox),
+            name="embedding-worker",
+            daemon=True
+        )
+        self.process.start()
+
+    def stop(self):
+        self.running = False
+        if self.inbox is not None:
+            self.inbox.put(None)
+        if self.process is not None:
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.terminate()
+
+    @property
+    def alive(self):
+        return self.running and self.process is not None and self.process.is_alive()
+
+    def submit(self, texts, job):
+        with self.lock:
+            job_id = next(self.job_ids)
+            self.jobs[job_id] = job
+            self.requests += 1
+            self.inbox.put((job_id, list(texts)))
+
+    def encode_async(self, texts):
+        """
+        Returns:
+            Deferred: Fires on the reactor thread with one embedding row per text.
+        """
+        d = Deferred()
+        self.submit(texts, d)
+        return d
+
+    def encode(self, texts, timeout=30):
+        """
+        Blocks the calling thread until the texts are encoded, for up to timeout seconds. Results
+        are delivered by the worker's reader thread, so this works from any thread, but it would
+        stall the server on the reactor thread: there, use encode_async() (or builder.embed_async).
+        """
+        waiter = _Waiter()
+        self.submit(texts, waiter)
+        if not waiter.done.wait(timeout):
+            raise TimeoutError(f"Embedding worker did not answer within {timeout} seconds")
+        if waiter.error:
+            raise RuntimeError(waiter.error)
+        return waiter.result
+
+    def read_results(self):
+        while self.running:
+            try:
+                kind, key, payload = self.outbox.get(timeout=1)
+            except queue.Empty:
+                self.check_worker()
+                continue
+
+            if kind == "ready":
+                self.ready = True
+                print(f"[EmbeddingWorker] Worker for {self.model_name} ready")
+            elif kind == "batch":
+                self.batches += 1
+                self.batched_texts += payload
+            else:
+                with self.lock:
+                    job = self.jobs.pop(key, None)
+                if job is not None:
+                    self.deliver(job, payload if kind == "done" else None, payload if kind == "error" else None)
+
+    def deliver(self, job, result, error):
+        if isinstance(job, _Waiter):
+            job.result, job.error = result, error
+            job.done.set()
+            return
+
+        from twisted.internet import reactor
+        if error:
+            reactor.callFromThread(job.errback, RuntimeError(error))
+        else:
+            reactor.callFromThread(job.callback, result)
+
+    def check_worker(self):
+        if not self.running or self.process is None or self.process.is_alive():
+            return
+
+        print(f"[EmbeddingWorker] Worker exited with code {self.process.exitcode}; restarting")
+        with self.lock:
+            lost = list(self.jobs.values())
+            self.jobs.clear()
+            self.spawn()
+        for job in lost:
+            self.deliver(job, None, "Embedding worker exited")
+
+    def stats(self):
+        with self.lock:
+            in_flight = len(self.jobs)
+        return {
+            "model": self.model_name,
+            "ready": self.ready,
+            "in_flight": in_flight,
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_texts": round(self.batched_texts / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+# The worker started at server start (see start_embedding_worker), if any.
+_embedding_worker = None
+
+
+def start_embedding_worker(model_name, **kwargs):
+    """
+    Starts the shared embedding worker. Until it is started, embeddings are computed in-process.
+    """
+    global _embedding_worker
+
+    if _embedding_worker is None or not _embedding_worker.alive:
+        _embedding_worker = EmbeddingWorker(model_name, **kwargs)
+        _embedding_worker.start()
+    return _embedding_worker
+
+
+def embedding_worker():
+    """
+    Returns the shared embedding worker if it is running, else None.
+    """
+    return _embedding_worker if _embedding_worker is not None and _embedding_worker.alive else None
+
+
+def stop_embedding_worker():
+    global _embedding_worker
+
+    if _embedding_worker is not None:
+        _embedding_worker.stop()
+        _embedding_worker = None
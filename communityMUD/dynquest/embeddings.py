@@ -0,0 +1,229 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from twisted.internet.defer import succeed
+
+from dynquest.lore import rss_bytes
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"    # Model used for lore, locations and dialogue
+
+
+class EmbeddingModelRegistry:
+    """
+    Loads each embedding model once, on first use, and shares it with everything on the server.
+
+    Importing this module does not import torch or sentence_transformers; the first get() of a
+    model does (or warm_up(), to take that cost in the background before anyone speaks).
+    Load time and resident memory growth are recorded per model in stats().
+    """
+
+    def __init__(self):
+        self.models = {}
+        self.load_stats = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def get(self, model_name=EMBEDDING_MODEL):
+        """
+        Returns the SentenceTransformer for model_name, loading it if needed. Concurrent
+        callers wait for a single load.
+        """
+        model = self.models.get(model_name)
+        if model is not None:
+            return model
+
+        with self.lock:
+            model_lock = self.locks.setdefault(model_name, threading.Lock())
+
+        with model_lock:
+            if model_name not in self.models:
+                rss_before = rss_bytes()
+                start = time.perf_counter()
+
+                # The first load also pays for importing torch
+                from sentence_transformers import SentenceTransformer
+                self.models[model_name] = SentenceTransformer(model_name)
+                rss_after = rss_bytes()
+
+                self.load_stats[model_name] = {
+                    "seconds": round(time.perf_counter() - start, 3),
+                    "rss_bytes": (rss_after - rss_before) if rss_before is not None else None
+                }
+                print(f"[EmbeddingModels] Loaded {model_name}: {self.load_stats[model_name]}")
+
+        return self.models[model_name]
+
+    def loaded(self, model_name=EMBEDDING_MODEL):
+        return model_name in self.models
+
+    def warm_up(self, model_names=(EMBEDDING_MODEL,)):
+        """
+        Loads models in a background thread.
+
+        Returns:
+            threading.Thread: The started loader thread.
+        """
+        def load():
+            for model_name in model_names:
+                try:
+                    self.get(model_name)
+                except Exception as e:
+                    print(f"[EmbeddingModels] Warm-up of {model_name} failed: {e}")
+
+        thread = threading.Thread(target=load, name="embedding-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def proxy(self, model_name=EMBEDDING_MODEL):
+        """
+        A stand-in for the model that only loads it when one of its attributes is used.
+        """
+        return LazyModel(self, model_name)
+
+    def stats(self):
+        return {name: dict(stats, loaded=True) for name, stats in self.load_stats.items()}
+
+
+class LazyModel:
+    """
+    Module-level handle on a registry model, such as builder.TRANSFORMER: attribute access
+    (encode, ...) is passed to the model, which is loaded on first use.
+    """
+
+    def __init__(self, registry, model_name):
+        self._registry = registry
+        self._model_name = model_name
+
+    def __getattr__(self, name):
+        return getattr(self._registry.get(self._model_name), name)
+
+    def __repr__(self):
+        state = "loaded" if self._registry.loaded(self._model_name) else "not loaded"
+        return f"<LazyModel {self._model_name} ({state})>"
+
+
+EMBEDDING_MODELS = EmbeddingModelRegistry()
+
+
+def normalize_text(text):
+    """
+    Cache key form of a text: lowercased, with whitespace collapsed. The embedding model
+    (all-MiniLM-L6-v2) is uncased, so this does not change the resulting embedding.
+    """
+    return " ".join(str(text).lower().split())
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of text embeddings, shared by everything that encodes text on the game server.
+
+    Entries are keyed on the model name and the normalized text, so repeated phrases skip
+    the transformer entirely. Cached embeddings are read-only float32 arrays.
+
+    Args:
+        max_entries (int): Number of embeddings kept before the least recently used are dropped.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def encode(self, transformer, texts, model_name):
+        """
+        Embeds texts like transformer.encode(texts), encoding only those not already cached.
+
+        Args:
+            transformer (SentenceTransformer): The model to use on a miss.
+            texts (list[str]): Texts to embed.
+            model_name (str): Name of the model, used in the cache key.
+
+        Returns:
+            np.ndarray: One embedding row per text.
+        """
+        keys, found, missing = self.lookup(texts, model_name)
+        if missing:
+            self.store(found, missing, transformer.encode([text for _, text in missing]))
+        return self.assemble(keys, found)
+
+    def encode_async(self, encode_deferred, texts, model_name):
+        """
+        Like encode(), with misses encoded by encode_deferred(texts), which returns a Deferred.
+
+        Returns:
+            Deferred: Fires with one embedding row per text.
+        """
+        keys, found, missing = self.lookup(texts, model_name)
+        if not missing:
+            return succeed(self.assemble(keys, found))
+
+        d = encode_deferred([text for _, text in missing])
+        d.addCallback(lambda encoded: self.store(found, missing, encoded))
+        d.addCallback(lambda _: self.assemble(keys, found))
+        return d
+
+    def lookup(self, texts, model_name):
+        """
+        Returns:
+            tuple: (cache key per text, {key: cached embedding}, [keys to encode])
+        """
+        keys = [(model_name, normalize_text(text)) for text in texts]
+        found = {}
+        missing = []
+
+        with self.lock:
+            for key in keys:
+                if key in found:
+                    continue
+                embedding = self.entries.get(key)
+                if embedding is None:
+                    if key not in missing:
+                        missing.append(key)
+                else:
+                    self.entries.move_to_end(key)
+                    found[key] = embedding
+
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        return keys, found, missing
+
+    def store(self, found, missing, encoded):
+        encoded = np.asarray(encoded, dtype=np.float32)
+
+        with self.lock:
+            for key, embedding in zip(missing, encoded):
+                embedding = embedding.copy()
+                embedding.flags.writeable = False
+                found[key] = embedding
+                self.entries[key] = embedding
+                self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    @staticmethod
+    def assemble(keys, found):
+        return np.vstack([found[key] for key in keys]) if keys else np.empty((0, 0), dtype=np.float32)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+EMBEDDING_CACHE = EmbeddingCache()
@@ -2,20 +2,179 @@ import subprocess
 from typeclasses.characters import Character
 import traceback
 import json
-import numpy as np
+import random
 import requests
 import re
+import threading
+import time
+from collections import deque
+from requests.adapters import HTTPAdapter
+from twisted.internet import reactor, threads
+from twisted.internet.defer import DeferredList, succeed
+from dynquest.breaker import CircuitBreaker
+from dynquest.classifier import QUEST_CLASSIFIER
 from dynquest.helpers import QuestEval
-from dynquest.builder import TRANSFORMER
-from evennia.utils.logger import log_info
+from dynquest.semantic_cache import SEMANTIC_CACHE
+from dynquest.lore import GLOBAL_PARTITION, LoreIndex, load_lore_store, lore_store_exists, measure_load
+from dynquest.builder import embed, embed_async
+from evennia.utils.logger import log_info, log_trace
+from evennia.utils.utils import delay
+
+# The spoken part of a heard line, e.g. 'Player says, "Hello there!"'
+SPEECH_PATTERN = re.compile(r"""\bsays?,\s*["'](.*)["']\s*$""", re.DOTALL)
+# A bare greeting: the greeting, then at most a few words of address and closing punctuation.
+# Anything more (or a question mark) is conversation, even if it opens with a greeting.
+GREETING_PATTERN = re.compile(
+    r"^\W*(hi|hello|hey|hiya|howdy|greetings|salutations|hail|well met|good (morning|afternoon|evening|day)|morning|evening)"
+    r"(?P<address>(\W+[\w'-]+){0,4})[\s.!,]*$",
+    re.IGNORECASE
+)
+# Words that may follow a greeting as a form of address, besides the NPC's own name
+GREETING_ADDRESS_WORDS = {
+    "there", "to", "you", "all", "everyone", "again", "friend", "my", "good", "sir", "madam", "ma'am",
+    "master", "mistress", "lord", "lady", "traveler", "traveller", "stranger", "folks"
+}
+
+# One keep-alive connection pool to the LLM service, shared by every GenPC (see model_session()).
+_model_session = None
+_model_session_lock = threading.Lock()
+
+
+def model_session():
+    """
+    Returns the shared HTTP session for LLM service calls, creating it on first use.
+
+    Connections are kept alive and reused, and there are never more than the pool size: a call
+    made while all of them are busy waits for one. By default the pool has a connection per
+    reactor pool thread. Every LLM call runs on one of those threads (deferToThread), so a call
+    never waits for a connection and the count stays bounded.
+    """
+    global _model_session
+
+    with _model_session_lock:
+        if _model_session is None:
+            session = requests.Session()
+            size = GenPC.MODEL_POOL_SIZE or reactor.getThreadPool().max
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size, pool_block=True)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _model_session = session
+
+    return _model_session
+
+
+def model_service_healthy():
+    """
+    Health probe for the model breaker: a cheap GET that does not touch the model.
+    """
+    response = model_session().get(GenPC.MODEL_HEALTH_URL, timeout=(GenPC.MODEL_CONNECT_TIMEOUT, GenPC.BREAKER_PROBE_TIMEOUT))
+    return response.ok and response.json().get("status") == "ok"
+
+
+# Circuit breaker shared by every GenPC (see model_breaker()).
+_model_breaker = None
+
+
+def model_breaker():
+    """
+    Returns the shared circuit breaker for LLM service calls, creating it on first use.
+
+    After repeated failed or slow calls it opens, and NPCs answer with canned lines at once
+    instead of each waiting out the timeouts, until a health probe finds the service back.
+    """
+    global _model_breaker
+
+    with _model_session_lock:
+        if _model_breaker is None:
+            _model_breaker = CircuitBreaker(
+                probe=model_service_healthy,
+                failure_threshold=GenPC.BREAKER_FAILURES,
+                slow_call_seconds=GenPC.BREAKER_SLOW_CALL,
+                cooldown=GenPC.BREAKER_COOLDOWN
+            )
+
+    return _model_breaker
+
+
+class ModelServiceBusy(Exception):
+    """
+    The LLM service refused a request because it is at capacity (HTTP 429).
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f"LLM service busy; retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def check_model_response(response, back_off=True):
+    """
+    Raises for an unsuccessful LLM service response. A 429 refusal raises ModelServiceBusy; for
+    dialogue (back_off), the shared breaker also refuses calls for the service's Retry-After, so
+    other NPCs fall back at once instead of asking again.
+    """
+    if response.status_code == 429:
+        try:
+            retry_after = float(response.headers.get("Retry-After", 1))
+        except ValueError:
+            retry_after = 1.0
+        if back_off:
+            model_breaker().back_off(min(retry_after, GenPC.MODEL_MAX_BACK_OFF))
+        raise ModelServiceBusy(retry_after)
+
+    response.raise_for_status()
+
 
 class GenPC(Character):
     """
     A simple NPC that generates responses using a local LLM.
     """
     MODEL_URL = "http://127.0.0.1:8000/generate"            # URL for local LLM
-    MODEL_TIMEOUT = 45                                      # Timeout for remote LLM in seconds
+    MODEL_STREAM_URL = "http://127.0.0.1:8000/generate/stream"  # Streaming (server-sent events) variant
+    MODEL_TIMEOUT = 45                                      # Deadline for a remote LLM response in seconds
+    MODEL_CONNECT_TIMEOUT = 3                               # Seconds to establish a connection to the LLM service
+    MODEL_READ_TIMEOUT = 45                                 # Seconds to wait for the next bytes of a response
+    MODEL_POOL_SIZE = None                                  # Most connections to the LLM service, shared by all GenPCs (None: one per reactor pool thread)
+    MODEL_MAX_BACK_OFF = 30                                 # Most seconds to stop calling a busy LLM service (429 Retry-After)
+    MODEL_HEALTH_URL = "http://127.0.0.1:8000/health"       # Cheap liveness check used to close the circuit breaker
+
+    BREAKER_FAILURES = 3                                    # Failed or slow calls (of the last 10) that open the circuit breaker
+    BREAKER_SLOW_CALL = 20                                  # Seconds to first sentence above which a reply counts as failed
+    BREAKER_COOLDOWN = 10                                   # Seconds between health probes while the breaker is open
+    BREAKER_PROBE_TIMEOUT = 2                               # Read timeout of a health probe
+
+    SEMANTIC_CACHE_ENABLED = True                           # Reuse answers to paraphrased questions (see SEMANTIC_CACHE)
+    OUT_OF_CHARACTER_LINE = "I'm afraid I can't speak on such matters."    # Said instead of out-of-character text
+
+    # In-character lines for when the LLM service is unavailable, if the NPC has no db.dialogue of its own
+    FALLBACK_LINES = [
+        "Hm. Give me a moment, my thoughts are elsewhere.",
+        "I've nothing to say on that just now.",
+        "Ask me again later, friend."
+    ]
         
+    LORE_STORE = "./world/severed_realms_embeddings"        # Binary lore store (.npy matrix + .meta.json)
+    LORE_JSON = "./world/severed_realms_embeddings.json"    # Legacy JSON lore file, used if there is no store
+
+    LORE_INCLUDE_GLOBAL = True                              # Also search lore not tied to any realm
+    HISTORY_FLUSH_INTERVAL = 60                             # Seconds between saving changed conversation history
+    HISTORY_PROMPT_TURNS = 6                                # Most recent turns with the speaker included in a prompt
+    COALESCE_WINDOW = 1.5                                   # Seconds to gather more utterances into one reply (0: reply at once); per NPC in db.coalesce_window
+
+    LINE_POOL_SIZE = 4                                      # Pre-generated lines kept per pool
+    LINE_POOL_TTL = 1800                                    # Seconds before a pool of pre-generated lines is regenerated
+    LINE_POOL_QUIET_PERIOD = 60                             # Seconds without hearing anyone before pools are refilled
+    LINE_POOL_ACTIVE_PERIOD = 1800                          # Pools are kept up for NPCs spoken to this recently (or with players present)
+    LINE_POOL_STAGGER = 120                                 # Up to this many extra seconds before a loaded NPC's first refresh
+    LINE_POOL_PRIORITY = 5                                  # Queue priority of pool requests: after dialogue, before quests
+
+    # Prompts for the pools of pre-generated lines, keyed by pool
+    LINE_POOL_PROMPTS = {
+        "greeting": "A traveler has just greeted you. Write {count} different short ways you might greet them back, "
+                    "one per line, each a single sentence.",
+        "idle": "Write {count} different short remarks you might make aloud to nobody in particular while you wait, "
+                "one per line, each a single sentence."
+    }
+
     lore_data = None
        
 
@@ -23,13 +182,64 @@ class GenPC(Character):
         """Set up defaults when NPC is created."""
         self.db.max_history = 10
         self.db.persona = "a grizzled railroad ticket-taker from the early 1900s"
-        self.db.conversation_history = []
+        self.db.conversation_turns = {}
         self.db.quest_giver = False
         return super().at_object_creation()
     
     def at_init(self):
+        # NPCs are loaded together at startup: spread their first refreshes out
+        if self.wants_line_pools():
+            self.schedule_pool_refresh(stagger=True)
         return super().at_init()
- 
+
+    def at_server_reload(self):
+        self.flush_history()
+        return super().at_server_reload()
+
+    def at_server_shutdown(self):
+        self.flush_history()
+        return super().at_server_shutdown()
+
+    def recent_turns(self, speaker):
+        """Copies of the last HISTORY_PROMPT_TURNS turns with a speaker, as sent in a prompt."""
+        return [dict(turn) for turn in list(self.conversation_turns(speaker))[-GenPC.HISTORY_PROMPT_TURNS:]]
+
+    def conversation_turns(self, speaker):
+        """
+        The in-memory turn buffer for one speaker: a deque of the last db.max_history
+        {"role", "content"} records, loaded from db.conversation_turns on first use.
+        """
+        if self.ndb.conversation_turns is None:
+            saved = self.db.conversation_turns or {}
+            self.ndb.conversation_turns = {
+                key: deque((dict(turn) for turn in turns), maxlen=self.db.max_history) for key, turns in saved.items()
+            }
+
+        turns = self.ndb.conversation_turns.get(speaker)
+        if turns is None:
+            turns = self.ndb.conversation_turns[speaker] = deque(maxlen=self.db.max_history)
+        return turns
+
+    def remember_turn(self, speaker, role, content):
+        """
+        Records a turn in memory only; flush_history() saves it later, so dialogue never waits on a DB write.
+        """
+        self.conversation_turns(speaker).append({"role": role, "content": content})
+
+        if not self.ndb.history_flush_pending:
+            self.ndb.history_flush_pending = True
+            delay(GenPC.HISTORY_FLUSH_INTERVAL, self.flush_history)
+
+    def flush_history(self):
+        """
+        Saves the in-memory conversation turns to db.conversation_turns if any changed since the last flush.
+        """
+        if not self.ndb.history_flush_pending:
+            return
+
+        self.ndb.history_flush_pending = False
+        self.db.conversation_turns = {speaker: list(turns) for speaker, turns in self.ndb.conversation_turns.items()}
+
 
     def msg(self, text, from_obj=None, **kwargs):
         "Custom msg() method reacting to say."
@@ -44,15 +254,24 @@ class GenPC(Character):
             if is_say:
                 self.at_heard_say(say_text, from_obj, **kwargs)
 
-    def was_quest(self, dq: QuestEval):
+    @staticmethod
+    def seems_quest_like(dq: QuestEval):
+        """
+        Decides whether a response is worth a quest extraction (see QuestClassifier).
+        Embeds in the calling thread; on the reactor use QUEST_CLASSIFIER.is_quest_async.
+        """
+        return QUEST_CLASSIFIER.is_quest(dq.text)
+
+    def was_quest(self, dq: QuestEval, persona=None):
         """
-        If the response seems quest-like, attempt to analyze it and create a persistable QuestEntry.
+        If the response seems quest-like, attempt to analyze it and return the extracted quest.
+        Blocks on the LLM; dialogue uses at_quest_response, which queues the analysis instead.
         """
         log_info(f"[QuestAnalysis] Analyzing response: {dq}")
 
-        if dq.is_quest_worthy() and dq.quest_confidence_score() >= 2:
+        if GenPC.seems_quest_like(dq):
             log_info("[QuestAnalysis] Prompting for quest design.")
-            quest = self.analyze_response_for_quest(dq.text)
+            quest = self.analyze_response_for_quest(dq.text, persona=persona)
         else:
             log_info("[QuestAnalysis] Skipped: not quest-worthy.")
             return None
@@ -61,170 +280,638 @@ class GenPC(Character):
             
     def at_quest_response(self, response, from_obj):
         """
-        Check to see if the response seems quest-like, and if so, persist it.
+        Check to see if the response seems quest-like, and if so, queue it for quest analysis.
+
+        The extraction itself runs later in QuestAnalysisScript, so a quest giver replies as fast
+        as any other NPC. The response is classified with embeddings computed off the reactor.
+
+        Returns:
+            Deferred: Fires with the queued "analyzing" QuestEntry, or None if the response is
+                not quest-like.
         """
-        try:
-            dq = QuestEval(response)
-            quest = self.was_quest(dq)
-            if quest:
-                dq.persist_generated_quest(quest, player=from_obj)
-                log_info(f"Successfully persisted quest: {quest}")
-            else:
-                log_info(f"Received a non-questy response: {response}")
-        except Exception as e:
-            traceback.print_exc()
-            log_info(f"Failed to persist quest Response: {response} Quest: {quest}: {e} ")
+        d = QUEST_CLASSIFIER.is_quest_async(response)
+        d.addCallback(self.queue_quest_response, response, from_obj)
+        d.addErrback(lambda failure: log_trace(f"Failed to classify response: {response}"))
+        return d
+
+    def queue_quest_response(self, is_quest, response, from_obj):
+        """
+        Continues at_quest_response() once the response is classified.
+        """
+        # Imported here: dynquest.analysis uses this module's model breaker
+        from dynquest.analysis import analysis_script
+
+        if not is_quest:
+            log_info(f"Received a non-questy response: {response}")
+            return None
+
+        dq = QuestEval(response)
+        entry = dq.queue_analysis(player=from_obj, persona=self.db.persona, npc=self)
+        log_info(f"[QuestAnalysis] Queued {entry.quest_id} for analysis: {response}")
+
+        script = analysis_script()
+        if script:
+            script.drain()
+        else:
+            log_info("[QuestAnalysis] Could not create quest_analysis_script; the quest will wait in the queue.")
+
+        return entry
 
 
     def at_heard_say(self, message, from_obj=None, **kwargs):
         """
         Called when someone speaks in the room.
+
+        Utterances are gathered for the NPC's coalescing window (see coalesce_window) and for
+        as long as a reply is still being generated, and answered together in a single reply.
+
+        The LLM round trip runs in a worker thread so the reactor keeps serving other players.
+        Replies are chained per NPC: new utterances are only sent to the model once the previous
+        reply has been fully said and recorded, so replies come out in the order they were heard.
         """
         print(f"Heard: {message} from {from_obj}")
 
         if from_obj and from_obj != self:
-            response = self.generate_response_remote(message)
-
-            if response:
-                # Update conversation history
-                if self.db.conversation_history is None:
-                    self.db.conversation_history = []
-
-                self.db.conversation_history = self.db.conversation_history[-self.db.max_history:]
-                self.db.conversation_history.append(f"{message}")
-                self.db.conversation_history.append(f"You replied: '{response}'")                
-                self.execute_cmd(f"say {response}", msg_obj=self)
-                
-                if self.db.quest_giver:
-                    self.at_quest_response(response, from_obj.account)
-            else:
-                self.execute_cmd("emote rubs their chin thoughtfully, but says nothing.")
+            self.ndb.last_heard = time.time()
+            self.schedule_pool_refresh()
+
+            # A pooled greeting is said at once, so only while no reply is pending: it must not
+            # overtake the model's reply to something said earlier
+            greetings = self.line_pool("greeting")
+            if greetings and not self.reply_pending() and GenPC.is_greeting(message, names=[self.key, *self.aliases.all()]):
+                return self.answer_from_pool(message, from_obj, random.choice(greetings))
+
+            window = self.coalesce_window(from_obj)
+            if self.ndb.pending_utterances is None:
+                self.ndb.pending_utterances = []
+            self.ndb.pending_utterances.append((message, from_obj))
+
+            if window <= 0:
+                return self.queue_reply()
+
+            if not self.ndb.reply_scheduled:
+                self.ndb.reply_scheduled = True
+                delay(window, self.queue_reply)
         else:
             print(f"I don't respond to {from_obj}.")
 
+    def coalesce_window(self, speaker=None):
+        """
+        Seconds to wait for more utterances before replying to the speaker: db.coalesce_window,
+        or COALESCE_WINDOW if unset. No wait if nothing else is pending and no one else who could
+        speak (a character with an account) is in the room, as for a player talking to the NPC alone.
+        """
+        window = self.db.coalesce_window
+        if window is None:
+            window = GenPC.COALESCE_WINDOW
+        if window <= 0 or self.reply_pending():
+            return window
+
+        others = [obj for obj in (self.location.contents if self.location else [])
+                  if obj not in (self, speaker) and obj.has_account]
+        return window if others else 0
+
+    def queue_reply(self):
+        """
+        Adds a reply to everything heard so far to this NPC's reply chain.
+
+        Returns:
+            Deferred: The reply chain.
+        """
+        self.ndb.reply_scheduled = False
+
+        chain = self.ndb.reply_chain
+        if chain is None:
+            chain = succeed(None)
+
+        self.ndb.replies_queued = (self.ndb.replies_queued or 0) + 1
+        chain.addCallback(lambda _: self.reply_to_pending())
+        chain.addErrback(lambda failure: log_trace("Failed to reply to heard utterances"))
+        chain.addBoth(self.at_reply_dequeued)
+        self.ndb.reply_chain = chain
+        return chain
+
+    def at_reply_dequeued(self, result):
+        self.ndb.replies_queued = max(0, (self.ndb.replies_queued or 0) - 1)
+        return result
+
+    def reply_pending(self):
+        """
+        True while something heard is waiting to be answered, or its reply is still being generated.
+        """
+        return bool(self.ndb.pending_utterances or self.ndb.reply_scheduled or self.ndb.replies_queued)
+
+    def reply_to_pending(self):
+        """
+        Takes every utterance heard since the last reply started, and starts one reply to all of them.
+        """
+        utterances = self.ndb.pending_utterances or []
+        self.ndb.pending_utterances = []
+
+        if utterances:
+            return self.reply_async(utterances)
+
+    @staticmethod
+    def merge_utterances(utterances):
+        """
+        Combines (message, speaker) pairs into one prompt message, asking for an answer to each speaker.
+        """
+        if len(utterances) == 1:
+            return utterances[0][0]
+
+        names = list(dict.fromkeys(speaker.key for _, speaker in utterances))
+        lines = "\n".join(message for message, _ in utterances)
+        return f"{', '.join(names)} speak to you at the same time. Answer each of them, by name:\n{lines}"
+
+    def reply_async(self, utterances):
+        """
+        Starts one reply: the request is built here (it reads the NPC's attributes), then
+        streamed and spoken from a worker thread.
+
+        Args:
+            utterances (list): (message, speaker) pairs to answer together. The conversation
+                history included in the prompt is that of the first speaker.
+
+        Returns:
+            Deferred: Fires after the reply has been said and added to the conversation history.
+        """
+        fallback = self.fallback_line()
+
+        if not model_breaker().allow():
+            # The LLM service is down: answer at once, and keep canned lines out of the history
+            self.execute_cmd(f"say {fallback}", msg_obj=self)
+            return succeed(fallback)
+
+        # Embed the message (for lore) and, for a single utterance, its spoken part (for the
+        # semantic cache) in the embedding worker, off the reactor.
+        message = GenPC.merge_utterances(utterances)
+        texts = [message]
+        if GenPC.SEMANTIC_CACHE_ENABLED and len(utterances) == 1:
+            texts.append(GenPC.spoken_text(message))
+
+        d = embed_async(texts)
+        d.addErrback(lambda failure: log_trace(f"Failed to embed utterance: {message}"))
+        d.addCallback(self.reply_with_embeddings, utterances, message, fallback)
+        return d
+
+    def reply_with_embeddings(self, embeddings, utterances, message, fallback):
+        """
+        Continues reply_async() once the message is embedded: retrieves lore, then answers from
+        the semantic cache or starts the LLM call.
+
+        Args:
+            embeddings: Rows for the message and (for a single utterance) its spoken part, or
+                None if embedding failed, in which case the reply goes without lore rather than
+                embedding on the reactor.
+        """
+        lore = self.get_relevant_lore(message, query_embedding=embeddings[0]) if embeddings is not None else ""
+
+        # A single question may have been answered already, in other words
+        question = embeddings[1] if embeddings is not None and len(embeddings) > 1 else None
+        if question is not None:
+            turns = self.recent_turns(GenPC.speaker_key(utterances[0][1]))
+            cached = SEMANTIC_CACHE.lookup(self.db.persona, question, lore, turns)
+            if cached:
+                log_info(f"[SemanticCache] {self.key} reused an answer: {SEMANTIC_CACHE.stats()}")
+                self.execute_cmd(f"say {cached}", msg_obj=self)
+                self.at_reply_complete(cached, utterances, cached=True)
+                return cached
+
+        request = self.npc_request(message, speaker=GenPC.speaker_key(utterances[0][1]), lore=lore)
+        d = threads.deferToThread(self.say_streamed_response, request, fallback)
+        if question is not None:
+            d.addCallback(self.cache_answer, question, lore, fallback, turns)
+        d.addCallback(self.at_reply_complete, utterances)
+        return d
+
+    def cache_answer(self, response, question, lore, fallback, turns=()):
+        """
+        Stores a generated answer in the semantic cache; canned and refusal lines are not stored.
+
+        Args:
+            turns (list[dict]): The conversation turns the answer was generated with.
+        """
+        if response and response not in (fallback, GenPC.OUT_OF_CHARACTER_LINE):
+            SEMANTIC_CACHE.put(self.db.persona, question, lore, response, turns)
+        return response
+
+    def fallback_line(self):
+        """
+        A canned in-character line, from the NPC's own db.dialogue if it has any, else its idle lines.
+        """
+        return random.choice(self.db.dialogue or self.line_pool("idle") or GenPC.FALLBACK_LINES)
+
+    @staticmethod
+    def spoken_text(message):
+        """The spoken part of a heard line: 'Hello there!' from 'Player says, "Hello there!"'."""
+        match = SPEECH_PATTERN.search(message)
+        return match.group(1) if match else message
+
+    @staticmethod
+    def is_greeting(message, names=()):
+        """
+        True if the spoken part of a heard line is a bare greeting, such as "Well met!" or
+        "Hello there, Storyteller." Greetings with a question or anything else to say go to the LLM.
+
+        Args:
+            names (list[str]): Names the NPC may be addressed by.
+        """
+        match = GREETING_PATTERN.match(GenPC.spoken_text(message))
+        if not match:
+            return False
+
+        allowed = GREETING_ADDRESS_WORDS | {word.lower() for name in names for word in name.split()}
+        return all(word.lower() in allowed for word in re.findall(r"[\w'-]+", match.group("address")))
+
+    def answer_from_pool(self, message, from_obj, line):
+        """
+        Answers at once with a pre-generated line, recording it like any other reply.
+        """
+        self.execute_cmd(f"say {line}", msg_obj=self)
+        speaker = GenPC.speaker_key(from_obj)
+        self.remember_turn(speaker, "user", message)
+        self.remember_turn(speaker, "assistant", line)
+        return line
+
+    def line_pool(self, kind):
+        """
+        The pre-generated lines of a pool ("greeting" or "idle"), or an empty list if it is
+        empty or older than LINE_POOL_TTL.
+        """
+        pool = (self.db.line_pools or {}).get(kind)
+        if not pool or time.time() - pool["generated"] > GenPC.LINE_POOL_TTL:
+            return []
+        return list(pool["lines"])
+
+    def wants_line_pools(self):
+        """
+        True if someone is likely to talk to the NPC soon: it was spoken to within
+        LINE_POOL_ACTIVE_PERIOD seconds, or a player is in its room.
+        """
+        if time.time() - (self.ndb.last_heard or 0) < GenPC.LINE_POOL_ACTIVE_PERIOD:
+            return True
+        return bool(self.location) and any(obj.has_account for obj in self.location.contents if obj != self)
+
+    def schedule_pool_refresh(self, stagger=False):
+        if not self.ndb.pool_refresh_scheduled:
+            self.ndb.pool_refresh_scheduled = True
+            wait = GenPC.LINE_POOL_QUIET_PERIOD + (random.uniform(0, GenPC.LINE_POOL_STAGGER) if stagger else 0)
+            delay(wait, self.refresh_line_pools)
+
+    def refresh_line_pools(self):
+        """
+        Regenerates empty or expired line pools, once nobody has spoken to the NPC for
+        LINE_POOL_QUIET_PERIOD seconds, then checks again after another quiet period.
+        Nothing is regenerated while the model breaker refuses calls, including while the
+        service has asked callers to back off.
+
+        Only NPCs that want pools (see wants_line_pools) are refreshed. For the others the
+        checks stop until someone speaks to them again.
+
+        Returns:
+            list[Deferred]: One per pool being regenerated.
+        """
+        self.ndb.pool_refresh_scheduled = False
+        if not self.wants_line_pools():
+            return []
+        self.schedule_pool_refresh()
+
+        quiet = time.time() - (self.ndb.last_heard or 0) >= GenPC.LINE_POOL_QUIET_PERIOD
+        if not quiet or self.ndb.pools_refreshing or not model_breaker().allow():
+            return []
+
+        stale = [kind for kind in GenPC.LINE_POOL_PROMPTS if not self.line_pool(kind)]
+        if not stale:
+            return []
+
+        self.ndb.pools_refreshing = True
+        persona = self.db.persona
+        refreshes = []
+
+        for kind in stale:
+            d = threads.deferToThread(self.generate_line_pool, kind, persona)
+            d.addCallback(self.store_line_pool, kind)
+            d.addErrback(lambda failure, kind=kind: log_trace(f"Failed to generate {kind} lines for {self.key}"))
+            refreshes.append(d)
+
+        def done(_):
+            self.ndb.pools_refreshing = False
+
+        DeferredList(refreshes).addBoth(done)
+        return refreshes
+
+    def generate_line_pool(self, kind, persona):
+        """
+        Asks the LLM for a pool of lines in one request. Runs in a worker thread.
+
+        Returns:
+            list[str]: Up to LINE_POOL_SIZE lines.
+        """
+        breaker = model_breaker()
+        start = time.monotonic()
+
+        try:
+            response = model_session().post(
+                GenPC.MODEL_URL,
+                json={
+                    "mode": "lines",
+                    "persona": persona,
+                    "messages": [{"role": "user", "content": GenPC.LINE_POOL_PROMPTS[kind].format(count=GenPC.LINE_POOL_SIZE)}],
+                    "max_tokens": 200,
+                    "temp": 0.9,
+                    "priority": GenPC.LINE_POOL_PRIORITY,
+                    "deadline": time.time() + GenPC.MODEL_TIMEOUT
+                },
+                timeout=(GenPC.MODEL_CONNECT_TIMEOUT, GenPC.MODEL_READ_TIMEOUT)
+            )
+            # Background work: a refused pool request must not hold up player dialogue
+            check_model_response(response, back_off=False)
+        except ModelServiceBusy:
+            raise
+        except Exception:
+            breaker.record_failure(time.monotonic() - start)
+            raise
+
+        breaker.record_success()
+        return GenPC.parse_pool_lines(response.json().get("response", ""), GenPC.LINE_POOL_SIZE)
+
+    @staticmethod
+    def parse_pool_lines(text, count):
+        """
+        Splits a generated list into clean lines: numbering, bullets and quotes are removed,
+        and duplicate or out-of-character lines dropped.
+        """
+        lines = []
+        for line in text.splitlines():
+            line = re.sub(r"^\s*(\d+[.)]|[-*\u2022])\s*", "", line).strip().strip('"\u201c\u201d').strip()
+            if line and line not in lines and not GenPC.is_out_of_character(line):
+                lines.append(line)
+        return lines[:count]
+
+    def store_line_pool(self, lines, kind):
+        if not lines:
+            return
+        pools = dict(self.db.line_pools or {})
+        pools[kind] = {"lines": lines, "generated": time.time()}
+        self.db.line_pools = pools
+
+    def at_reply_complete(self, response, utterances, cached=False):
+        """
+        Called on the reactor thread with everything the NPC said in reply to the utterances.
+        Each speaker's history records their own message(s) and the shared reply.
+
+        Args:
+            cached (bool): The reply came from the semantic cache, so it was already analyzed for quests.
+        """
+        if response:
+            speakers = {}
+            for message, from_obj in utterances:
+                speakers.setdefault(GenPC.speaker_key(from_obj), from_obj)
+                self.remember_turn(GenPC.speaker_key(from_obj), "user", message)
+
+            for speaker in speakers:
+                self.remember_turn(speaker, "assistant", response)
+
+            if self.db.quest_giver and not cached:
+                self.at_quest_response(response, utterances[0][1].account)
+        else:
+            self.execute_cmd("emote rubs their chin thoughtfully, but says nothing.")
+
 
     def load_lore_data(self):
         """
-        Loads lore data from a file if it hasn't been loaded yet.
+        Loads the lore index if it hasn't been loaded yet: the memory-mapped binary store if
+        present, otherwise the legacy JSON file (see dynquest.lore for converting it).
 
         Returns:
-            list: A list of objects with keys 'content' and 'embedding'
+            LoreIndex: The lore snippets and their embeddings, or None if no lore could be loaded.
         """
         try:
-            if not GenPC.lore_data:
-                # Load JSON and extract embeddings with their corresponding lore content
-                with open("./world/severed_realms_embeddings.json", "r", encoding="utf-8") as f:
-                    GenPC.lore_data = json.load(f)
+            if GenPC.lore_data is None:
+                if lore_store_exists(GenPC.LORE_STORE):
+                    GenPC.lore_data, seconds, rss = measure_load(load_lore_store, GenPC.LORE_STORE)
+                else:
+                    print(f"No lore store at {GenPC.LORE_STORE}; loading {GenPC.LORE_JSON}")
+                    GenPC.lore_data, seconds, rss = measure_load(self.load_lore_json)
+
+                rss_text = f", RSS +{rss / 1024 / 1024:.1f} MiB" if rss is not None else ""
+                log_info(f"Loaded {len(GenPC.lore_data)} lore snippets in {seconds * 1000:.1f} ms{rss_text}")
 
-            if not isinstance(GenPC.lore_data, list):
-                raise ValueError("Unexpected JSON structure: Expected a list of objects.")
-            
             return GenPC.lore_data
         except Exception as e:
             print(f"Error in loading lore data: {e}")
             traceback.print_exc()
             return None
 
+    def load_lore_json(self):
+        with open(GenPC.LORE_JSON, "r", encoding="utf-8") as f:
+            data = json.load(f)
 
-    def get_relevant_lore(self, message, top_n=3):
-        try:
-            data = self.load_lore_data()
+        if not isinstance(data, list):
+            raise ValueError("Unexpected JSON structure: Expected a list of objects.")
 
-            # Extract embeddings and lore content
-            embeddings = []
-            lore_chunks = []
-            
-            for entry in data: # type: ignore
-                if "content" in entry and "embedding" in entry:
-                    lore_chunks.append(entry["content"])
-                    embeddings.append(np.array(entry["embedding"]))
-                else:
-                    raise ValueError("Missing 'content' or 'embedding' in an entry.")
+        return LoreIndex.from_entries(data)
 
-            if len(embeddings) != len(lore_chunks):
-                raise ValueError("Mismatch between embeddings and lore content count.")
+    def lore_partitions(self):
+        """
+        The lore partitions this NPC draws on: its room's realm (db.realm), plus global lore
+        if LORE_INCLUDE_GLOBAL is set. None (search all lore) if the room has no realm.
+        """
+        realm = self.location.db.realm if self.location else None
+        if not realm:
+            return None
 
-            # Convert to numpy array for batch operations
-            embeddings = np.vstack(embeddings)  
+        return [realm, GLOBAL_PARTITION] if GenPC.LORE_INCLUDE_GLOBAL else [realm]
 
-            # Generate query embedding
-            query_embedding = TRANSFORMER.encode([message])[0]
+    def get_relevant_lore(self, message, top_n=3, query_embedding=None):
+        """
+        Returns the lore snippets most similar to the message, from the NPC's realm partitions.
 
-            # Compute cosine similarity
-            query_norm = np.linalg.norm(query_embedding)
-            similarities = [
-                (i, np.dot(query_embedding, embed) / (query_norm * np.linalg.norm(embed)))
-                for i, embed in enumerate(embeddings)
-            ]
+        Args:
+            query_embedding (array-like, optional): The message's embedding, if already computed.
+                Without it the message is embedded in the calling thread, so pass it on the reactor.
+        """
+        try:
+            index = self.load_lore_data()
+            if index is None:
+                return ""
 
-            # Sort by similarity score in descending order
-            similarities.sort(key=lambda x: x[1], reverse=True)
-            top_chunks = [lore_chunks[i] for i, _ in similarities[:top_n]]
+            # Generate query embedding
+            if query_embedding is None:
+                query_embedding = embed([message])[0]
+            top_chunks = index.top_contents(query_embedding, top_n, partitions=self.lore_partitions())
 
             # print(f"Top {top_n} chunks: {top_chunks}")
 
-            return "\n".join(top_chunks)
+            # One snippet per line: the service drops whole lines when the prompt budget is tight
+            return "\n".join(" ".join(chunk.split()) for chunk in top_chunks)
 
         except Exception as e:
             print(f"Error in get_relevant_lore: {e}")
             return ""
 
-    def generate_response_remote(self, message):
+    def say_sentence(self, sentence):
+        """
+        Says one sentence of a reply. Safe to call from a worker thread: the command runs on the reactor.
+        """
+        reactor.callFromThread(self.execute_cmd, f"say {sentence}", msg_obj=self)
+
+    def say_streamed_response(self, request, fallback="I do not have an answer right now."):
+        """
+        Streams a response from the LLM and says each sentence to the room as soon as it is complete.
+        Runs in a worker thread (see reply_async).
+
+        The time to the first sentence, or the failure, is recorded with the model breaker.
+
+        Args:
+            fallback (str): What to say if the call fails before anything was said.
+
+        Returns:
+            str: Everything that was said, or an empty string if the NPC said nothing.
+        """
+        said = []
+        breaker = model_breaker()
+        start = time.monotonic()
+
         try:
-            # Prepare chat-style messages
-            chat_history = []
-
-            # System persona and role
-            chat_history.append({
-                "role": "system",
-                "content": f"Lore elements: {self.get_relevant_lore(message)}"
-            })
-
-            # Add conversation history as user/assistant turns
-            if self.db.conversation_history is None:
-                self.db.conversation_history = []
-
-            for line in self.db.conversation_history[-6:]:
-                if line.startswith("You replied:"):
-                    chat_history.append({
-                        "role": "assistant",
-                        "content": line
-                    })
-                elif " said '" in line:
-                    chat_history.append({
-                        "role": "user",
-                        "content": line
-                    })
-
-            # Current message from the player
-            chat_history.append({"role": "user", "content": message})
+            for sentence in self.stream_response_remote(request):
+                if not said:
+                    breaker.record_success(time.monotonic() - start)
+
+                if GenPC.is_out_of_character(sentence):
+                    sentence = GenPC.OUT_OF_CHARACTER_LINE
+                    self.say_sentence(sentence)
+                    said.append(sentence)
+                    break
+
+                self.say_sentence(sentence)
+                said.append(sentence)
+
+        except ModelServiceBusy as e:
+            print(f"LLM streaming call refused: {e}")
+            self.say_sentence(fallback)
+            said.append(fallback)
+
+        except Exception as e:
+            print(f"LLM streaming call failed: {e}")
+            traceback.print_exc()
+            if not said:
+                breaker.record_failure(time.monotonic() - start)
+                self.say_sentence(fallback)
+                said.append(fallback)
+
+        return " ".join(said)
+
+    def stream_response_remote(self, request):
+        """
+        Requests a streamed response from the LLM service.
 
+        Args:
+            request (dict): The request body, as built by npc_request().
+
+        Yields:
+            str: Post-processed sentences of the response, in order, as the service produces them.
+        """
+        with model_session().post(
+            GenPC.MODEL_STREAM_URL,
+            json=request,
+            timeout=(GenPC.MODEL_CONNECT_TIMEOUT, GenPC.MODEL_READ_TIMEOUT),
+            stream=True
+        ) as response:
+            check_model_response(response)
+
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                if not line or not line.startswith("data: "):
+                    continue
+
+                event = json.loads(line[len("data: "):])
+                if event.get("error"):
+                    raise RuntimeError(event["error"])
+                if event.get("text"):
+                    yield event["text"]
+                if event.get("done"):
+                    return
+
+    @staticmethod
+    def is_out_of_character(response):
+        return any(x in response.lower() for x in ["out of character", "as an ai", "grouplayout", "ai assistant"])
+
+    @staticmethod
+    def speaker_key(speaker):
+        """Key of a speaker's conversation turn buffer."""
+        return speaker.dbref if speaker else ""
+
+    def npc_request(self, message, speaker="", lore=None):
+        """
+        Builds the /generate request body for dialogue: lore, recent conversation with the
+        speaker (see speaker_key) and the player's message. The service fits them to its prompt
+        token budget, dropping lore before turns, and older turns before newer ones.
+
+        Args:
+            lore (str, optional): Lore already retrieved for the message, one snippet per line.
+        """
+        if lore is None:
+            lore = self.get_relevant_lore(message)
+
+        # Prepare chat-style messages
+        chat_history = []
+
+        # Add conversation history as user/assistant turns
+        chat_history.extend(self.recent_turns(speaker))
+
+        # Current message from the player
+        chat_history.append({"role": "user", "content": message})
+
+        return {
+            "mode": "npc",
+            "persona": self.db.persona,
+            "messages": chat_history,
+            "lore": lore,
+            "max_tokens": 250,
+            "temp": 0.5,
+            "deadline": time.time() + GenPC.MODEL_TIMEOUT
+        }
+
+    def generate_response_remote(self, message):
+        breaker = model_breaker()
+        if not breaker.allow():
+            return self.fallback_line()
+
+        start = time.monotonic()
+        try:
             # Call the remote LLM API
-            response = requests.post(
+            result = model_session().post(
                 GenPC.MODEL_URL,
-                json={
-                    "mode": "npc",
-                    "persona": self.db.persona,
-                    "messages": chat_history,
-                    "max_tokens": 250,
-                    "temp": 0.5
-                },
-                timeout=GenPC.MODEL_TIMEOUT
-            ).json()["response"]
+                json=self.npc_request(message),
+                timeout=(GenPC.MODEL_CONNECT_TIMEOUT, GenPC.MODEL_READ_TIMEOUT)
+            )
+            check_model_response(result)
+            response = result.json()["response"]
+            breaker.record_success(time.monotonic() - start)
 
-            if any(x in response.lower() for x in ["out of character", "as an ai", "grouplayout", "ai assistant"]):
-                response = "I'm afraid I can't speak on such matters."
+            if GenPC.is_out_of_character(response):
+                response = GenPC.OUT_OF_CHARACTER_LINE
 
             return response
 
+        except ModelServiceBusy as e:
+            print(f"LLM API call refused: {e}")
+            return self.fallback_line()
+
         except Exception as e:
             print(f"LLM API call failed: {e}")
             traceback.print_exc()
-            return "I do not have an answer right now."
+            breaker.record_failure(time.monotonic() - start)
+            return self.fallback_line()
 
-    def analyze_response_for_quest(self, npc_response):
+    def analyze_response_for_quest(self, npc_response, persona=None):
         """
         Ask the LLM to extract a build plan in JSON.
+
+        Args:
+            npc_response (str): The quest-like text the NPC said.
+            persona (str, optional): The NPC's persona. Pass it in when calling from a worker thread,
+                so the NPC's attributes are not read off the reactor thread.
         """
 
         try:
@@ -235,21 +922,38 @@ class GenPC(Character):
             try:
                 modelrequest = {
                         "mode": "quest",
-                        "persona": self.db.persona,
+                        "persona": persona if persona is not None else self.db.persona,
                         "messages": messages,
                         "max_tokens": 1200,
-                        "temp": 0.3
+                        "temp": 0.3,
+                        "deadline": time.time() + GenPC.MODEL_TIMEOUT
                     }
             except Exception as e:
                 print(f"[QuestAnalysis] Error assembling model request: {e}")
                 traceback.print_exc()
                 return None
 
-            result = requests.post(
-                GenPC.MODEL_URL,
-                json = modelrequest,
-                timeout = GenPC.MODEL_TIMEOUT
-            )
+            breaker = model_breaker()
+            if not breaker.allow():
+                log_info("[QuestAnalysis] Skipped: LLM service unavailable.")
+                return None
+
+            try:
+                result = model_session().post(
+                    GenPC.MODEL_URL,
+                    json = modelrequest,
+                    timeout = (GenPC.MODEL_CONNECT_TIMEOUT, GenPC.MODEL_READ_TIMEOUT)
+                )
+                # Quest extraction has its own admission limit, so a busy quest pool leaves dialogue alone
+                check_model_response(result, back_off=False)
+            except ModelServiceBusy:
+                raise
+            except Exception:
+                breaker.record_failure()
+                raise
+
+            # Quest extraction is long by design, so its latency is not held against the service
+            breaker.record_success()
 
             raw_response = result.json().get("response", "").strip()
 
@@ -272,6 +976,10 @@ class GenPC(Character):
 
             return parsed
 
+        except ModelServiceBusy:
+            # Not a failed extraction: the caller keeps the job queued
+            raise
+
         except Exception as e:
             print(f"[QuestAnalysis] Error: {e}")
             traceback.print_exc()
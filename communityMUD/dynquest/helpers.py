@@ -71,6 +71,33 @@ class QuestEval():
         )
         return entry
 
+    def queue_analysis(self, player=None, persona=None, npc=None):
+        """
+        Queues this text for quest extraction by QuestAnalysisScript, as an "analyzing" QuestEntry.
+
+        Args:
+            player: Account the quest is for.
+            persona (str): Persona of the NPC that said it, used in the extraction prompt.
+            npc: The NPC that said it.
+        """
+        quest_id = f"quest_{uuid.uuid4().hex[:8]}"
+        title = self.text if len(self.text) <= 60 else f"{self.text[:57]}..."
+
+        entry = QuestEntry.objects.create(
+            quest_id=quest_id,
+            title=title,
+            status="analyzing",
+            triggered_by=player,
+            raw_data={
+                "originating_response": self.text,
+                "persona": persona,
+                "npc": npc.dbref if npc else None,
+                "attempts": 0,
+                "last_error": None
+            }
+        )
+        return entry
+
     def __str__(self) -> str:
         # A custom string representation for the QuestEval class
         return (f"QuestEval(worthy={self.is_quest_worthy()}, confidence={self.quest_confidence_score()}, text='{self.text}')")
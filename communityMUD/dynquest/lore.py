@@ -0,0 +1,279 @@
+import json
+import os
+import time
+
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+STORE_FORMAT = 1
+MATRIX_SUFFIX = ".npy"          # float32 matrix of unit-length embedding rows
+META_SUFFIX = ".meta.json"      # Header (format, model, dim, count) and the lore snippets and realms, in row order
+GLOBAL_PARTITION = "global"     # Partition for lore that belongs to no particular realm
+
+
+class LoreIndex:
+    """
+    Similarity index over embedded lore snippets, partitioned by realm.
+
+    Embeddings are stored once as a contiguous float32 matrix of unit-length rows, grouped so
+    each realm's snippets form one contiguous block. A query is a matrix-vector product over
+    the blocks of the requested partitions (cosine similarity against just those snippets)
+    followed by an argpartition for the top matches.
+
+    Args:
+        contents (list[str]): The lore snippets.
+        embeddings (array-like): One embedding row per snippet.
+        realms (list[str], optional): The realm tag of each snippet. Snippets without one
+            belong to the GLOBAL_PARTITION.
+    """
+
+    def __init__(self, contents, embeddings, realms=None):
+        matrix = np.array(embeddings, dtype=np.float32, ndmin=2)
+
+        if matrix.ndim != 2 or matrix.shape[0] != len(contents):
+            raise ValueError(f"Mismatch between embeddings {matrix.shape} and lore content count ({len(contents)}).")
+
+        self.model = None
+        self.set_rows(contents, normalize_rows(matrix), realms)
+
+    @classmethod
+    def from_entries(cls, entries):
+        """
+        Builds an index from a list of objects with keys 'content', 'embedding' and optionally
+        'realm' (the legacy JSON lore format).
+        """
+        contents = []
+        embeddings = []
+        realms = []
+
+        for entry in entries:
+            if "content" not in entry or "embedding" not in entry:
+                raise ValueError("Missing 'content' or 'embedding' in an entry.")
+            contents.append(entry["content"])
+            embeddings.append(entry["embedding"])
+            realms.append(entry.get("realm"))
+
+        return cls(contents, embeddings, realms)
+
+    @classmethod
+    def from_normalized(cls, contents, matrix, model=None, realms=None):
+        """
+        Wraps an already normalized float32 matrix (such as a memory-mapped store). The matrix
+        is only copied if its rows are not already grouped by realm.
+        """
+        index = cls.__new__(cls)
+        index.model = model
+        index.set_rows(contents, matrix, realms)
+        return index
+
+    def set_rows(self, contents, matrix, realms):
+        """
+        Stores the rows grouped by realm and records each realm's block of rows.
+        """
+        realms = [realm or GLOBAL_PARTITION for realm in (realms or [None] * len(contents))]
+        if len(realms) != len(contents):
+            raise ValueError(f"Mismatch between realm tags ({len(realms)}) and lore content count ({len(contents)}).")
+
+        order = sorted(range(len(realms)), key=lambda row: realms[row])
+        if order != list(range(len(realms))):
+            matrix = matrix[order]
+            contents = [contents[row] for row in order]
+            realms = [realms[row] for row in order]
+
+        self.contents = list(contents)
+        self.realms = realms
+        self.matrix = matrix if isinstance(matrix, np.memmap) else np.ascontiguousarray(matrix)
+
+        self.partitions = {}
+        for row, realm in enumerate(realms):
+            start, _ = self.partitions.get(realm, (row, row))
+            self.partitions[realm] = (start, row + 1)
+
+    def __len__(self):
+        return len(self.contents)
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def search(self, query_embedding, top_n=3, partitions=None):
+        """
+        Finds the snippets most similar to a query embedding.
+
+        Args:
+            partitions (list[str], optional): Realm tags (or GLOBAL_PARTITION) to search.
+                Unknown tags are ignored. Searches every snippet if not given.
+
+        Returns:
+            list[tuple[int, float]]: (row, cosine similarity) pairs, most similar first.
+        """
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        query_norm = np.linalg.norm(query)
+
+        if partitions is None:
+            blocks = [(0, len(self.contents))]
+        else:
+            blocks = [self.partitions[name] for name in dict.fromkeys(partitions) if name in self.partitions]
+
+        candidates = sum(stop - start for start, stop in blocks)
+        top_n = min(top_n, candidates)
+        if top_n <= 0 or query_norm == 0:
+            return []
+
+        query = query / query_norm
+        scores = np.concatenate([self.matrix[start:stop] @ query for start, stop in blocks])
+        offsets = np.concatenate([np.arange(start, stop) for start, stop in blocks])
+
+        if top_n < len(scores):
+            best = np.argpartition(scores, -top_n)[-top_n:]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(scores[best])[::-1]]
+
+        return [(int(offsets[i]), float(scores[i])) for i in best]
+
+    def top_contents(self, query_embedding, top_n=3, partitions=None):
+        """
+        Returns the text of the top_n snippets most similar to a query embedding.
+        """
+        return [self.contents[row] for row, _ in self.search(query_embedding, top_n, partitions)]
+
+
+def normalize_rows(matrix):
+    """
+    Scales each row of a float32 matrix to unit length, in place. Zero rows are left as they are.
+    """
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def save_lore_store(base_path, contents, embeddings, model_name, realms=None):
+    """
+    Writes lore embeddings in the binary store format: <base_path>.npy holding the normalized
+    float32 matrix, and <base_path>.meta.json holding the header, the snippets and their realms.
+    Rows are written grouped by realm, so loading can memory-map each partition as-is.
+
+    Args:
+        base_path (str): Path of the store without suffix.
+        contents (list[str]): The lore snippets.
+        embeddings (array-like): One embedding row per snippet.
+        model_name (str): The embedding model that produced the embeddings.
+        realms (list[str], optional): The realm tag of each snippet (None for global lore).
+    """
+    index = LoreIndex(contents, embeddings, realms)
+
+    np.save(base_path + MATRIX_SUFFIX, index.matrix)
+    with open(base_path + META_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump({
+            "format": STORE_FORMAT,
+            "model": model_name,
+            "dim": index.dim,
+            "count": len(index),
+            "contents": index.contents,
+            "realms": index.realms
+        }, f, indent=2)
+
+
+def lore_store_exists(base_path):
+    return os.path.exists(base_path + MATRIX_SUFFIX) and os.path.exists(base_path + META_SUFFIX)
+
+
+def load_lore_store(base_path, mmap=True, model_name=None):
+    """
+    Opens a binary lore store as a LoreIndex. With mmap, the matrix is memory-mapped read-only
+    rather than read into memory, so pages are loaded on demand and shared between processes.
+
+    Args:
+        model_name (str, optional): If given, the store must have been built with this model.
+    """
+    with open(base_path + META_SUFFIX, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+
+    if meta.get("format") != STORE_FORMAT:
+        raise ValueError(f"Unsupported lore store format {meta.get('format')} in {base_path}{META_SUFFIX}")
+    if model_name and meta.get("model") != model_name:
+        raise ValueError(f"Lore store was embedded with {meta.get('model')}, not {model_name}")
+
+    matrix = np.load(base_path + MATRIX_SUFFIX, mmap_mode="r" if mmap else None)
+    if matrix.dtype != np.float32 or matrix.shape != (meta["count"], meta["dim"]) or len(meta["contents"]) != meta["count"]:
+        raise ValueError(f"Lore store {base_path} does not match its header: {matrix.dtype} {matrix.shape}, {meta['count']}x{meta['dim']}")
+
+    return LoreIndex.from_normalized(meta["contents"], matrix, model=meta["model"], realms=meta.get("realms"))
+
+
+def convert_json_lore(json_path, base_path, model_name="all-MiniLM-L6-v2"):
+    """
+    Converts a JSON lore file (a list of {"content", "embedding"} objects) to the binary store.
+
+    Returns:
+        int: The number of snippets converted.
+    """
+    with open(json_path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+
+    index = LoreIndex.from_entries(entries)
+    save_lore_store(base_path, index.contents, index.matrix, model_name, index.realms)
+    return len(index)
+
+
+def rss_bytes():
+    """
+    Resident memory of this process, or None if psutil is not installed.
+    """
+    return psutil.Process().memory_info().rss if psutil else None
+
+
+def measure_load(loader, *args, **kwargs):
+    """
+    Runs a lore loader and reports how long it took and how much resident memory it added.
+
+    Returns:
+        tuple: (result, seconds, RSS growth in bytes or None)
+    """
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    result = loader(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    rss_after = rss_bytes()
+    return result, elapsed, (rss_after - rss_before) if rss_before is not None else None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert or measure lore embedding stores.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    convert = commands.add_parser("convert", help="Convert a JSON lore file to the binary store format.")
+    convert.add_argument("json_path")
+    convert.add_argument("base_path", help="Store path without suffix, e.g. world/severed_realms_embeddings")
+    convert.add_argument("--model", default="all-MiniLM-L6-v2")
+
+    measure = commands.add_parser("measure", help="Report load time and RSS growth of a JSON file or binary store.")
+    measure.add_argument("path", help="A .json lore file, or a store path without suffix")
+
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        count = convert_json_lore(args.json_path, args.base_path, args.model)
+        print(f"Converted {count} lore snippets to {args.base_path}{MATRIX_SUFFIX} and {args.base_path}{META_SUFFIX}")
+    else:
+        def load_json_index(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return LoreIndex.from_entries(json.load(f))
+
+        def load_and_query(path):
+            # Run one query so pages of a memory-mapped matrix are counted too
+            index = load_json_index(path) if path.endswith(".json") else load_lore_store(path)
+            index.search(index.matrix[0], 1)
+            return index
+
+        index, seconds, rss = measure_load(load_and_query, args.path)
+        rss_text = f"{rss / 1024 / 1024:.1f} MiB" if rss is not None else "unknown (install psutil)"
+        print(f"Loaded {len(index)} snippets ({index.dim} dims) in {seconds * 1000:.1f} ms; RSS grew by {rss_text}")
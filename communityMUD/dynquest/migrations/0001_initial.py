@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:29
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('objects', '0013_defaultobject_alter_objectdb_id_defaultcharacter_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quest_id', models.CharField(max_length=64, unique=True)),
+                ('title', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('analyzing', 'Analyzing'), ('analysis_failed', 'Analysis Failed'), ('pending', 'Pending'), ('building', 'Building'), ('built', 'Built'), ('failed', 'Failed'), ('abandoned', 'Abandoned')], default='pending', max_length=20)),
+                ('timestamp_created', models.DateTimeField(auto_now_add=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('raw_data', models.JSONField()),
+                ('triggered_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='generated_quests', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='QuestProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('completed', models.DateTimeField(blank=True, null=True)),
+                ('current_step', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(choices=[('in_progress', 'In Progress'), ('complete', 'Complete'), ('failed', 'Failed'), ('abandoned', 'Abandoned')], default='in_progress', max_length=20)),
+                ('character', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='objects.objectdb')),
+                ('quest', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dynquest.questentry')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
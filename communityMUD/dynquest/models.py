@@ -7,9 +7,15 @@ from django.conf import settings
 class QuestEntry(SharedMemoryModel):
     """
     Stores structured quest data generated by the LLM, whether pending or built.
+
+    An entry starts out "analyzing" when an NPC says something quest-like: raw_data then holds
+    the analysis job (see QuestEval.queue_analysis) until QuestAnalysisScript replaces it with
+    the extracted quest and marks the entry "pending" for QuestBuilderScript.
     """
 
     QUEST_STATUS_CHOICES = [
+        ("analyzing", "Analyzing"),
+        ("analysis_failed", "Analysis Failed"),
         ("pending", "Pending"),
         ("building", "Building"),
         ("built", "Built"),
@@ -0,0 +1,161 @@
+import hashlib
+import threading
+import time
+
+import numpy as np
+
+
+def context_key(lore, turns=()):
+    """
+    Short fingerprint of what a prompt holds besides the utterance: its lore and the recent
+    conversation turns. An answer is only reused with the same lore and the same conversation
+    so far, so a follow-up such as "and then?" is never answered from another conversation.
+    """
+    digest = hashlib.sha1((lore or "").encode("utf-8"))
+    for turn in turns:
+        digest.update(f"\0{turn['role']}\0{turn['content']}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class PersonaEntries:
+    """
+    The cached answers of one persona: a matrix of unit-length utterance embeddings, one row
+    per answer, with the answer, context fingerprint and timestamps in parallel lists.
+    """
+
+    def __init__(self, dim):
+        self.matrix = np.empty((0, dim), dtype=np.float32)
+        self.responses = []
+        self.context_keys = []
+        self.stored = []
+        self.last_used = []
+
+    def __len__(self):
+        return len(self.responses)
+
+    def keep(self, rows):
+        """Keeps only the given rows, in order."""
+        self.matrix = np.ascontiguousarray(self.matrix[rows])
+        self.responses = [self.responses[row] for row in rows]
+        self.context_keys = [self.context_keys[row] for row in rows]
+        self.stored = [self.stored[row] for row in rows]
+        self.last_used = [self.last_used[row] for row in rows]
+
+
+class SemanticResponseCache:
+    """
+    Per-persona cache of NPC answers, looked up by meaning rather than exact wording.
+
+    Each entry is an (utterance embedding, context fingerprint, answer) triple. A new utterance
+    reuses the answer of the most similar cached utterance to the same persona if their cosine
+    similarity is at least `threshold` and both came with the same lore and conversation turns
+    (see context_key), so "who are you?" and "who might you be?" share one LLM call. Entries expire after `ttl` seconds; past
+    max_entries per persona the least recently used are evicted.
+
+    Args:
+        threshold (float): Minimum cosine similarity for a hit.
+        ttl (float): Seconds an answer stays fresh.
+        max_entries (int): Answers kept per persona.
+    """
+
+    def __init__(self, threshold=0.9, ttl=900, max_entries=128):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.personas = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, persona, embedding, lore, turns=()):
+        """
+        Returns the cached answer for an utterance, or None.
+
+        Args:
+            persona (str): The answering NPC's persona.
+            embedding (array-like): Embedding of the utterance.
+            lore (str): The lore that would be included in the prompt.
+            turns (list[dict]): The conversation turns that would be included in the prompt.
+        """
+        query = self.normalize(embedding)
+
+        with self.lock:
+            entries = self.personas.get(persona)
+            response = None
+
+            if entries is not None and query is not None:
+                self.expire(entries)
+                if len(entries):
+                    scores = entries.matrix @ query
+                    key = context_key(lore, turns)
+                    scores[[row for row, entry_key in enumerate(entries.context_keys) if entry_key != key]] = -1.0
+
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.threshold:
+                        entries.last_used[best] = time.monotonic()
+                        response = entries.responses[best]
+
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return response
+
+    def put(self, persona, embedding, lore, response, turns=()):
+        query = self.normalize(embedding)
+        if query is None or not response:
+            return
+
+        with self.lock:
+            entries = self.personas.get(persona)
+            if entries is None or entries.matrix.shape[1] != query.shape[0]:
+                entries = self.personas[persona] = PersonaEntries(query.shape[0])
+
+            now = time.monotonic()
+            entries.matrix = np.vstack([entries.matrix, query[np.newaxis, :]])
+            entries.responses.append(response)
+            entries.context_keys.append(context_key(lore, turns))
+            entries.stored.append(now)
+            entries.last_used.append(now)
+
+            self.expire(entries)
+            if len(entries) > self.max_entries:
+                recent = sorted(range(len(entries)), key=lambda row: entries.last_used[row])[-self.max_entries:]
+                self.evictions += len(entries) - len(recent)
+                entries.keep(sorted(recent))
+
+    def expire(self, entries):
+        """Drops answers older than the ttl. Caller holds the lock."""
+        now = time.monotonic()
+        fresh = [row for row, stored in enumerate(entries.stored) if now - stored <= self.ttl]
+        if len(fresh) != len(entries):
+            entries.keep(fresh)
+
+    @staticmethod
+    def normalize(embedding):
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        return query / norm if norm else None
+
+    def clear(self):
+        with self.lock:
+            self.personas.clear()
+
+    def stats(self):
+        """
+        Hit ratio is the fraction of lookups answered without the LLM.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "personas": len(self.personas),
+                "entries": sum(len(entries) for entries in self.personas.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+SEMANTIC_CACHE = SemanticResponseCache()
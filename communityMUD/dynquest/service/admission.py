@@ -0,0 +1,87 @@
+import math
+import threading
+import time
+
+
+class Overloaded(Exception):
+    """
+    Raised by AdmissionControl.admit() when a mode already has as many requests as it may.
+    """
+
+    def __init__(self, mode: str, retry_after: int):
+        super().__init__(f"Too many {mode} requests in progress; retry in {retry_after}s")
+        self.mode = mode
+        self.retry_after = retry_after
+
+
+class AdmissionControl:
+    """
+    Bounds how many requests of each mode are in the service at once, running or queued.
+
+    A request over its mode's limit is refused at once instead of waiting behind the others,
+    so a rush of players gets quick refusals rather than ever longer waits, and no request
+    thread or socket is held for it. The refusal carries an estimated wait: the recent mean
+    latency of the mode's requests, about how long the oldest admitted request still needs
+    to free its slot.
+
+    Args:
+        limits: Mapping of mode name to the most requests admitted at once.
+        default_limit: Limit of modes not in limits.
+        smoothing: Weight of the newest latency in the running mean (0 to 1).
+    """
+
+    def __init__(self, limits: dict, default_limit: int = 8, smoothing: float = 0.2):
+        self.limits = limits
+        self.default_limit = default_limit
+        self.smoothing = smoothing
+        self.in_flight = {}
+        self.latency = {}       # mode -> running mean seconds from admission to release
+        self.admitted = {}
+        self.rejected = {}
+        self.lock = threading.Lock()
+
+    def limit(self, mode: str) -> int:
+        return self.limits.get(mode, self.default_limit)
+
+    def admit(self, mode: str) -> float:
+        """
+        Takes a slot for a request, or raises Overloaded.
+
+        Returns:
+            The admission time, to pass to release().
+        """
+        with self.lock:
+            if self.in_flight.get(mode, 0) >= self.limit(mode):
+                self.rejected[mode] = self.rejected.get(mode, 0) + 1
+                raise Overloaded(mode, self.retry_after(mode))
+
+            self.in_flight[mode] = self.in_flight.get(mode, 0) + 1
+            self.admitted[mode] = self.admitted.get(mode, 0) + 1
+        return time.monotonic()
+
+    def release(self, mode: str, admitted_at: float):
+        """
+        Frees the slot of a finished request, whether it succeeded or not.
+        """
+        seconds = time.monotonic() - admitted_at
+        with self.lock:
+            self.in_flight[mode] = max(0, self.in_flight.get(mode, 0) - 1)
+            mean = self.latency.get(mode)
+            self.latency[mode] = seconds if mean is None else mean + self.smoothing * (seconds - mean)
+
+    def retry_after(self, mode: str) -> int:
+        """Whole seconds a refused client should wait. Caller holds the lock."""
+        return max(1, math.ceil(self.latency.get(mode, 1.0)))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                mode: {
+                    "limit": self.limit(mode),
+                    "in_flight": self.in_flight.get(mode, 0),
+                    "admitted": self.admitted.get(mode, 0),
+                    "rejected": self.rejected.get(mode, 0),
+                    "mean_latency": round(self.latency[mode], 3) if mode in self.latency else None,
+                }
+                for mode in sorted(set(self.limits) | set(self.in_flight))
+            }
@@ -0,0 +1,78 @@
+import re
+
+# A sentence ends at terminal punctuation (plus any closing quotes) followed by whitespace, or at a paragraph break.
+SENTENCE_BOUNDARY = re.compile(r"\n\s*\n|[.!?]+[\"'”’)\]]*\s+")
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+class EarlyStop:
+    """
+    Ends a generation as soon as the rest of it would be thrown away by post-processing.
+
+    Checked after every decoded token. Generation stops once the reply holds max_paragraphs
+    paragraphs or max_sentences sentences, or as soon as a paragraph after the first opens with
+    one of ooc_openers (meta text such as "Let me know if") or turn_openers (the model starting
+    another speaker's turn, such as "Assistant:"). The text is cut back to the end of the last
+    sentence or paragraph that is kept.
+
+    The first paragraph never stops the reply: stopping there would leave nothing to say.
+    An out-of-character first paragraph is dropped by post-processing, which keeps the
+    in-character paragraphs after it, and a fourth-wall prefix is stripped from it.
+
+    Plain data, so it can be sent to a worker process with a job.
+
+    Args:
+        max_paragraphs (int): Paragraphs kept, or None for no limit.
+        max_sentences (int): Sentences kept, or None for no limit.
+        ooc_openers (list[str]): Paragraph openers that end the reply (case-insensitive).
+        turn_openers (list[str]): More paragraph openers that end the reply.
+    """
+
+    def __init__(self, max_paragraphs=None, max_sentences=None, ooc_openers=(), turn_openers=()):
+        self.max_paragraphs = max_paragraphs
+        self.max_sentences = max_sentences
+        self.ooc_openers = [opener.lower() for opener in ooc_openers]
+        self.turn_openers = [opener.lower() for opener in turn_openers]
+
+    def paragraph_starts(self, text: str) -> list[int]:
+        """Offsets where each paragraph's text begins, after leading whitespace."""
+        starts = [len(text) - len(text.lstrip())]
+        starts.extend(match.end() for match in PARAGRAPH_BREAK.finditer(text, starts[0]))
+        return starts
+
+    def openers_for(self, paragraph: int) -> list[str]:
+        return self.ooc_openers + self.turn_openers if paragraph else []
+
+    def cut(self, text: str):
+        """
+        Returns the length to cut text to and stop generating, or None to carry on.
+        """
+        starts = self.paragraph_starts(text)
+
+        for paragraph, start in enumerate(starts):
+            opening = text[start:].lower()
+            if any(opening.startswith(opener) for opener in self.openers_for(paragraph)):
+                return start
+
+        if self.max_paragraphs and len(starts) > self.max_paragraphs:
+            return PARAGRAPH_BREAK.search(text, starts[self.max_paragraphs - 1]).start()
+
+        if self.max_sentences:
+            for count, match in enumerate(SENTENCE_BOUNDARY.finditer(text, starts[0]), start=1):
+                if count == self.max_sentences:
+                    return match.end()
+
+        return None
+
+    def hold(self, text: str) -> int:
+        """
+        Number of trailing characters not to stream yet: the last paragraph, while it could
+        still turn out to open with an opener and be cut.
+        """
+        starts = self.paragraph_starts(text)
+        start = starts[-1]
+        opening = text[start:].lower()
+
+        if opening and any(opener.startswith(opening) for opener in self.openers_for(len(starts) - 1)):
+            return len(text) - start
+        return 0
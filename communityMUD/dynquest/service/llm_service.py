@@ -1,27 +1,101 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from llama_cpp import Llama
-from threading import Lock
+from llama_cpp.llama_grammar import json_schema_to_gbnf
+from dynquest.service.admission import AdmissionControl, Overloaded
+from dynquest.service.postprocess import FILTER_STARTS, FOURTH_WALL_PREFIXES, StreamFilter, process_response
+from dynquest.service.prompt_budget import PromptBudgetStats, fit_prompt, lore_lines
+from dynquest.service.response_cache import ResponseCache, response_cache_key
+from dynquest.service.scheduler import DeadlineExceeded, chat_formatter
+from dynquest.service.workers import RemoteGeneration, Router, WorkerPool
+import json
+import queue
 import re
+import threading
+import time
 import traceback
 
-app = FastAPI()
-
 # Configure your model here
 MODEL_PATH = "C:\\Users\\amele\\model\\"
 MODEL_FILE = "gemma-2-2b-neogenesis-ita-Q4_K_M.gguf"    # "gemma-3-4b-it-q4_0_s.gguf" #"zephyr-7b-beta.Q4_0.gguf"
 CHAT_FORMAT = "gemma"
-llm_lock = Lock()
-
-FOURTH_WALL_PREFIXES = [
-    'You replied:',
-    'You reply:',
-    'The NPC replies:',
-    'The NPC said:',
-    'They respond:',
-    'The system says:',
-    'Assistant:'
-]
+N_CTX = 4096                # Context available to each sequence
+MAX_BATCH_SIZE = 4          # Sequences decoded together by the scheduler
+MAX_BATCH_WAIT = 0.05       # Seconds an idle scheduler waits for more requests to batch together
+PREFIX_CACHE_BYTES = 512 * 1024 * 1024     # Memory budget for cached instruction/persona KV state, per worker
+SYSTEMLESS_CHAT_FORMATS = ["gemma"]         # Chat formats that silently drop system messages
+
+# Model worker processes per request mode. Quest extraction gets its own pool so it never
+# occupies the workers serving NPC dialogue. Each worker holds its own context and KV cache;
+# the mmapped weights are shared through the OS page cache. Modes without a pool of their own
+# (such as "lines") use the npc pool.
+WORKER_POOLS = {
+    "npc": 2,
+    "quest": 1
+}
+
+# Default queue priority per mode (lower runs first). Players are waiting on dialogue; quest
+# extraction is background work and can wait behind it wherever the two share a worker.
+MODE_PRIORITIES = {
+    "npc": 0,
+    "lines": 5,
+    "quest": 10
+}
+
+# Most prompt tokens per request, by mode; prompts are also kept small enough to leave room for
+# max_tokens of output. A fixed budget bounds prefill time: persona, message, recent turns and
+# lore are included in that order until it is full (see prompt_budget.fit_prompt).
+PROMPT_TOKEN_BUDGETS = {
+    "npc": 1536,
+    "lines": 512,
+    "quest": N_CTX
+}
+
+# Most requests per mode in the service at once, running or queued; more are refused with 429
+# and a Retry-After estimate rather than left to wait. Sized a little above what the mode's pool
+# decodes together (workers x MAX_BATCH_SIZE), so a short burst queues but a rush is shed.
+ADMISSION_LIMITS = {
+    "npc": 12,
+    "lines": 4,
+    "quest": 6
+}
+
+# Finished /generate responses are reused for identical (whitespace-normalized) requests.
+# Quest extraction runs at low temperature, so a repeat is as good as a fresh answer. NPC
+# dialogue is streamed (/generate/stream never uses this cache) and reused on the game side by
+# the semantic cache instead. Line pools are sampled hot for variety, which caching would undo.
+RESPONSE_CACHE_MODES = {
+    "npc": False,
+    "lines": False,
+    "quest": True
+}
+RESPONSE_CACHE_TTL = 300                    # Seconds a cached response stays valid
+RESPONSE_CACHE_BYTES = 16 * 1024 * 1024     # Approximate memory budget for cached responses
+
+MODEL_CONFIG = {
+    "model_path": MODEL_PATH + MODEL_FILE,
+    "chat_format": CHAT_FORMAT,
+    "n_threads": 12,
+    "n_gpu_layers": 35,         # Use your GPU if supported, else set to 0
+    "n_ctx": N_CTX,
+    "max_batch_size": MAX_BATCH_SIZE,
+    "max_batch_wait": MAX_BATCH_WAIT,
+    "prefix_cache_bytes": PREFIX_CACHE_BYTES
+}
+
+# Per mode, when to stop generating a reply early (see early_stop.EarlyStop): at the length the
+# instructions ask for, or as soon as a paragraph opens like text that post-processing removes.
+# Without this, tokens past the limit are paid for and then thrown away by filter_response.
+EARLY_STOP = {
+    "npc": {
+        "max_paragraphs": 3,
+        "max_sentences": 10,
+        "ooc_openers": FILTER_STARTS,
+        "turn_openers": FOURTH_WALL_PREFIXES
+    }
+}
 
 INSTRUCTIONS = (
     "You are a character in a fantasy world. You are not an AI or assistant. "
@@ -37,12 +111,23 @@ INSTRUCTIONS = (
     "Do not generate harmful or inappropriate content. "
 )
 
+# Line pools ("lines" mode, see GenPC.generate_line_pool) ask for several alternative lines in
+# one request. INSTRUCTIONS forbids list output, so they get their own system prompt.
+LINES_INSTRUCTIONS = (
+    "You are a character in a fantasy world. You are not an AI or assistant. "
+    "You will be asked for several different things your character might say. "
+    "Write each as a single short sentence of in-character first person dialogue, one per line, "
+    "with no numbering, quotes, headings or commentary. "
+    "Avoid references to real world people, places or events. "
+    "Do not generate harmful or inappropriate content. "
+)
+
 QUEST_QUERY = "Convert the quest description into JSON using the defined schema. Do not invent fields. Respond only with JSON.\n"
 
 QUEST_INSTRUCTIONS = (
     "Given a quest description, output a JSON object representing that quest description in the specified JSON format. "
     "Where details are missing from the required format, fill them in with a proposed value consistent with the quest description.\n"
-    "Respond ONLY with the defined JSON format in a code block. Do not explain, narrate, or comment. Do not invent new fields.\n"
+    "Respond ONLY with the defined JSON format. Do not explain, narrate, or comment. Do not invent new fields.\n"
     "A quest must have a short title, a long description, a list of locations, a list of objects, a list of NPCs and a list of goals.\n"
     "The goals.target field should exactly match the key of a location, object, or NPC defined elsewhere in the quest. "
 )
@@ -72,15 +157,84 @@ QUEST_JSON = ("Required JSON format: "
     "}"
 )
 
-# Load model
-llm = Llama(
-    model_path=MODEL_PATH + MODEL_FILE,
-    n_ctx=4096,
-    n_threads=12,
-    n_gpu_layers=35,            # Use your GPU if supported, else set to 0
-    chat_format=CHAT_FORMAT
+# JSON schema equivalent of QUEST_JSON. With CONSTRAIN_QUEST_JSON, quest generations are decoded
+# under a grammar built from it, so the output is always a bare JSON object in this shape
+# (unless cut off by max_tokens) - no code fences, prose or invented fields.
+CONSTRAIN_QUEST_JSON = True
+QUEST_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "lore": {"type": "string"},
+        "locations": {"type": "array", "items": {
+            "type": "object",
+            "properties": {"key": {"type": "string"}, "desc": {"type": "string"}},
+            "required": ["key", "desc"],
+            "additionalProperties": False
+        }},
+        "objects": {"type": "array", "items": {
+            "type": "object",
+            "properties": {"key": {"type": "string"}, "location": {"type": "string"}, "desc": {"type": "string"}},
+            "required": ["key", "location", "desc"],
+            "additionalProperties": False
+        }},
+        "npcs": {"type": "array", "items": {
+            "type": "object",
+            "properties": {
+                "key": {"type": "string"},
+                "location": {"type": "string"},
+                "dialogue": {"type": "array", "items": {"type": "string"}}
+            },
+            "required": ["key", "location", "dialogue"],
+            "additionalProperties": False
+        }},
+        "goals": {"type": "array", "items": {
+            "type": "object",
+            "properties": {
+                "key": {"type": "string"},
+                "desc": {"type": "string"},
+                "type": {"enum": ["findlocation", "findobject", "findnpc", "giveto"]},
+                "target": {"type": "string"},
+                "object": {"type": "string"}
+            },
+            "required": ["key", "desc", "type", "target"],
+            "additionalProperties": False
+        }}
+    },
+    "required": ["title", "lore", "locations", "objects", "npcs", "goals"],
+    "additionalProperties": False
+}
+QUEST_GRAMMAR = json_schema_to_gbnf(
+    json.dumps(QUEST_SCHEMA),
+    prop_order=["title", "lore", "locations", "objects", "npcs", "goals", "key", "location", "desc", "type", "target"]
+).replace(
+    # The generated string rule admits raw control characters (e.g. newlines), which json.loads rejects
+    r'char ::= [^"\\]', r'char ::= [^"\\\x7F\x00-\x1F]'
 )
 
+# This process only formats and tokenizes prompts, so it loads the vocabulary alone.
+# The model itself is loaded by the worker processes.
+tokenizer = Llama(model_path=MODEL_PATH + MODEL_FILE, vocab_only=True, chat_format=CHAT_FORMAT)
+format_chat = chat_formatter(CHAT_FORMAT)
+
+# Running count of quest responses that parse as JSON, split by whether decoding was constrained.
+quest_json_stats = {"constrained": {"valid": 0, "invalid": 0}, "unconstrained": {"valid": 0, "invalid": 0}}
+quest_json_lock = threading.Lock()
+
+prompt_stats = PromptBudgetStats()
+
+response_cache = ResponseCache(max_bytes=RESPONSE_CACHE_BYTES, ttl=RESPONSE_CACHE_TTL, enabled_modes=RESPONSE_CACHE_MODES)
+admission = AdmissionControl(ADMISSION_LIMITS)
+router = Router({mode: WorkerPool(mode, size, MODEL_CONFIG) for mode, size in WORKER_POOLS.items()})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    router.start()
+    yield
+    router.stop()
+
+app = FastAPI(lifespan=lifespan)
+
 # Pydantic models for request parsing
 class Message(BaseModel):
     role: str
@@ -92,137 +246,355 @@ class RequestData(BaseModel):
     messages: list[Message]
     max_tokens: int = 500
     temp: float = 0.7
+    priority: int | None = None     # Overrides MODE_PRIORITIES
+    deadline: float | None = None   # Unix time after which the caller no longer wants the response
+    lore: str = ""                  # Lore lines, most relevant first; included as far as the prompt budget allows
+
+
+def instruction_messages(data: RequestData):
+    """
+    The fixed preamble for a request: the same for every request with the same mode and persona.
+    """
+    if data.mode == "quest":
+        return [{"role": "system", "content": QUEST_INSTRUCTIONS + QUEST_JSON}]
+
+    if data.mode == "lines":
+        return [{"role": "system", "content": f"Your persona: {data.persona}. {LINES_INSTRUCTIONS}"}]
+
+    return [
+        {"role": "system", "content": f"Your persona: {data.persona}. {INSTRUCTIONS}. "},
+        {"role": "user", "content": "Respond to the following as your persona of " + data.persona}
+    ]
+
+def prompt_budget(data: RequestData) -> int:
+    """
+    Prompt tokens available to a request: its mode's budget, less room for max_tokens of output.
+    """
+    return min(PROMPT_TOKEN_BUDGETS.get(data.mode, N_CTX), N_CTX - data.max_tokens - 1)
 
+def truncate_text(text: str, tokens: int) -> str:
+    """
+    Cuts about the given number of tokens from the end of text.
+    """
+    text_tokens = tokenizer.tokenize(text.encode("utf-8"), add_bos=False, special=False)
+    kept = text_tokens[:max(0, len(text_tokens) - tokens)]
+    return tokenizer.detokenize(kept).decode("utf-8", errors="ignore")
 
 def assemble_messages(data: RequestData):
-    assembled_messages = [] 
-    moremessages = []
+    """
+    Builds the chat messages for a request within its prompt budget.
+    """
+    messages = [{"role": msg.role, "content": msg.content} for msg in data.messages]
 
     if data.mode == "quest":
-        assembled_messages.append({"role": "system", "content": QUEST_INSTRUCTIONS + QUEST_JSON})
-        assembled_messages.append({"role": "user", "content": data.messages[0].content + QUEST_QUERY + QUEST_JSON})
+        message, turns, suffix = messages[0], [], QUEST_QUERY + QUEST_JSON
     else:
-        assembled_messages.append({"role": "system", "content": f"Your persona: {data.persona}. {INSTRUCTIONS}. "})
-        assembled_messages.append({"role": "user", "content": "Respond to the following as your persona of " + data.persona})
-        moremessages = [{"role": msg.role, "content": msg.content} for msg in data.messages]
-        assembled_messages.extend(moremessages)
+        message, turns, suffix = messages[-1], messages[:-1], ""
 
-    print(f"Assembled messages: {assembled_messages}")
+    assembled_messages, report = fit_prompt(
+        instruction_messages(data), message, turns, lore_lines(data.lore), prompt_budget(data),
+        count_tokens=lambda candidate: len(chat_prompt_tokens(candidate)[0]),
+        truncate_text=truncate_text,
+        suffix=suffix
+    )
+    prompt_stats.record(report)
+
+    print(f"Assembled messages: {assembled_messages} ({report})")
 
     return assembled_messages
 
-def process_response(mode: str, response: str, finish_reason: str) -> str:
-    if mode != "quest":
-        response = normalize_symbols(response or "")
-        response = filter_response(response or "", finish_reason)
-        response = strip_fourth_wall_intro(response or "")
+def record_quest_json(response: str):
+    """
+    Tallies whether a quest response parses as JSON the way GenPC reads it (optionally fenced).
+    """
+    match = re.search(r"```json\s*(.*?)```", response, re.DOTALL)
+    try:
+        json.loads(match.group(1).strip() if match else response)
+        outcome = "valid"
+    except ValueError:
+        outcome = "invalid"
+
+    with quest_json_lock:
+        quest_json_stats["constrained" if CONSTRAIN_QUEST_JSON else "unconstrained"][outcome] += 1
+
+def quest_json_validity() -> dict:
+    with quest_json_lock:
+        return {
+            kind: dict(counts, rate=round(counts["valid"] / total, 3) if (total := counts["valid"] + counts["invalid"]) else None)
+            for kind, counts in quest_json_stats.items()
+        }
+
+def shared_prefix(data: RequestData, prompt_tokens: list[int]) -> tuple[tuple, int]:
+    """
+    Finds how many leading prompt tokens come from the mode/persona preamble alone.
 
-    return response
+    Returns:
+        The prefix cache key and the number of shared tokens.
+    """
+    head_tokens, _ = chat_prompt_tokens(instruction_messages(data))
+
+    prefix_len = 0
+    for head, token in zip(head_tokens, prompt_tokens):
+        if head != token:
+            break
+        prefix_len += 1
+
+    return (data.mode, "" if data.mode == "quest" else data.persona), prefix_len
+
+def submit_generation(prompt_tokens: list[int], data: RequestData, stop=None, stream=None, prefix=None) -> RemoteGeneration:
+    """
+    Queues a tokenized prompt on a worker in the pool for the request's mode, without waiting for it.
+    """
+    if len(prompt_tokens) + 1 > N_CTX:
+        raise ValueError(f"Requested tokens ({len(prompt_tokens)}) exceed context window of {N_CTX}")
+    if data.deadline is not None and time.time() >= data.deadline:
+        raise DeadlineExceeded("Deadline passed before the request was queued")
+
+    prefix_key, prefix_len = prefix or (None, 0)
+    grammar = QUEST_GRAMMAR if data.mode == "quest" and CONSTRAIN_QUEST_JSON else None
+    priority = data.priority if data.priority is not None else MODE_PRIORITIES.get(data.mode, 0)
+    return router.submit(data.mode, {
+        "prompt_tokens": prompt_tokens,
+        "max_tokens": data.max_tokens,
+        "temp": data.temp,
+        "stop": stop or [],
+        "prefix_key": prefix_key,
+        "prefix_len": prefix_len,
+        "priority": priority,
+        "deadline": data.deadline,
+        "grammar": grammar,
+        "early_stop": EARLY_STOP.get(data.mode)
+    }, stream=stream)
+
+def submit_chat_generation(data: RequestData, stream=None) -> RemoteGeneration:
+    """
+    Assembles, formats and queues the chat prompt for a request, falling back to a flat prompt on error.
+    """
+    try:
+        messages = assemble_messages(data)
+        prompt_tokens, stop = chat_prompt_tokens(messages)
+        return submit_generation(prompt_tokens, data, stop=stop, stream=stream, prefix=shared_prefix(data, prompt_tokens))
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"Fallback to prompt mode due to error: {e}")
+        traceback.print_exc()
+        return submit_generation(flat_prompt_tokens(data), data, stream=stream)
+
+def fold_system_messages(messages: list[dict]) -> list[dict]:
+    """
+    Prepends each system message to the user turn that follows it, for chat formats
+    without a system role (Gemma's formatter otherwise drops them, instructions and all).
+    """
+    folded = []
+    pending = []
+
+    for msg in messages:
+        if msg["role"] == "system":
+            pending.append(msg["content"])
+            continue
+        if pending and msg["role"] == "user":
+            msg = {"role": "user", "content": "\n\n".join(pending + [msg["content"]])}
+            pending = []
+        folded.append(msg)
+
+    if pending:
+        folded.append({"role": "user", "content": "\n\n".join(pending)})
+
+    return folded
+
+def chat_prompt_tokens(messages: list[dict]) -> tuple[list[int], list[str]]:
+    """
+    Applies the chat format to assembled messages and tokenizes the result.
+    """
+    if CHAT_FORMAT in SYSTEMLESS_CHAT_FORMATS:
+        messages = fold_system_messages(messages)
+
+    formatted = format_chat(messages=messages)
+    tokens = tokenizer.tokenize(formatted.prompt.encode("utf-8"), add_bos=not formatted.added_special, special=True)
+    stop = formatted.stop if isinstance(formatted.stop, list) else [formatted.stop]
+    return tokens, [s for s in stop if s]
 
 @app.post("/generate")
 def generate_response(data: RequestData):
     print(f"Received data: {data}")
 
-    with llm_lock:
-        try:
-            print("Using llama_cpp.create_chat_completion()")
-            messages = assemble_messages(data)
-
-            result = llm.create_chat_completion(
-                messages=messages,                  # type: ignore[arg-type]
-                max_tokens=data.max_tokens,
-                temperature=data.temp,
-                stream=False
-            )
-            response = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-            finish_reason = result["choices"][0]["finish_reason"]    # type: ignore
-
-            print(f"Finish reason: {finish_reason}")
-            
-        except Exception as e:
-            print(f"Fallback to prompt mode due to error: {e}")
-            traceback.print_exc()
-            
-            flat_prompt = "\n".join(f"{msg.role.title()}: {msg.content}" for msg in data.messages)
-            result = llm.create_completion(
-                prompt=flat_prompt,
-                max_tokens=data.max_tokens,
-                temperature=data.temp
-            )
-            response = result.get("choices", [{}])[0].get("text", "")
-            finish_reason = result["choices"][0]["finish_reason"]    # type: ignore
+    cache_key = None
+    if response_cache.enabled(data.mode):
+        cache_key = response_cache_key(data.mode, data.persona, data.messages, data.temp, data.max_tokens, lore=data.lore)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            print(f"Response cache hit for {data.mode} request")
+            return dict(cached, queue_time=0.0, generation_time=0.0, cached=True)
+
+    admitted = admit(data)
+    try:
+        return run_generation(data, cache_key)
+    finally:
+        admission.release(data.mode, admitted)
+
+def http_error(error: Exception) -> HTTPException:
+    """
+    The response for a request the service gave up on: 429 with a Retry-After estimate when it
+    is over capacity, 504 when the caller's deadline passed.
+    """
+    if isinstance(error, Overloaded):
+        print(f"Refused request: {error}")
+        return HTTPException(
+            status_code=429,
+            detail={"error": str(error), "retry_after": error.retry_after},
+            headers={"Retry-After": str(error.retry_after)}
+        )
+
+    print(f"Dropped request: {error}")
+    return HTTPException(status_code=504, detail=str(error))
+
+def admit(data: RequestData) -> float:
+    """
+    Admits a request past AdmissionControl, or refuses it with 429 and a Retry-After estimate.
+    """
+    try:
+        return admission.admit(data.mode)
+    except Overloaded as e:
+        raise http_error(e)
+
+def run_job(submit) -> RemoteGeneration:
+    """
+    Submits a generation and waits for it. Timeouts and refusals become HTTP errors (see
+    http_error); any other error is left on the job for the caller.
+    """
+    try:
+        job = submit()
+        job.wait()
+    except (DeadlineExceeded, Overloaded) as e:
+        raise http_error(e)
+
+    if isinstance(job.error, (DeadlineExceeded, Overloaded)):
+        raise http_error(job.error)
+    return job
+
+def run_generation(data: RequestData, cache_key):
+    """
+    Generates, post-processes and (if cache_key is given) caches the response to an admitted request.
+    """
+    job = run_job(lambda: submit_chat_generation(data))
+
+    if job.error:
+        print(f"Fallback to prompt mode due to error: {job.error}")
+        job = run_job(lambda: submit_generation(flat_prompt_tokens(data), data))
+        if job.error:
+            raise job.error
+
+    response = job.text
+    finish_reason = job.finish_reason
+    print(f"Finish reason: {finish_reason} (queued {job.queue_time:.3f}s, prefix cache {'hit' if job.prefix_hit else 'miss'}, generated {job.completion_tokens} tokens on {data.mode} worker {job.worker} in {job.generation_time:.3f}s)")
 
     print(f"Generated (pre-processed) response: {response}")
     response = process_response(data.mode, response or "", finish_reason or "")
     print(f"Generated (post-processed) response: {response}")
+    if data.mode == "quest":
+        record_quest_json(response.strip())
     
-    return {"response": response.strip()}           # type: ignore
-
-
-def filter_response(response: str, finish_reason: str) -> str:
-    """
-    Removes paragraphs that are likely out-of-character or meta/instructional.
-    """
-    # Define phrases that indicate OOC behavior
-    filter_starts = [
-        "Would you like me to",
-        "Here are a few ways",
-        "To help you",
-        "Let me know if",
-        "If you'd like",
-        "You could",
-        "We could",
-        "Here's how",
-        "Some options might be",
-        "Depending on your preferences",
-        "If you're going for",
-        "Do you want me to"
-    ]
+    result = {
+        "response": response.strip(),
+        "queue_time": round(job.queue_time, 3),
+        "generation_time": round(job.generation_time, 3),
+        "completion_tokens": job.completion_tokens,
+        "cached": False
+    }
 
-    # Split into paragraphs
-    paragraphs = re.split(r"\n\s*\n", response)
+    if cache_key and result["response"]:
+        response_cache.put(cache_key, result)
 
-    # Keep only in-character lines
-    filtered = [
-        para for para in paragraphs
-        if not any(para.strip().lower().startswith(start.lower()) for start in filter_starts)
-    ]
+    return result
 
-                # When the response was truncated due to the token limit eliminate the final (incomplete) paragraph.
-    if finish_reason == "length" and len(paragraphs) > 1:
-        filtered_response = "\n\n".join(paragraphs[:-1]).strip()
-    else:
-        filtered_response = "\n\n".join(filtered).strip()
+def flat_prompt_tokens(data: RequestData) -> list[int]:
+    """
+    Fallback prompt: the raw messages as plain "Role: content" lines, without instructions or chat format.
+    """
+    flat_prompt = "\n".join(f"{msg.role.title()}: {msg.content}" for msg in data.messages)
+    return tokenizer.tokenize(flat_prompt.encode("utf-8"), special=True)
 
-    return filtered_response
+def sse_event(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
 
-def normalize_symbols(text: str) -> str:
-    return (
-        text.replace("“", '"')
-            .replace("”", '"')
-            .replace("‘", "'")
-            .replace("’", "'")
-            .replace("…", "...")    # ellipsis
-            .replace("—", "-")      # em-dash
-            .replace("–", "-")      # en-dash
-            .replace("**", "")      # Emphasis
+def stream_events(data: RequestData, job: RemoteGeneration, deltas: queue.Queue, admitted: float):
+    """
+    Relays generated text as server-sent events, one post-processed sentence per event.
+    The final event carries done=True and the same timing fields as /generate. The request's
+    admission slot is released when the stream ends or the client goes away.
+    """
+    try:
+        yield from relay_events(data, job, deltas)
+    finally:
+        admission.release(data.mode, admitted)
 
-    )
+def relay_events(data: RequestData, job: RemoteGeneration, deltas: queue.Queue):
+    sentences = StreamFilter(data.mode)
+
+    while (delta := deltas.get()) is not None:
+        for sentence in sentences.feed(delta):
+            yield sse_event({"text": sentence})
+
+    if job.error:
+        yield sse_event({"error": str(job.error), "done": True})
+        return
 
-def strip_fourth_wall_intro(text):
-    # Normalize smart quotes to straight quotes
-    text = text.replace('“', '"').replace('”', '"')
-
-    # Check for any defined prefix and remove it
-    for prefix in FOURTH_WALL_PREFIXES:
-        # Check for prefix with optional quote immediately after
-        pattern = rf'^{re.escape(prefix)}\s*["\']?'
-        if re.match(pattern, text):
-            # Remove the prefix + optional opening quote
-            cleaned = re.sub(pattern, '', text, count=1)
-            # Remove a trailing quote if it exists
-            if cleaned.endswith('"') or cleaned.endswith("'"):
-                cleaned = cleaned[:-1]
-            return cleaned.strip()
-
-    return text
+    for sentence in sentences.finish(job.finish_reason or ""):
+        yield sse_event({"text": sentence})
+
+    print(f"Streamed response: {job.text} (finish reason: {job.finish_reason}, queued {job.queue_time:.3f}s)")
+
+    yield sse_event({
+        "done": True,
+        "finish_reason": job.finish_reason,
+        "queue_time": round(job.queue_time, 3),
+        "generation_time": round(job.generation_time, 3),
+        "completion_tokens": job.completion_tokens
+    })
+
+@app.post("/generate/stream")
+def generate_response_stream(data: RequestData):
+    """
+    Streaming variant of /generate. Responds with text/event-stream; each event is a JSON
+    object holding either the next complete sentence ("text") or the final summary ("done").
+    """
+    print(f"Received stream data: {data}")
+    deltas = queue.Queue()
+    admitted = admit(data)
+    try:
+        job = submit_chat_generation(data, stream=deltas)
+    except DeadlineExceeded as e:
+        admission.release(data.mode, admitted)
+        raise http_error(e)
+    except Exception:
+        admission.release(data.mode, admitted)
+        raise
+
+    return StreamingResponse(stream_events(data, job, deltas, admitted), media_type="text/event-stream")
+
+@app.get("/health")
+def get_health():
+    """
+    Cheap liveness check for clients' circuit breakers: never touches a model. Healthy when
+    every pool has at least one loaded worker.
+    """
+    ready = {mode: pool.stats()["ready"] for mode, pool in router.pools.items()}
+    if not all(ready.values()):
+        raise HTTPException(status_code=503, detail={"status": "starting", "ready": ready})
+    return {"status": "ok", "ready": ready}
+
+@app.get("/stats")
+def get_stats():
+    """
+    Per-pool worker status, with each worker's scheduler throughput and prefix cache counters,
+    plus admission counts, response cache hit rate and memory use, prompt sizes and trimming,
+    and the quest JSON validity rate.
+    """
+    return {
+        "pools": router.stats(),
+        "admission": admission.stats(),
+        "response_cache": response_cache.stats(),
+        "prompts": prompt_stats.stats(),
+        "quest_json": quest_json_validity()
+    }
@@ -0,0 +1,174 @@
+import re
+
+from dynquest.service.early_stop import PARAGRAPH_BREAK, SENTENCE_BOUNDARY
+
+FOURTH_WALL_PREFIXES = [
+    'You replied:',
+    'You reply:',
+    'The NPC replies:',
+    'The NPC said:',
+    'They respond:',
+    'The system says:',
+    'Assistant:'
+]
+
+# Paragraph openers that indicate out-of-character (OOC) behavior
+FILTER_STARTS = [
+    "Would you like me to",
+    "Here are a few ways",
+    "To help you",
+    "Let me know if",
+    "If you'd like",
+    "You could",
+    "We could",
+    "Here's how",
+    "Some options might be",
+    "Depending on your preferences",
+    "If you're going for",
+    "Do you want me to"
+]
+
+
+def process_response(mode: str, response: str, finish_reason: str) -> str:
+    if mode != "quest":
+        response = normalize_symbols(response or "")
+        response = filter_response(response or "", finish_reason)
+        response = strip_fourth_wall_intro(response or "")
+
+    return response
+
+
+class StreamFilter:
+    """
+    Incremental version of process_response() for streamed text.
+
+    Raw text is fed in as it is generated and complete sentences come out, each run through
+    normalize_symbols(). A paragraph whose first sentence opens like out-of-character text
+    is dropped entirely, and the fourth-wall prefix check is applied to the first sentence.
+    Because earlier sentences are already sent, a response cut off by the token limit only
+    loses its unfinished trailing sentence rather than the whole trailing paragraph.
+    """
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.buffer = ""
+        self.first_sentence = True
+        self.paragraph_start = True
+        self.skip_paragraph = False
+
+    def feed(self, text: str) -> list[str]:
+        if self.mode == "quest":
+            return [text] if text else []
+
+        self.buffer += text
+        return self.drain(final=False)
+
+    def finish(self, finish_reason: str) -> list[str]:
+        if self.mode == "quest":
+            return []
+
+        if finish_reason == "length":
+            # Discard the incomplete sentence cut off by the token limit.
+            self.buffer = ""
+
+        return self.drain(final=True)
+
+    def drain(self, final: bool) -> list[str]:
+        sentences = []
+
+        while True:
+            match = SENTENCE_BOUNDARY.search(self.buffer)
+
+            # Wait for more text if the boundary might still grow (e.g. "\n" turning into "\n\n").
+            if match and (final or match.end() < len(self.buffer)):
+                sentence, self.buffer = self.buffer[:match.end()], self.buffer[match.end():]
+                paragraph_break = bool(PARAGRAPH_BREAK.search(match.group()))
+            elif final and self.buffer.strip():
+                sentence, self.buffer = self.buffer, ""
+                paragraph_break = True
+            else:
+                break
+
+            sentence = self.clean(sentence)
+            if sentence:
+                sentences.append(sentence)
+
+            if paragraph_break:
+                self.paragraph_start = True
+                self.skip_paragraph = False
+
+        return sentences
+
+    def clean(self, sentence: str) -> str:
+        sentence = normalize_symbols(sentence).strip()
+        if not sentence:
+            return ""
+
+        if self.paragraph_start:
+            self.paragraph_start = False
+            self.skip_paragraph = is_out_of_character(sentence)
+
+        if self.skip_paragraph:
+            return ""
+
+        if self.first_sentence:
+            self.first_sentence = False
+            sentence = strip_fourth_wall_intro(sentence)
+
+        return sentence
+
+
+def is_out_of_character(paragraph: str) -> bool:
+    """
+    True if the paragraph opens like meta/instructional text rather than in-character dialogue.
+    """
+    return any(paragraph.strip().lower().startswith(start.lower()) for start in FILTER_STARTS)
+
+def filter_response(response: str, finish_reason: str) -> str:
+    """
+    Removes paragraphs that are likely out-of-character or meta/instructional.
+    """
+    # Split into paragraphs
+    paragraphs = re.split(r"\n\s*\n", response)
+
+    # Keep only in-character lines
+    filtered = [para for para in paragraphs if not is_out_of_character(para)]
+
+                # When the response was truncated due to the token limit eliminate the final (incomplete) paragraph.
+    if finish_reason == "length" and len(paragraphs) > 1:
+        filtered_response = "\n\n".join(paragraphs[:-1]).strip()
+    else:
+        filtered_response = "\n\n".join(filtered).strip()
+
+    return filtered_response
+
+def normalize_symbols(text: str) -> str:
+    return (
+        text.replace("“", '"')
+            .replace("”", '"')
+            .replace("‘", "'")
+            .replace("’", "'")
+            .replace("…", "...")    # ellipsis
+            .replace("—", "-")      # em-dash
+            .replace("–", "-")      # en-dash
+            .replace("**", "")      # Emphasis
+
+    )
+
+def strip_fourth_wall_intro(text):
+    # Normalize smart quotes to straight quotes
+    text = text.replace('“', '"').replace('”', '"')
+
+    # Check for any defined prefix and remove it
+    for prefix in FOURTH_WALL_PREFIXES:
+        # Check for prefix with optional quote immediately after
+        pattern = rf'^{re.escape(prefix)}\s*["\']?'
+        if re.match(pattern, text):
+            # Remove the prefix + optional opening quote
+            cleaned = re.sub(pattern, '', text, count=1)
+            # Remove a trailing quote if it exists
+            if cleaned.endswith('"') or cleaned.endswith("'"):
+                cleaned = cleaned[:-1]
+            return cleaned.strip()
+
+    return text
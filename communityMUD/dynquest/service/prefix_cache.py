@@ -0,0 +1,108 @@
+import ctypes
+import threading
+from collections import OrderedDict
+
+import llama_cpp
+
+
+class PrefixEntry:
+    """
+    A saved llama.cpp sequence state covering exactly `tokens`.
+    """
+
+    def __init__(self, tokens: list[int], state):
+        self.tokens = tokens
+        self.state = state
+
+    @property
+    def size(self) -> int:
+        return len(self.state)
+
+
+class PrefixCache:
+    """
+    LRU cache of sequence state snapshots for recurring prompt prefixes (instructions + persona).
+
+    Entries are keyed by caller-chosen keys such as (mode, persona). A lookup only counts as a hit
+    when the cached tokens are a strict prefix of the new prompt, so a changed persona or
+    instruction block simply misses and is re-snapshotted. The least recently used entries are
+    evicted once the total snapshot size exceeds max_bytes.
+
+    Args:
+        max_bytes: Memory budget for all snapshots together.
+        min_tokens: Prefixes shorter than this are not worth snapshotting.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024, min_tokens: int = 32):
+        self.max_bytes = max_bytes
+        self.min_tokens = min_tokens
+        self.entries: OrderedDict = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, key, prompt_tokens: list[int]):
+        """
+        Returns the entry for key if it is a usable prefix of prompt_tokens, otherwise None.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and len(entry.tokens) < len(prompt_tokens) and prompt_tokens[:len(entry.tokens)] == entry.tokens:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+            self.misses += 1
+            return None
+
+    def store(self, key, tokens: list[int], state):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old:
+                self.bytes -= old.size
+
+            entry = PrefixEntry(list(tokens), state)
+            if entry.size > self.max_bytes:
+                return
+
+            self.entries[key] = entry
+            self.bytes += entry.size
+
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.size
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def save_sequence_state(ctx, seq_id: int):
+    """
+    Copies the KV cache state of one sequence out of a llama.cpp context.
+    """
+    size = llama_cpp.llama_state_seq_get_size(ctx, seq_id)
+    state = (ctypes.c_uint8 * size)()
+    written = llama_cpp.llama_state_seq_get_data(ctx, state, size, seq_id)
+    if written != size:
+        raise RuntimeError(f"Sequence state copy wrote {written} of {size} bytes")
+    return state
+
+
+def load_sequence_state(ctx, seq_id: int, state) -> bool:
+    """
+    Restores a saved sequence state into seq_id. Returns False if llama.cpp rejected it.
+    """
+    return llama_cpp.llama_state_seq_set_data(ctx, state, len(state), seq_id) > 0
@@ -0,0 +1,110 @@
+import threading
+
+LORE_PREFIX = "Lore elements: "
+
+
+def lore_lines(lore: str) -> list[str]:
+    """
+    Splits the lore sent with a request into the units the budget keeps or drops, most relevant first.
+    """
+    return [line.strip() for line in (lore or "").split("\n") if line.strip()]
+
+
+def fit_prompt(instructions: list[dict], message: dict, turns: list[dict], lore: list[str], budget: int,
+               count_tokens, truncate_text, suffix: str = "") -> tuple[list[dict], dict]:
+    """
+    Assembles chat messages that fit a prompt token budget, filling it in priority order: the
+    instructions (persona), the current message, the most recent turns, then lore.
+
+    Every candidate prompt is measured whole with count_tokens, so chat template tokens are
+    counted too. Turns are added newest first and stop at the first that does not fit, so the
+    prompt never skips part of the conversation. Lore lines are added most relevant first; a
+    line that does not fit is skipped and shorter ones after it are still tried. If the
+    instructions and the message alone exceed the budget, the end of the message is cut.
+
+    Args:
+        instructions (list[dict]): Messages that are always sent first.
+        message (dict): The current message, sent last.
+        turns (list[dict]): Earlier conversation, oldest first.
+        lore (list[str]): Lore lines, most relevant first. Sent as one system message after the instructions.
+        budget (int): Maximum prompt tokens.
+        count_tokens (callable): Returns the number of tokens of a list of messages, as formatted for the model.
+        truncate_text (callable): truncate_text(text, n) returns text with about n tokens removed from its end.
+        suffix (str): Appended to the message content after truncation, so it is never cut.
+
+    Returns:
+        The messages, and a report with the prompt's token count and what was dropped.
+    """
+    text = message["content"]
+    kept_turns = []
+    kept_lore = []
+
+    def assemble(candidate_turns, candidate_lore):
+        lore_message = [{"role": "system", "content": LORE_PREFIX + "\n".join(candidate_lore)}] if candidate_lore else []
+        return instructions + lore_message + candidate_turns + [{"role": message["role"], "content": text + suffix}]
+
+    tokens = count_tokens(assemble([], []))
+    truncated = False
+    while tokens > budget and text:
+        text = truncate_text(text, tokens - budget)
+        truncated = True
+        tokens = count_tokens(assemble([], []))
+
+    for turn in reversed(turns):
+        candidate = count_tokens(assemble([turn] + kept_turns, []))
+        if candidate > budget:
+            break
+        kept_turns.insert(0, turn)
+        tokens = candidate
+
+    for line in lore:
+        candidate = count_tokens(assemble(kept_turns, kept_lore + [line]))
+        if candidate <= budget:
+            kept_lore.append(line)
+            tokens = candidate
+
+    return assemble(kept_turns, kept_lore), {
+        "prompt_tokens": tokens,
+        "turns_dropped": len(turns) - len(kept_turns),
+        "lore_dropped": len(lore) - len(kept_lore),
+        "truncated": truncated
+    }
+
+
+class PromptBudgetStats:
+    """
+    Running totals of fit_prompt reports: how large prompts are and how often the budget cut them.
+    """
+
+    def __init__(self):
+        self.prompts = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.trimmed = 0
+        self.turns_dropped = 0
+        self.lore_dropped = 0
+        self.truncated = 0
+        self.lock = threading.Lock()
+
+    def record(self, report: dict):
+        with self.lock:
+            self.prompts += 1
+            self.prompt_tokens += report["prompt_tokens"]
+            self.max_prompt_tokens = max(self.max_prompt_tokens, report["prompt_tokens"])
+            self.turns_dropped += report["turns_dropped"]
+            self.lore_dropped += report["lore_dropped"]
+            self.truncated += int(report["truncated"])
+            if report["turns_dropped"] or report["lore_dropped"] or report["truncated"]:
+                self.trimmed += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "prompts": self.prompts,
+                "mean_prompt_tokens": round(self.prompt_tokens / self.prompts, 1) if self.prompts else 0.0,
+                "max_prompt_tokens": self.max_prompt_tokens,
+                "trimmed": self.trimmed,
+                "turns_dropped": self.turns_dropped,
+                "lore_dropped": self.lore_dropped,
+                "truncated": self.truncated,
+            }
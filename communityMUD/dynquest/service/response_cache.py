@@ -0,0 +1,143 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+ENTRY_OVERHEAD = 256        # Rough per-entry bookkeeping cost in bytes (key, dict, timestamps)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Collapses whitespace so prompts differing only in spacing share a cache entry.
+    """
+    return " ".join((text or "").split())
+
+
+def _field(msg, name: str) -> str:
+    return msg[name] if isinstance(msg, dict) else getattr(msg, name)
+
+
+def response_cache_key(mode: str, persona: str, messages: list, temp: float, max_tokens: int, lore: str = "") -> str:
+    """
+    Hashes the parts of a request that determine its response.
+
+    Args:
+        messages: Role/content pairs, as dicts or objects with role and content attributes.
+        lore: Lore sent alongside the messages.
+    """
+    normalized = {
+        "mode": mode,
+        "persona": normalize_text(persona),
+        "messages": [
+            [normalize_text(_field(msg, "role")).lower(), normalize_text(_field(msg, "content"))]
+            for msg in messages
+        ],
+        "lore": normalize_text(lore),
+        "temp": round(float(temp), 2),
+        "max_tokens": int(max_tokens),
+    }
+    encoded = json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class CachedResponse:
+    """
+    A finished /generate result and when it was stored.
+    """
+
+    def __init__(self, result: dict):
+        self.result = result
+        self.stored = time.monotonic()
+        self.size = len(json.dumps(result).encode("utf-8")) + ENTRY_OVERHEAD
+
+
+class ResponseCache:
+    """
+    LRU cache of finished responses with a time-to-live, bounded by an approximate byte budget.
+
+    Only modes switched on in enabled_modes are cached; callers check enabled() before
+    computing a key, so other modes never touch the cache or its hit rate.
+
+    Args:
+        max_bytes: Approximate memory budget for all cached responses.
+        ttl: Seconds a response stays valid.
+        enabled_modes: Mapping of mode name to whether its responses are cached.
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, ttl: float = 600, enabled_modes: dict = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled_modes = enabled_modes or {}
+        self.entries: OrderedDict = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def enabled(self, mode: str) -> bool:
+        return self.enabled_modes.get(mode, False)
+
+    def get(self, key: str):
+        """
+        Returns a copy of the cached result for key, or None if absent or stale.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.monotonic() - entry.stored > self.ttl:
+                self.remove(key)
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry.result)
+
+    def put(self, key: str, result: dict):
+        with self.lock:
+            self.remove(key)
+
+            entry = CachedResponse(dict(result))
+            if entry.size > self.max_bytes:
+                return
+
+            self.entries[key] = entry
+            self.bytes += entry.size
+
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.size
+                self.evictions += 1
+
+    def remove(self, key: str):
+        """Drops key if present. Caller holds the lock."""
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.bytes -= entry.size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled_modes": [mode for mode, enabled in self.enabled_modes.items() if enabled],
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
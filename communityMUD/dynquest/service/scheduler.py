@@ -0,0 +1,484 @@
+import codecs
+import itertools
+import queue
+import threading
+import time
+import traceback
+
+import llama_cpp
+from llama_cpp import Llama, llama_chat_format
+from llama_cpp import _internals as internals
+from dynquest.service.early_stop import EarlyStop
+from dynquest.service.prefix_cache import PrefixCache, load_sequence_state, save_sequence_state
+
+
+def chat_formatter(chat_format: str):
+    """
+    Looks up the llama_cpp prompt formatter for a chat format name (e.g. "gemma" -> format_gemma).
+
+    The scheduler tokenizes prompts itself, so it needs the formatter rather than the
+    chat completion handler that Llama.create_chat_completion() uses.
+    """
+    formatter = getattr(llama_chat_format, "format_" + chat_format.replace("-", "_").replace(".", "_"), None)
+    if formatter is None:
+        raise ValueError(f"No prompt formatter found for chat format '{chat_format}'")
+    return formatter
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised (as a request error) when the caller's deadline passed before the response was ready.
+    """
+
+
+class GenerationRequest:
+    """
+    A single prompt waiting for, or going through, the batch scheduler.
+
+    The request thread creates one of these, hands it to BatchScheduler.submit() and
+    then blocks on wait(). The scheduler thread fills in the result fields.
+
+    If a stream queue is given, each newly decoded piece of text is put on it as it is
+    produced, followed by None once the request finishes.
+
+    If prefix_key is given, the first prefix_len prompt tokens are a shared preamble that
+    the scheduler may restore from (or save to) its prefix cache under that key.
+
+    Requests with a lower priority number are admitted first. deadline is the Unix time at
+    which the caller stops waiting; after it, the request is dropped from the queue or
+    abandoned mid-generation. A streaming caller that has started receiving text is still
+    listening, so its deadline only applies until the first text is delivered. streaming
+    defaults to whether a stream queue is given.
+
+    grammar is optional GBNF text; when given, sampling only produces text the grammar accepts.
+
+    early_stop is an optional EarlyStop that ends generation once the rest would be discarded.
+    """
+
+    def __init__(self, prompt_tokens: list[int], max_tokens: int = 500, temp: float = 0.7, stop=None, stream=None,
+                 prefix_key=None, prefix_len: int = 0, priority: int = 0, deadline: float = None, streaming: bool = None,
+                 grammar: str = None, early_stop: EarlyStop = None):
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        self.temp = temp
+        self.stop = [s for s in (stop or []) if s]
+        self.stream = stream
+        self.streamed = 0                   # Characters of text already put on the stream
+        self.prefix_key = prefix_key
+        self.prefix_len = prefix_len
+        self.prefix_hit = False
+        self.priority = priority
+        self.deadline = deadline
+        self.streaming = stream is not None if streaming is None else streaming
+        self.grammar = grammar
+        self.early_stop = early_stop
+
+        self.completion_tokens: list[int] = []
+        self.text = ""
+        self.finish_reason = None
+        self.error = None
+
+        self.enqueued = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    @property
+    def queue_time(self) -> float:
+        """Seconds spent waiting for a free batch slot."""
+        return ((self.started or time.monotonic()) - self.enqueued)
+
+    @property
+    def generation_time(self) -> float:
+        """Seconds spent in the batch (prompt processing plus decoding)."""
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def wait(self, timeout=None) -> bool:
+        return self.done.wait(timeout)
+
+    def expired(self) -> bool:
+        """True once the caller has given up waiting for this request."""
+        if self.deadline is None or time.time() < self.deadline:
+            return False
+        return not (self.streaming and self.streamed)
+
+
+class _Sequence:
+    """
+    Scheduler-side state for a request that currently owns a sequence slot in the KV cache.
+    """
+
+    def __init__(self, request: GenerationRequest, seq_id: int, sampler):
+        self.request = request
+        self.seq_id = seq_id
+        self.sampler = sampler
+        self.prompt = list(request.prompt_tokens)    # Prompt tokens not yet evaluated
+        self.n_past = 0                              # Tokens already in the KV cache for this sequence
+        self.last_token = None                       # Sampled but not yet evaluated token
+        self.logits_index = None                     # Batch index holding the logits to sample from
+        self.snapshot_at = 0                         # Save a prefix snapshot once n_past reaches this
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+
+
+class BatchScheduler:
+    """
+    Queues generation requests and decodes several sequences together in one batched loop.
+
+    Each active request owns a sequence id in a shared llama.cpp context. Every step
+    evaluates one new token for each decoding sequence plus as much pending prompt as
+    still fits in n_batch, then samples the next token for every sequence that has logits.
+    New requests join between steps, so a long generation no longer blocks short ones.
+
+    Args:
+        llm: A loaded Llama. Its weights and tokenizer are shared; decoding happens in a
+            separate context sized for max_batch_size sequences of n_ctx tokens each.
+        max_batch_size: Maximum number of sequences decoded together.
+        max_wait: Seconds to wait for more requests before starting a batch from idle.
+        n_ctx: Context size available to each sequence.
+        prefix_cache: Optional PrefixCache used to skip prompt processing of shared preambles.
+    """
+
+    def __init__(self, llm: Llama, max_batch_size: int = 4, max_wait: float = 0.05, n_ctx: int = 4096,
+                 prefix_cache: PrefixCache = None):
+        self.llm = llm
+        self.prefix_cache = prefix_cache
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.n_ctx = n_ctx
+        self.n_batch = llm.n_batch
+
+        params = llama_cpp.llama_context_params.from_buffer_copy(llm.context_params)
+        params.n_ctx = n_ctx * max_batch_size
+        params.n_seq_max = max_batch_size
+        params.kv_unified = False
+        self.ctx = internals.LlamaContext(model=llm._model, params=params, verbose=llm.verbose)
+        self.batch = internals.LlamaBatch(n_tokens=self.n_batch, embd=0, n_seq_max=1, verbose=llm.verbose)
+        self.vocab = llm._model.vocab
+
+        self.pending = queue.PriorityQueue()       # (priority, arrival order, request)
+        self.arrivals = itertools.count()
+        self.active: list[_Sequence] = []
+        self.free_slots = list(range(max_batch_size))
+
+        self.lock = threading.Lock()     # Guards the counters below
+        self.completed = 0
+        self.completion_tokens = 0
+        self.prompt_tokens = 0
+        self.busy_time = 0.0
+        self.total_queue_time = 0.0
+        self.expired = 0
+        self.early_stops = 0
+
+        self.thread = threading.Thread(target=self.run, name="llm-batch-scheduler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, request: GenerationRequest) -> GenerationRequest:
+        """
+        Queues a request for generation. Raises ValueError if it can never fit in a sequence.
+        """
+        if not request.prompt_tokens:
+            raise ValueError("Cannot generate from an empty prompt")
+        if len(request.prompt_tokens) + 1 > self.n_ctx:
+            raise ValueError(
+                f"Requested tokens ({len(request.prompt_tokens)}) exceed context window of {self.n_ctx}"
+            )
+        request.enqueued = time.monotonic()
+        self.pending.put((request.priority, next(self.arrivals), request))
+        return request
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "active": len(self.active),
+                "queued": self.pending.qsize(),
+                "completed": self.completed,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "busy_time": round(self.busy_time, 3),
+                "tokens_per_second": round(self.completion_tokens / self.busy_time, 2) if self.busy_time else 0.0,
+                "tokens_per_request": round(self.completion_tokens / self.completed, 1) if self.completed else 0.0,
+                "early_stops": self.early_stops,
+                "avg_queue_time": round(self.total_queue_time / self.completed, 3) if self.completed else 0.0,
+                "expired": self.expired,
+            }
+
+    # --------------------------
+    # Scheduler thread
+    # --------------------------
+
+    def run(self):
+        while True:
+            self.admit()
+            if not self.active:
+                continue
+
+            step_start = time.monotonic()
+            try:
+                self.step()
+            except Exception as e:
+                print(f"[BatchScheduler] Batch step failed: {e}")
+                traceback.print_exc()
+                for seq in list(self.active):
+                    self.finish(seq, None, error=e)
+            with self.lock:
+                self.busy_time += time.monotonic() - step_start
+
+    def admit(self):
+        """
+        Moves queued requests into free sequence slots. Blocks only when nothing is running.
+        """
+        free = len(self.free_slots)
+        if free == 0:
+            return
+
+        incoming = []
+        if not self.active:
+            # Idle: wait for the first request, then give others a short window to join it.
+            incoming.append(self.next_pending())
+            deadline = time.monotonic() + self.max_wait
+            while len(incoming) < free:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    incoming.append(self.next_pending(timeout=remaining))
+                except queue.Empty:
+                    break
+        else:
+            while len(incoming) < free:
+                try:
+                    incoming.append(self.next_pending(block=False))
+                except queue.Empty:
+                    break
+
+        for request in incoming:
+            self.start_sequence(request)
+
+    def next_pending(self, block: bool = True, timeout=None) -> GenerationRequest:
+        """
+        Takes the most urgent queued request, dropping any whose caller has already given up.
+        Raises queue.Empty like Queue.get().
+        """
+        while True:
+            _, _, request = self.pending.get(block, timeout)
+            if not request.expired():
+                return request
+
+            print(f"[BatchScheduler] Dropping request queued for {request.queue_time:.1f}s: deadline passed")
+            with self.lock:
+                self.expired += 1
+            self.reject(request, DeadlineExceeded("Deadline passed while queued"))
+
+    def reject(self, request: GenerationRequest, error: Exception):
+        """
+        Completes a request that never got a sequence slot.
+        """
+        request.error = error
+        request.finished = time.monotonic()
+
+        if request.stream is not None:
+            request.stream.put(None)
+        request.done.set()
+
+    def start_sequence(self, request: GenerationRequest):
+        try:
+            sampler = self.make_sampler(request)
+        except Exception as e:
+            print(f"[BatchScheduler] Could not set up sampling: {e}")
+            self.reject(request, e)
+            return
+
+        seq_id = self.free_slots.pop(0)
+        self.ctx.kv_cache_seq_rm(seq_id, -1, -1)
+
+        request.started = time.monotonic()
+        seq = _Sequence(request, seq_id, sampler)
+        self.active.append(seq)
+
+        if self.prefix_cache and request.prefix_key is not None and request.prefix_len >= self.prefix_cache.min_tokens:
+            self.restore_prefix(seq)
+
+    def restore_prefix(self, seq: _Sequence):
+        """
+        Loads the cached KV state for the request's prefix, or arranges for it to be saved.
+        """
+        request = seq.request
+        entry = self.prefix_cache.lookup(request.prefix_key, request.prompt_tokens)
+
+        if entry and load_sequence_state(self.ctx.ctx, seq.seq_id, entry.state):
+            seq.n_past = len(entry.tokens)
+            seq.prompt = seq.prompt[seq.n_past:]
+            request.prefix_hit = True
+            return
+
+        if entry:
+            print(f"[BatchScheduler] Could not restore prefix state for {request.prefix_key}")
+            self.ctx.kv_cache_seq_rm(seq.seq_id, -1, -1)
+
+        if request.prefix_len < len(request.prompt_tokens):
+            seq.snapshot_at = request.prefix_len
+
+    def make_sampler(self, request: GenerationRequest):
+        # Mirrors the create_chat_completion() sampling defaults.
+        sampler = internals.LlamaSampler()
+        if request.grammar:
+            # The grammar goes first so the later samplers only see tokens it allows.
+            grammar = llama_cpp.llama_sampler_init_grammar(self.vocab, request.grammar.encode("utf-8"), b"root")
+            if not grammar:
+                sampler.close()
+                raise ValueError("Invalid grammar")
+            llama_cpp.llama_sampler_chain_add(sampler.sampler, grammar)
+
+        if request.temp <= 0:
+            sampler.add_greedy()
+        else:
+            sampler.add_top_k(40)
+            sampler.add_top_p(0.95, 1)
+            sampler.add_min_p(0.05, 1)
+            sampler.add_temp(request.temp)
+            sampler.add_dist(llama_cpp.LLAMA_DEFAULT_SEED)
+        return sampler
+
+    def batch_add(self, token: int, pos: int, seq_id: int, logits: bool) -> int:
+        batch = self.batch.batch
+        i = batch.n_tokens
+        batch.token[i] = token
+        batch.pos[i] = pos
+        batch.seq_id[i][0] = seq_id
+        batch.n_seq_id[i] = 1
+        batch.logits[i] = logits
+        batch.n_tokens += 1
+        return i
+
+    def step(self):
+        """
+        Evaluates one batch: a token for each decoding sequence, then prompt chunks.
+        """
+        for seq in [seq for seq in self.active if seq.request.expired()]:
+            print(f"[BatchScheduler] Abandoning generation after {len(seq.request.completion_tokens)} tokens: deadline passed")
+            with self.lock:
+                self.expired += 1
+            self.finish(seq, None, error=DeadlineExceeded("Deadline passed during generation"))
+        if not self.active:
+            return
+
+        self.batch.reset()
+        ready = []
+
+        for seq in self.active:
+            if not seq.prompt and seq.last_token is not None:
+                seq.logits_index = self.batch_add(seq.last_token, seq.n_past, seq.seq_id, True)
+                seq.n_past += 1
+                ready.append(seq)
+
+        capacity = self.n_batch - self.batch.n_tokens()
+        for seq in self.active:
+            if not seq.prompt or capacity <= 0:
+                continue
+            take = capacity
+            if seq.snapshot_at > seq.n_past:
+                # Stop exactly at the prefix boundary so the snapshot holds only the shared tokens.
+                take = min(take, seq.snapshot_at - seq.n_past)
+            chunk, seq.prompt = seq.prompt[:take], seq.prompt[take:]
+            for j, token in enumerate(chunk):
+                last = (j == len(chunk) - 1) and not seq.prompt
+                index = self.batch_add(token, seq.n_past, seq.seq_id, last)
+                seq.n_past += 1
+            capacity -= len(chunk)
+            with self.lock:
+                self.prompt_tokens += len(chunk)
+            if not seq.prompt:
+                seq.logits_index = index
+                ready.append(seq)
+
+        if self.batch.n_tokens() == 0:
+            return
+
+        self.ctx.decode(self.batch)
+
+        for seq in self.active:
+            if seq.snapshot_at and seq.n_past == seq.snapshot_at:
+                seq.snapshot_at = 0
+                self.prefix_cache.store(
+                    seq.request.prefix_key,
+                    seq.request.prompt_tokens[:seq.n_past],
+                    save_sequence_state(self.ctx.ctx, seq.seq_id)
+                )
+
+        for seq in ready:
+            token = llama_cpp.llama_sampler_sample(seq.sampler.sampler, self.ctx.ctx, seq.logits_index)
+            self.accept(seq, token)
+
+    def accept(self, seq: _Sequence, token: int):
+        request = seq.request
+
+        if llama_cpp.llama_vocab_is_eog(self.vocab, token):
+            self.finish(seq, "stop")
+            return
+
+        request.completion_tokens.append(token)
+        request.text += seq.decoder.decode(self.llm._model.detokenize([token]))
+
+        for stop in request.stop:
+            cut = request.text.find(stop)
+            if cut >= 0:
+                request.text = request.text[:cut]
+                self.finish(seq, "stop")
+                return
+
+        if request.early_stop:
+            cut = request.early_stop.cut(request.text)
+            if cut is not None:
+                request.text = request.text[:cut]
+                with self.lock:
+                    self.early_stops += 1
+                self.finish(seq, "stop")
+                return
+
+        if len(request.completion_tokens) >= request.max_tokens or seq.n_past + 1 >= self.n_ctx:
+            self.finish(seq, "length")
+            return
+
+        hold = max((len(stop) for stop in request.stop), default=1) - 1
+        if request.early_stop:
+            hold = max(hold, request.early_stop.hold(request.text))
+        self.stream_text(request, hold=hold)
+        seq.last_token = token
+
+    def stream_text(self, request: GenerationRequest, hold: int = 0):
+        """
+        Puts newly decoded text on the request's stream, holding back the last `hold`
+        characters in case they turn out to be the start of a stop string.
+        """
+        if request.stream is None:
+            return
+        end = max(request.streamed, len(request.text) - hold)
+        if end > request.streamed:
+            request.stream.put(request.text[request.streamed:end])
+            request.streamed = end
+
+    def finish(self, seq: _Sequence, finish_reason, error=None):
+        request = seq.request
+        request.finish_reason = finish_reason
+        request.error = error
+        request.finished = time.monotonic()
+
+        self.active.remove(seq)
+        self.ctx.kv_cache_seq_rm(seq.seq_id, -1, -1)
+        self.free_slots.append(seq.seq_id)
+        seq.sampler.close()
+
+        with self.lock:
+            self.completed += 1
+            self.completion_tokens += len(request.completion_tokens)
+            self.total_queue_time += request.queue_time
+
+        self.stream_text(request)
+        if request.stream is not None:
+            request.stream.put(None)
+        request.done.set()
@@ -0,0 +1,327 @@
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+
+from dynquest.service.scheduler import DeadlineExceeded
+
+# Worker processes are started with "spawn" (the only option on Windows), so anything a worker
+# needs must be importable from this module without pulling in llm_service and its FastAPI app.
+MP_CONTEXT = multiprocessing.get_context("spawn")
+STATS_INTERVAL = 2          # Seconds between stats reports from each worker
+
+
+class _Relay:
+    """
+    Stands in for a GenerationRequest's stream queue inside a worker, forwarding
+    text (if wanted) and the final result to the pool's outbox.
+    """
+
+    def __init__(self, outbox, worker_id: int, job_id: int, forward_text: bool):
+        self.outbox = outbox
+        self.worker_id = worker_id
+        self.job_id = job_id
+        self.forward_text = forward_text
+        self.request = None
+
+    def put(self, delta):
+        if delta is not None:
+            if self.forward_text:
+                self.outbox.put(("text", self.job_id, delta))
+            return
+
+        request = self.request
+        self.outbox.put(("done", self.job_id, {
+            "worker": self.worker_id,
+            "text": request.text,
+            "finish_reason": request.finish_reason,
+            "error": str(request.error) if request.error else None,
+            "deadline_exceeded": isinstance(request.error, DeadlineExceeded),
+            "completion_tokens": len(request.completion_tokens),
+            "queue_time": request.queue_time,
+            "generation_time": request.generation_time,
+            "prefix_hit": request.prefix_hit,
+        }))
+
+
+def load_scheduler(config: dict):
+    """
+    Loads the model and starts a batch scheduler with its own prefix cache.
+    """
+    from llama_cpp import Llama
+    from dynquest.service.prefix_cache import PrefixCache
+    from dynquest.service.scheduler import BatchScheduler
+
+    # The Llama instance supplies weights and tokenizer; decoding happens in the scheduler's own
+    # batched context, so this context is kept minimal. Weights are mmapped, so workers loading the
+    # same file share the page cache.
+    llm = Llama(
+        model_path=config["model_path"],
+        n_ctx=512,
+        n_threads=config["n_threads"],
+        n_gpu_layers=config["n_gpu_layers"],
+        chat_format=config["chat_format"],
+        use_mmap=True
+    )
+
+    scheduler = BatchScheduler(
+        llm,
+        max_batch_size=config["max_batch_size"],
+        max_wait=config["max_batch_wait"],
+        n_ctx=config["n_ctx"],
+        prefix_cache=PrefixCache(max_bytes=config["prefix_cache_bytes"])
+    )
+    scheduler.start()
+    return scheduler
+
+
+def worker_main(worker_id: int, config: dict, inbox, outbox):
+    """
+    Entry point of a model worker process: takes job specs from inbox until it receives None.
+    """
+    from dynquest.service.early_stop import EarlyStop
+    from dynquest.service.scheduler import GenerationRequest
+
+    scheduler = load_scheduler(config)
+    outbox.put(("ready", worker_id, None))
+
+    def report_stats():
+        while True:
+            outbox.put(("stats", worker_id, {
+                "scheduler": scheduler.stats(),
+                "prefix_cache": scheduler.prefix_cache.stats()
+            }))
+            time.sleep(STATS_INTERVAL)
+
+    threading.Thread(target=report_stats, name="llm-worker-stats", daemon=True).start()
+
+    while (spec := inbox.get()) is not None:
+        relay = _Relay(outbox, worker_id, spec["id"], spec["stream"])
+        request = GenerationRequest(
+            spec["prompt_tokens"],
+            max_tokens=spec["max_tokens"],
+            temp=spec["temp"],
+            stop=spec["stop"],
+            stream=relay,
+            prefix_key=spec["prefix_key"],
+            prefix_len=spec["prefix_len"],
+            priority=spec.get("priority", 0),
+            deadline=spec.get("deadline"),
+            streaming=spec["stream"],
+            grammar=spec.get("grammar"),
+            early_stop=EarlyStop(**spec["early_stop"]) if spec.get("early_stop") else None
+        )
+        relay.request = request
+
+        try:
+            scheduler.submit(request)
+        except Exception as e:
+            outbox.put(("done", spec["id"], {"worker": worker_id, "error": str(e)}))
+
+
+class RemoteGeneration:
+    """
+    Main-process handle for a job running in a worker. Mirrors the GenerationRequest fields
+    that llm_service reads, so endpoints do not care where the generation happens.
+    """
+
+    def __init__(self, job_id: int, stream=None):
+        self.id = job_id
+        self.stream = stream
+        self.worker = None
+        self.text = ""
+        self.finish_reason = None
+        self.error = None
+        self.completion_tokens = 0
+        self.queue_time = 0.0
+        self.generation_time = 0.0
+        self.prefix_hit = False
+        self.submitted = time.monotonic()
+        self.done = threading.Event()
+
+    def wait(self, timeout=None) -> bool:
+        return self.done.wait(timeout)
+
+    def finish(self, result: dict):
+        self.worker = result.get("worker")
+        self.text = result.get("text", "")
+        self.finish_reason = result.get("finish_reason")
+        if result.get("deadline_exceeded"):
+            self.error = DeadlineExceeded(result["error"])
+        elif result.get("error"):
+            self.error = RuntimeError(result["error"])
+        else:
+            self.error = None
+        self.completion_tokens = result.get("completion_tokens", 0)
+        self.queue_time = result.get("queue_time", 0.0)
+        self.generation_time = result.get("generation_time", 0.0)
+        self.prefix_hit = result.get("prefix_hit", False)
+
+        if self.stream is not None:
+            self.stream.put(None)
+        self.done.set()
+
+
+class WorkerPool:
+    """
+    Supervises a fixed number of model worker processes and spreads jobs across them.
+
+    Each job goes to the worker with the fewest jobs in flight. A dispatcher thread routes
+    results back to their RemoteGeneration and restarts any worker that dies, failing the
+    jobs that were running on it.
+
+    Args:
+        name: Pool name used in logs and stats (e.g. "npc").
+        size: Number of worker processes.
+        config: Model and scheduler settings passed to load_scheduler() in each worker.
+    """
+
+    def __init__(self, name: str, size: int, config: dict):
+        self.name = name
+        self.size = size
+        self.config = config
+        self.outbox = MP_CONTEXT.Queue()
+        self.inboxes = [None] * size
+        self.processes = [None] * size
+        self.ready = [False] * size
+        self.worker_stats = [{} for _ in range(size)]
+
+        self.jobs = {}                  # job id -> (worker index, RemoteGeneration)
+        self.job_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.running = False
+        self.dispatcher = threading.Thread(target=self.dispatch, name=f"llm-pool-{name}", daemon=True)
+
+    def start(self):
+        self.running = True
+        for index in range(self.size):
+            self.spawn(index)
+        self.dispatcher.start()
+
+    def spawn(self, index: int):
+        print(f"[WorkerPool:{self.name}] Starting worker {index}")
+        self.ready[index] = False
+        # A worker killed while blocked on its inbox can leave that queue's lock held, so every
+        # (re)start gets a fresh inbox.
+        self.inboxes[index] = MP_CONTEXT.Queue()
+        process = MP_CONTEXT.Process(
+            target=worker_main,
+            args=(index, self.config, self.inboxes[index], self.outbox),
+            name=f"llm-{self.name}-{index}",
+            daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+
+    def stop(self):
+        self.running = False
+        for inbox in self.inboxes:
+            if inbox is not None:
+                inbox.put(None)
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+
+    def load(self, index: int) -> int:
+        return sum(1 for worker, _ in self.jobs.values() if worker == index)
+
+    def submit(self, spec: dict, stream=None) -> RemoteGeneration:
+        """
+        Sends a job spec (see worker_main) to the least busy worker.
+        """
+        with self.lock:
+            job = RemoteGeneration(next(self.job_ids), stream=stream)
+            index = min(range(self.size), key=self.load)
+            self.jobs[job.id] = (index, job)
+            self.inboxes[index].put(dict(spec, id=job.id, stream=stream is not None))
+
+        return job
+
+    def dispatch(self):
+        while self.running:
+            try:
+                kind, key, payload = self.outbox.get(timeout=1)
+            except queue.Empty:
+                self.check_workers()
+                continue
+
+            try:
+                if kind == "text":
+                    with self.lock:
+                        entry = self.jobs.get(key)
+                    if entry and entry[1].stream is not None:
+                        entry[1].stream.put(payload)
+                elif kind == "done":
+                    with self.lock:
+                        entry = self.jobs.pop(key, None)
+                    if entry:
+                        entry[1].finish(payload)
+                elif kind == "stats":
+                    self.worker_stats[key] = payload
+                elif kind == "ready":
+                    self.ready[key] = True
+                    print(f"[WorkerPool:{self.name}] Worker {key} ready")
+            except Exception as e:
+                print(f"[WorkerPool:{self.name}] Error dispatching {kind}: {e}")
+                traceback.print_exc()
+
+            self.check_workers()
+
+    def check_workers(self):
+        for index, process in enumerate(self.processes):
+            if not self.running or process is None or process.is_alive():
+                continue
+
+            print(f"[WorkerPool:{self.name}] Worker {index} exited with code {process.exitcode}; restarting")
+            with self.lock:
+                lost = [job_id for job_id, (worker, _) in self.jobs.items() if worker == index]
+                failed = [self.jobs.pop(job_id)[1] for job_id in lost]
+                self.spawn(index)
+            for job in failed:
+                job.finish({"worker": index, "error": "LLM worker exited"})
+
+    def stats(self) -> dict:
+        with self.lock:
+            in_flight = [self.load(index) for index in range(self.size)]
+        return {
+            "workers": self.size,
+            "ready": sum(self.ready),
+            "in_flight": in_flight,
+            "worker_stats": self.worker_stats,
+        }
+
+
+class Router:
+    """
+    Sends each request to the pool configured for its mode, so long quest extractions
+    cannot occupy the workers that serve NPC dialogue.
+
+    Args:
+        pools: Mapping of mode name to WorkerPool. Modes without a pool use default_mode's pool.
+        default_mode: Mode whose pool handles unknown modes.
+    """
+
+    def __init__(self, pools: dict, default_mode: str = "npc"):
+        self.pools = pools
+        self.default_mode = default_mode
+
+    def pool_for(self, mode: str) -> WorkerPool:
+        return self.pools.get(mode) or self.pools[self.default_mode]
+
+    def submit(self, mode: str, spec: dict, stream=None) -> RemoteGeneration:
+        return self.pool_for(mode).submit(spec, stream=stream)
+
+    def start(self):
+        for pool in self.pools.values():
+            pool.start()
+
+    def stop(self):
+        for pool in self.pools.values():
+            pool.stop()
+
+    def stats(self) -> dict:
+        return {mode: pool.stats() for mode, pool in self.pools.items()}
@@ -0,0 +1,44 @@
+from unittest.mock import patch
+from evennia.utils.test_resources import EvenniaTestCase
+from dynquest.service.admission import AdmissionControl, Overloaded
+
+
+class TestAdmissionControl(EvenniaTestCase):
+
+    def test_limits_are_per_mode(self):
+        admission = AdmissionControl({"npc": 2, "quest": 1})
+
+        admission.admit("npc")
+        admission.admit("npc")
+        admission.admit("quest")
+
+        with self.assertRaises(Overloaded) as refused:
+            admission.admit("npc")
+        self.assertEqual(refused.exception.mode, "npc")
+        self.assertRaises(Overloaded, admission.admit, "quest")
+
+        stats = admission.stats()
+        self.assertEqual((stats["npc"]["in_flight"], stats["npc"]["admitted"], stats["npc"]["rejected"]), (2, 2, 1))
+        self.assertEqual(stats["quest"]["rejected"], 1)
+
+    def test_release_frees_a_slot_and_sets_the_estimate(self):
+        admission = AdmissionControl({"npc": 1}, smoothing=0.5)
+
+        with patch("dynquest.service.admission.time.monotonic", return_value=100.0):
+            admitted = admission.admit("npc")
+        with self.assertRaises(Overloaded) as refused:
+            admission.admit("npc")
+        self.assertEqual(refused.exception.retry_after, 1)
+
+        with patch("dynquest.service.admission.time.monotonic", return_value=104.5):
+            admission.release("npc", admitted)
+        self.assertEqual(admission.stats()["npc"]["mean_latency"], 4.5)
+
+        admitted = admission.admit("npc")
+        with self.assertRaises(Overloaded) as refused:
+            admission.admit("npc")
+        self.assertEqual(refused.exception.retry_after, 5)
+
+        with patch("dynquest.service.admission.time.monotonic", return_value=admitted + 1.5):
+            admission.release("npc", admitted)
+        self.assertEqual(admission.stats()["npc"]["mean_latency"], 3.0)
@@ -0,0 +1,135 @@
+from unittest.mock import patch
+from twisted.internet.defer import Deferred, succeed
+from evennia.utils import create
+from evennia.utils.test_resources import EvenniaTest
+from dynquest.analysis import ANALYSIS_SCRIPT_KEY, QuestAnalysisScript, analysis_script, retry_analysis
+from dynquest.breaker import CircuitBreaker
+from dynquest.classifier import QuestClassifier
+from dynquest.helpers import QuestEval
+import dynquest.genpc
+
+
+class TestQuestAnalysisQueue(EvenniaTest):
+
+    def setUp(self):
+        super().setUp()
+        print(f"Running test: {self._testMethodName}")
+
+        self.npc = create.create_object(dynquest.genpc.GenPC, key="Quartermaster", location=self.room1)
+        self.npc.db.quest_giver = True
+        self.npc.db.persona = "a quartermaster"
+        self.script = create.create_script(QuestAnalysisScript, autostart=False)
+
+        breaker = patch("dynquest.genpc._model_breaker", CircuitBreaker(probe=lambda: False))
+        breaker.start()
+        self.addCleanup(breaker.stop)
+
+        self.started = []
+
+        def fake_defer(func, text, *args, **kwargs):
+            d = Deferred()
+            self.started.append((d, text))
+            return d
+
+        defer = patch("dynquest.analysis.threads.deferToThread", side_effect=fake_defer)
+        defer.start()
+        self.addCleanup(defer.stop)
+
+    def queue(self, text):
+        return QuestEval(text).queue_analysis(player=self.account, persona="a quartermaster", npc=self.npc)
+
+    def test_quest_response_is_queued(self):
+        with patch("dynquest.analysis.analysis_script", return_value=self.script), \
+                patch.object(dynquest.genpc.QUEST_CLASSIFIER, "is_quest_async", side_effect=lambda text: succeed("must" in text)):
+            entries = []
+            self.npc.at_quest_response("You must find the lost ledger and bring back its pages.", self.account).addCallback(entries.append)
+            self.npc.at_quest_response("Fine weather today.", self.account).addCallback(entries.append)
+
+        self.assertEqual(entries[0].status, "analyzing")
+        self.assertEqual(entries[0].raw_data["persona"], "a quartermaster")
+        self.assertEqual(len(self.started), 1)
+        self.assertIsNone(entries[1])
+
+    def test_classification_waits_for_embeddings(self):
+        """
+        Quest responses are classified with embeddings computed off the reactor.
+        """
+        pending = []
+
+        def fake_embed_async(texts):
+            pending.append(Deferred())
+            return pending[-1]
+
+        classifier = QuestClassifier(quest_exemplars=["You must go."], other_exemplars=["Fine weather."], top_k=1,
+                                     embed_fn=lambda texts: self.fail("embedded on the reactor"),
+                                     embed_async_fn=fake_embed_async)
+        with patch("dynquest.analysis.analysis_script", return_value=self.script), \
+                patch("dynquest.genpc.QUEST_CLASSIFIER", classifier):
+            entries = []
+            self.npc.at_quest_response("You must find the lost ledger.", self.account).addCallback(entries.append)
+            self.assertEqual(entries, [])
+
+            pending[0].callback([[1.0, 0.0], [0.0, 1.0]])    # exemplars
+            self.assertEqual(entries, [])
+            pending[1].callback([[1.0, 0.1]])                # the response
+
+        self.assertEqual(entries[0].status, "analyzing")
+
+    def test_drain_is_bounded_and_saves_quests(self):
+        entries = [self.queue(f"You must find relic {n} and bring back its shards.") for n in range(3)]
+
+        self.script.drain()
+        self.assertEqual([text for _, text in self.started], [entry.raw_data["originating_response"] for entry in entries[:2]])
+
+        # Slots are full until a job finishes
+        self.script.drain()
+        self.assertEqual(len(self.started), 2)
+
+        self.started[0][0].callback({"title": "The First Relic", "quest": {}})
+        entries[0].refresh_from_db()
+        self.assertEqual(entries[0].status, "pending")
+        self.assertEqual(entries[0].title, "The First Relic")
+
+        self.script.drain()
+        self.assertEqual(len(self.started), 3)
+        self.assertEqual(self.started[2][1], entries[2].raw_data["originating_response"])
+
+    def test_failed_analysis_can_be_retried(self):
+        entry = self.queue("You must track the smugglers and recover the cargo.")
+
+        for attempt in range(QuestAnalysisScript.MAX_ATTEMPTS):
+            self.script.drain()
+            self.started[-1][0].errback(RuntimeError("LLM unavailable"))
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, "analysis_failed")
+        self.assertEqual(entry.raw_data["attempts"], QuestAnalysisScript.MAX_ATTEMPTS)
+        self.assertEqual(entry.raw_data["last_error"], "LLM unavailable")
+
+        self.script.drain()
+        self.assertEqual(len(self.started), QuestAnalysisScript.MAX_ATTEMPTS)
+
+        retry_analysis(entry)
+        self.script.drain()
+        self.assertEqual(len(self.started), QuestAnalysisScript.MAX_ATTEMPTS + 1)
+
+    def test_busy_service_keeps_job_queued(self):
+        entry = self.queue("You must carry the dispatch to the border fort.")
+
+        self.script.drain()
+        self.started[-1][0].errback(dynquest.genpc.ModelServiceBusy(5))
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, "analyzing")
+        self.assertEqual(entry.raw_data["attempts"], 0)
+
+        self.script.drain()
+        self.assertEqual(len(self.started), 2)
+
+    def test_script_is_created_on_demand(self):
+        self.script.delete()
+
+        script = analysis_script()
+        self.assertIsInstance(script, QuestAnalysisScript)
+        self.assertEqual(script.key, ANALYSIS_SCRIPT_KEY)
+        self.assertEqual(analysis_script().id, script.id)
@@ -0,0 +1,68 @@
+import threading
+import time
+from evennia.utils.test_resources import EvenniaTestCase
+from dynquest.breaker import CLOSED, OPEN, CircuitBreaker
+
+
+class TestCircuitBreaker(EvenniaTestCase):
+
+    def test_opens_after_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, cooldown=60)
+
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.stats()["refused"], 1)
+
+    def test_slow_calls_count_as_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, slow_call_seconds=5, cooldown=60)
+
+        breaker.record_success(1.0)
+        breaker.record_success()
+        breaker.record_success(30.0)
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_success(30.0)
+
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_back_off_refuses_without_opening(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+
+        breaker.back_off(60)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.stats()["recent_failures"], 0)
+
+        breaker.retry_at = 0.0
+        self.assertTrue(breaker.allow())
+
+    def test_probe_closes_breaker(self):
+        probed = threading.Event()
+        healthy = [False]
+
+        def probe():
+            probed.set()
+            return healthy[0]
+
+        breaker = CircuitBreaker(probe=probe, failure_threshold=1, cooldown=0)
+        breaker.record_failure()
+
+        # A failing probe keeps the breaker open
+        self.assertFalse(breaker.allow())
+        self.assertTrue(probed.wait(5))
+        self.wait_for(lambda: not breaker.probing)
+        self.assertEqual(breaker.state, OPEN)
+
+        healthy[0] = True
+        self.assertFalse(breaker.allow())
+        self.wait_for(lambda: breaker.state == CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
@@ -171,3 +171,14 @@ class TestBuilderGoalHandling(EvenniaTestCase):
         # Ensure quest was marked as built
         updated = QuestEntry.objects.get(quest_id=self.quest_id)
         self.assertEqual(updated.status, "built")
+
+    def test_inferred_locations_are_embedded_ahead(self):
+        self.quest_data["quest"]["locations"] = [{"key": "Old Mill", "desc": "A mill by the river."}]
+        self.quest_data["quest"]["goals"] += [
+            {"key": "Find the mill", "type": "findlocation", "target": "Old Mill"},
+            {"key": "Find the grove", "type": "findlocation", "target": "Ember Grove"},
+        ]
+        self.entry.raw_data = self.quest_data
+
+        texts = QuestBuilderScript.location_texts(self.entry)
+        self.assertEqual(texts[:2], ["A mill by the river.", "A mysterious place called Ember Grove."])
@@ -0,0 +1,97 @@
+import numpy as np
+from evennia.utils.test_resources import EvenniaTestCase
+from dynquest.classifier import QUEST_HELDOUT_SET, QuestClassifier, keyword_is_quest, keyword_score, passes_prefilter
+from dynquest.helpers import QuestEval
+
+
+class AxisEmbedder:
+    """Embeds texts on two axes: how much they ask something of the listener, and how much they just chat."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, texts):
+        self.calls += 1
+        return np.array([[text.count("must") + text.count("bring"), text.count("once") + text.count("weather")] for text in texts], dtype=np.float32)
+
+
+class TestQuestClassifier(EvenniaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.embedder = AxisEmbedder()
+        self.classifier = QuestClassifier(
+            quest_exemplars=["You must bring the ore.", "You must go."],
+            other_exemplars=["Once upon a time.", "Fine weather."],
+            top_k=1,
+            embed_fn=self.embedder,
+            prefilter=passes_prefilter
+        )
+
+    def test_scores_against_exemplars(self):
+        self.assertGreater(self.classifier.score("You must find the ledger."), 0)
+        self.assertLess(self.classifier.score("Once I found a ledger in fine weather."), 0)
+        self.assertTrue(self.classifier.is_quest("You must find the ledger."))
+        self.assertFalse(self.classifier.is_quest("Once I found a ledger."))
+
+    def test_exemplars_embedded_once(self):
+        self.classifier.score("You must find it.")
+        self.classifier.score("You must bring it.")
+        self.assertEqual(self.embedder.calls, 3)
+
+    def test_async_matches_blocking(self):
+        results = []
+        for text in ("You must find the ledger.", "Once I found a ledger.", "Good evening."):
+            self.classifier.is_quest_async(text).addCallback(results.append)
+        self.assertEqual(results, [True, False, False])
+        # The exemplars and the one response past the pre-filter
+        self.assertEqual(self.embedder.calls, 2)
+
+    def test_prefilter_skips_embedding(self):
+        self.assertFalse(self.classifier.is_quest("Good evening."))
+        self.assertEqual(self.embedder.calls, 0)
+
+    def test_evaluate_reports_precision_and_recall(self):
+        labeled = [("a", True), ("b", True), ("c", False), ("d", False)]
+        result = self.classifier.evaluate(labeled, predict=lambda text: text in ("a", "c"))
+
+        self.assertEqual((result["tp"], result["fp"], result["fn"], result["tn"]), (1, 1, 1, 1))
+        self.assertEqual(result["precision"], 0.5)
+        self.assertEqual(result["recall"], 0.5)
+        self.assertEqual(result["extractions"], 2)
+
+
+    def test_without_prefilter_every_response_is_scored(self):
+        classifier = QuestClassifier(quest_exemplars=["You must bring the ore."], other_exemplars=["Fine weather."],
+                                     top_k=1, embed_fn=self.embedder)
+        self.assertTrue(classifier.is_quest("Bring the ore, you must."))
+        self.assertFalse(classifier.is_quest("Good evening."))
+        self.assertEqual(self.embedder.calls, 3)
+
+    def test_separation_of_scores(self):
+        labeled = [("You must bring it.", True), ("You must go.", True), ("Once, in fine weather.", False)]
+        spread = self.classifier.separation(labeled)
+        self.assertGreater(spread["quest_min"], spread["other_max"])
+
+        # "You must go." has no baseline keyword, so it scores no higher than small talk
+        spread = self.classifier.separation(labeled, score=keyword_score)
+        self.assertEqual((spread["quest_min"], spread["other_max"]), (0, 0))
+
+    def test_held_out_precision_and_recall(self):
+        """
+        The pre-filter and the keyword baseline on responses neither was written from. Both miss
+        most quests, which is why QUEST_CLASSIFIER embeds every response.
+        """
+        baseline = self.classifier.evaluate(QUEST_HELDOUT_SET, predict=keyword_is_quest)
+        prefilter = self.classifier.evaluate(QUEST_HELDOUT_SET, predict=passes_prefilter)
+        self.assertEqual((baseline["precision"], baseline["recall"]), (0.0, 0.0))
+        self.assertEqual((prefilter["precision"], prefilter["recall"]), (0.25, 0.2))
+
+
+class TestQuestEvalPatterns(EvenniaTestCase):
+
+    def test_confidence_counts_matching_phrases(self):
+        dq = QuestEval("You must investigate the blight, and  bring back a cure. YOU MUST hurry.")
+        self.assertEqual(dq.quest_confidence_score(), 3)
+        self.assertTrue(dq.is_quest_worthy())
+        self.assertFalse(QuestEval("Good evening to you.").is_quest_worthy())
@@ -1,10 +1,11 @@
+from unittest.mock import patch
 from evennia.utils.create import create_object
 from evennia.accounts.models import AccountDB
 from evennia.commands.cmdhandler import cmdhandler
 from evennia.utils.test_resources import EvenniaTestCase
 from dynquest.models import QuestEntry
 from datetime import datetime, timedelta
-from dynquest.commands import CmdQuestStatus
+from dynquest.commands import CmdQuestQueue, CmdQuestStatus
 
 class TestCmdQuestStatus(EvenniaTestCase):
 
@@ -80,3 +81,48 @@ class TestCmdQuestStatus(EvenniaTestCase):
         self.assertIn("built", output)
         self.assertIn("error", output)
 
+
+
+class TestCmdQuestQueue(EvenniaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        print(f"Running test: {self._testMethodName}")
+
+        QuestEntry.objects.create(
+            quest_id="test_a1",
+            title="Lost Ledger",
+            status="analysis_failed",
+            raw_data={"originating_response": "Find the ledger.", "attempts": 3, "last_error": "LLM unavailable"}
+        )
+        QuestEntry.objects.create(
+            quest_id="test_a2",
+            title="Built Already",
+            status="built",
+            raw_data={"quest": {}}
+        )
+
+    def run_cmd(self, args="", switches=None):
+        cmd = CmdQuestQueue()
+        cmd.caller = None
+        cmd.args = args
+        cmd.switches = switches or []
+        responses = []
+        cmd.msg = lambda text=None, **kwargs: responses.append(str(text))
+        cmd.func()
+        return "\n".join(responses)
+
+    def test_cmd_questqueue_lists_and_retries(self):
+        output = self.run_cmd()
+        self.assertIn("Lost Ledger", output)
+        self.assertIn("LLM unavailable", output)
+        self.assertNotIn("Built Already", output)
+
+        # Without the analysis script draining it, the job stays queued (its NPC does not exist)
+        with patch("dynquest.commands.analysis_script", return_value=None):
+            output = self.run_cmd("test_a1", ["retry"])
+        self.assertIn("Queued 1", output)
+
+        quest = QuestEntry.objects.get(quest_id="test_a1")
+        self.assertEqual(quest.status, "analyzing")
+        self.assertEqual(quest.raw_data["attempts"], 0)
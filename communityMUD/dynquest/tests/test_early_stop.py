@@ -0,0 +1,47 @@
+from evennia.utils.test_resources import EvenniaTestCase
+from dynquest.service.early_stop import EarlyStop
+
+
+def generate(policy, reply):
+    """Feeds reply to the policy one word at a time, like decoded tokens. Returns the kept text."""
+    text = ""
+    for word in reply.split(" "):
+        text += word if not text else " " + word
+        cut = policy.cut(text)
+        if cut is not None:
+            return text[:cut]
+    return text
+
+
+class TestEarlyStop(EvenniaTestCase):
+
+    def test_paragraph_budget(self):
+        policy = EarlyStop(max_paragraphs=2)
+        reply = "\n\nFirst part. Still first.\n\nSecond part.\n\nThird part that would be paid for."
+        self.assertEqual(generate(policy, reply), "\n\nFirst part. Still first.\n\nSecond part.")
+
+    def test_sentence_budget(self):
+        policy = EarlyStop(max_sentences=2)
+        self.assertEqual(generate(policy, 'One. "Two!" Three. Four.'), 'One. "Two!" ')
+        self.assertIsNone(policy.cut("One. Two"))
+
+    def test_out_of_character_opener(self):
+        policy = EarlyStop(ooc_openers=["Let me know if"], turn_openers=["Assistant:"])
+        reply = "The ferry leaves at dawn.\n\nLet me know if you need anything else."
+        self.assertEqual(generate(policy, reply), "The ferry leaves at dawn.\n\n")
+
+    def test_out_of_character_first_paragraph_does_not_stop(self):
+        policy = EarlyStop(ooc_openers=["Let me know if"])
+        reply = "Let me know if this helps.\n\nThe ferry leaves at dawn, mind the tide."
+        self.assertEqual(generate(policy, reply), reply)
+        self.assertEqual(policy.hold("Let me"), 0)
+
+    def test_turn_openers_only_after_first_paragraph(self):
+        policy = EarlyStop(turn_openers=["Assistant:"])
+        self.assertEqual(generate(policy, "Assistant: Well met.\n\nAssistant: And more."), "Assistant: Well met.\n\n")
+
+    def test_hold_back_possible_opener(self):
+        policy = EarlyStop(ooc_openers=["Let me know if"])
+        self.assertEqual(policy.hold("Aye.\n\nLet me"), len("Let me"))
+        self.assertEqual(policy.hold("Aye.\n\nLet us go"), 0)
+        self.assertEqual(policy.hold("Aye."), 0)
@@ -0,0 +1,118 @@
+import queue
+import numpy as np
+from twisted.internet.defer import Deferred
+from evennia.utils.test_resources import EvenniaTestCase
+from unittest.mock import patch
+from dynquest.embedding_worker import worker_main
+from dynquest.embeddings import EmbeddingCache, EmbeddingModelRegistry
+
+
+class CountingTransformer:
+    """Stands in for a SentenceTransformer, recording which texts it was asked to encode."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        return np.array([[len(text), text.count("a"), 1.0] for text in texts])
+
+
+class TestEmbeddingCache(EvenniaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.transformer = CountingTransformer()
+        self.cache = EmbeddingCache(max_entries=3)
+
+    def test_repeated_text_is_encoded_once(self):
+        first = self.cache.encode(self.transformer, ["Hello there", "any work?"], "model")
+        second = self.cache.encode(self.transformer, ["  hello   THERE ", "hello there"], "model")
+
+        self.assertEqual(self.transformer.encoded, ["hello there", "any work?"])
+        np.testing.assert_array_equal(second[0], first[0])
+        np.testing.assert_array_equal(second[1], first[0])
+
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 2))
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_keyed_on_model(self):
+        self.cache.encode(self.transformer, ["hello"], "model-a")
+        self.cache.encode(self.transformer, ["hello"], "model-b")
+        self.assertEqual(len(self.transformer.encoded), 2)
+
+    def test_bounded_lru(self):
+        self.cache.encode(self.transformer, ["one", "two", "three"], "model")
+        self.cache.encode(self.transformer, ["one"], "model")
+        self.cache.encode(self.transformer, ["four"], "model")
+
+        self.assertEqual(self.cache.stats()["entries"], 3)
+        self.cache.encode(self.transformer, ["one", "two"], "model")
+        self.assertEqual(self.transformer.encoded[-1], "two")
+
+
+class TestEmbeddingModelRegistry(EvenniaTestCase):
+
+    def test_model_loaded_once_on_first_use(self):
+        registry = EmbeddingModelRegistry()
+        lazy = registry.proxy("model")
+        self.assertFalse(registry.loaded("model"))
+
+        with patch("sentence_transformers.SentenceTransformer", side_effect=lambda name: CountingTransformer()) as loader:
+            lazy.encode(["hello"])
+            registry.warm_up(["model"]).join(5)
+            lazy.encode(["there"])
+
+        loader.assert_called_once_with("model")
+        self.assertEqual(registry.get("model").encoded, ["hello", "there"])
+        self.assertIn("seconds", registry.stats()["model"])
+
+
+class TestEmbeddingWorker(EvenniaTestCase):
+
+    def test_concurrent_jobs_share_a_forward_pass(self):
+        batches = []
+
+        class BatchRecordingModel:
+            def __init__(self, name):
+                pass
+
+            def encode(self, texts, **kwargs):
+                batches.append(list(texts))
+                return np.array([[len(text), 1.0] for text in texts])
+
+        inbox, outbox = queue.Queue(), queue.Queue()
+        for job_id, texts in enumerate([["a"], ["bb", "ccc"], ["dddd"]], start=1):
+            inbox.put((job_id, texts))
+        inbox.put(None)
+
+        with patch("sentence_transformers.SentenceTransformer", BatchRecordingModel):
+            worker_main("model", 0.05, 64, inbox, outbox)
+
+        messages = [outbox.get_nowait() for _ in range(outbox.qsize())]
+        self.assertEqual(batches, [["a", "bb", "ccc", "dddd"]])
+
+        done = {job_id: embeddings[:, 0].tolist() for kind, job_id, embeddings in messages if kind == "done"}
+        self.assertEqual(done, {1: [1.0], 2: [2.0, 3.0], 3: [4.0]})
+        self.assertIn(("batch", 3, 4), messages)
+
+    def test_cache_encodes_misses_asynchronously(self):
+        cache = EmbeddingCache()
+        transformer = CountingTransformer()
+        cache.encode(transformer, ["cached"], "model")
+
+        pending = Deferred()
+        requested = []
+
+        def encode_deferred(texts):
+            requested.extend(texts)
+            return pending
+
+        results = []
+        cache.encode_async(encode_deferred, ["cached", "new"], "model").addCallback(results.append)
+        self.assertEqual(requested, ["new"])
+
+        pending.callback(transformer.encode(["new"]))
+        self.assertEqual(results[0].shape, (2, 3))
+        self.assertEqual(cache.stats()["entries"], 2)
@@ -1,16 +1,23 @@
-from evennia.utils.test_resources import EvenniaTest
+from evennia.utils.test_resources import EvenniaTest, EvenniaTestCase
 from evennia.utils import create
-from unittest.mock import patch
+from unittest.mock import MagicMock, PropertyMock, patch
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, fail, maybeDeferred, succeed
 from typeclasses.characters import Character
 from dynquest.models import QuestEntry
 import dynquest.genpc 
+import threading
 import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from evennia.accounts.models import AccountDB
 from dynquest.helpers import QuestEval
+from dynquest.breaker import CircuitBreaker
+from dynquest.semantic_cache import SemanticResponseCache
 
 class TestPlayer(Character):
     def at_object_creation(self):
         self.last_heard = ""
+        self.all_heard = ""
         self.heard_from = ""
 
     def msg(self, text, from_obj=None, **kwargs):
@@ -29,6 +36,7 @@ class TestPlayer(Character):
     def at_heard_say(self, message, msg_obj=None, **kwargs):
         print(f"TestPlayer heard: {message} from {msg_obj}")
         self.last_heard = message
+        self.all_heard = f"{self.all_heard} {message}".strip()
         self.heard_from = msg_obj
 
 class TestGenPC(EvenniaTest):
@@ -46,6 +54,30 @@ class TestGenPC(EvenniaTest):
         self.player.account  = AccountDB.objects.create(username="testaccount")
         self.player.save()
 
+        # Reply at once: no reactor runs under test to fire the coalescing delay
+        window = patch.object(dynquest.genpc.GenPC, "COALESCE_WINDOW", 0)
+        window.start()
+        self.addCleanup(window.stop)
+
+        # Each test gets its own breaker, so failures in one cannot open it for the next
+        breaker = patch("dynquest.genpc._model_breaker", CircuitBreaker(probe=lambda: False))
+        breaker.start()
+        self.addCleanup(breaker.stop)
+
+        # Answers are only reused in the tests that check the semantic cache
+        semantic = patch.object(dynquest.genpc.GenPC, "SEMANTIC_CACHE_ENABLED", False)
+        semantic.start()
+        self.addCleanup(semantic.stop)
+
+        # LLM calls made through fake_defer, as (deferred, request) pairs for the test to fire
+        self.started = []
+
+    def fake_defer(self, func, request, *args, **kwargs):
+        """Stands in for threads.deferToThread: the call is recorded in self.started instead of run."""
+        d = Deferred()
+        self.started.append((d, request))
+        return d
+
     def test_npc_response(self):
         """Ensure the NPC was created correctly."""
         self.assertEqual(self.npc.location, self.room)
@@ -57,19 +89,349 @@ class TestGenPC(EvenniaTest):
 
         """Test that the NPC attempts to generate a response."""
         print(f"About to call npc.at_heard_say() with a source of {self.player}")
-        self.npc.at_heard_say("Tell me a story about a ghost train.", from_obj=self.player)
+        # No reactor runs under test, so run the worker-thread and callFromThread steps inline.
+        with patch("dynquest.genpc.threads.deferToThread", side_effect=maybeDeferred), \
+                patch("dynquest.genpc.reactor.callFromThread", side_effect=lambda f, *args, **kwargs: f(*args, **kwargs)):
+            self.npc.at_heard_say("Tell me a story about a ghost train.", from_obj=self.player)
 
         for i in range(10): 
             if not self.player.last_heard:
                 time.sleep(4)  # Pause to allow the player to hear the response.
 
         goodstory = False
-        if any(item in self.player.last_heard.lower() for item in ["train", "ghost", "story", "station", "railway"]):
+        # GenPC speaks its response one sentence at a time, so check everything it said.
+        if any(item in self.player.all_heard.lower() for item in ["train", "ghost", "story", "station", "railway"]):
             goodstory = True
 
         # Ensure the NPC responds
         self.assertTrue(goodstory, "NPC did not respond to the player's message with a good story...")
 
+    def test_replies_are_ordered(self):
+        """
+        A second message is not sent to the model until the reply to the first has been recorded.
+        """
+        with patch.object(self.npc, "get_relevant_lore", return_value=""), \
+                patch("dynquest.genpc.threads.deferToThread", side_effect=self.fake_defer):
+            self.npc.at_heard_say("Player says, 'First question'", from_obj=self.player)
+            self.npc.at_heard_say("Player says, 'Second question'", from_obj=self.player)
+            self.assertEqual(len(self.started), 1)
+
+            self.started[0][0].callback("First answer.")
+            self.assertEqual(len(self.started), 2)
+
+            second_request = self.started[1][1]
+            self.assertEqual(second_request["messages"][-1]["content"], "Player says, 'Second question'")
+            self.assertIn({"role": "assistant", "content": "First answer."}, second_request["messages"])
+
+            self.started[1][0].callback("Second answer.")
+
+        self.assertEqual(list(self.npc.conversation_turns(self.player.dbref))[-2:], [
+            {"role": "user", "content": "Player says, 'Second question'"},
+            {"role": "assistant", "content": "Second answer."}
+        ])
+
+    def test_history_is_flushed_in_batches(self):
+        """
+        Turns are kept in memory per speaker and only written to the database by flush_history().
+        """
+        with patch("dynquest.genpc.delay") as flush_later:
+            self.npc.at_reply_complete("Well met.", [("Player says, 'Hello'", self.player)])
+            self.npc.at_reply_complete("Farewell.", [("Player says, 'Goodbye'", self.player)])
+
+        flush_later.assert_called_once()
+        self.assertEqual(self.npc.db.conversation_turns, {})
+        self.assertEqual(len(self.npc.conversation_turns(self.player.dbref)), 4)
+        self.assertEqual(len(self.npc.conversation_turns("#0")), 0)
+
+        self.npc.flush_history()
+        saved = self.npc.db.conversation_turns[self.player.dbref]
+        self.assertEqual(saved[0], {"role": "user", "content": "Player says, 'Hello'"})
+        self.assertEqual(saved[-1], {"role": "assistant", "content": "Farewell."})
+
+        # A fresh buffer is reloaded from the saved turns
+        self.npc.ndb.conversation_turns = None
+        self.assertEqual(list(self.npc.conversation_turns(self.player.dbref)), saved)
+
+    def test_utterances_are_coalesced(self):
+        """
+        Everything heard while a reply is pending is answered together, once.
+        """
+        other = create.create_object(TestPlayer, key="Other", location=self.room)
+        with patch.object(dynquest.genpc.GenPC, "COALESCE_WINDOW", 1.5), \
+                patch.object(TestPlayer, "has_account", new_callable=PropertyMock, return_value=True), \
+                patch("dynquest.genpc.delay") as reply_later, \
+                patch.object(self.npc, "get_relevant_lore", return_value=""), \
+                patch("dynquest.genpc.threads.deferToThread", side_effect=self.fake_defer):
+            self.npc.at_heard_say("Player says, 'Any work?'", from_obj=self.player)
+            self.npc.at_heard_say("Other says, 'Hello!'", from_obj=other)
+            reply_later.assert_any_call(1.5, self.npc.queue_reply)
+            replies = [call for call in reply_later.call_args_list if call[0][1] == self.npc.queue_reply]
+            self.assertEqual(len(replies), 1)
+            self.assertEqual(self.started, [])
+
+            # The coalescing window closes
+            replies[0][0][1]()
+            self.assertEqual(len(self.started), 1)
+
+            prompt = self.started[0][1]["messages"][-1]["content"]
+            self.assertIn("Player, Other", prompt)
+            self.assertIn("Player says, 'Any work?'", prompt)
+            self.assertIn("Other says, 'Hello!'", prompt)
+
+            self.started[0][0].callback("Work aplenty, Player. Hello to you, Other.")
+
+        self.assertEqual(len(self.started), 1)
+        self.assertEqual(list(self.npc.conversation_turns(other.dbref)), [
+            {"role": "user", "content": "Other says, 'Hello!'"},
+            {"role": "assistant", "content": "Work aplenty, Player. Hello to you, Other."}
+        ])
+
+    def test_coalesce_window_per_npc(self):
+        create.create_object(TestPlayer, key="Other", location=self.room)
+        self.npc.db.coalesce_window = 0.5
+
+        with patch.object(dynquest.genpc.GenPC, "COALESCE_WINDOW", 1.5), \
+                patch.object(TestPlayer, "has_account", new_callable=PropertyMock, return_value=True), \
+                patch("dynquest.genpc.delay") as reply_later, \
+                patch.object(self.npc, "queue_reply") as queue_reply:
+            self.npc.at_heard_say("Player says, 'Any work?'", from_obj=self.player)
+
+            reply_later.assert_any_call(0.5, queue_reply)
+            queue_reply.assert_not_called()
+
+    def test_speaker_alone_is_answered_at_once(self):
+        """
+        With no one else in the room to add to the reply, the NPC does not wait for more utterances.
+        """
+        with patch.object(dynquest.genpc.GenPC, "COALESCE_WINDOW", 1.5), \
+                patch.object(TestPlayer, "has_account", new_callable=PropertyMock, return_value=True), \
+                patch("dynquest.genpc.delay") as reply_later, \
+                patch.object(self.npc, "queue_reply") as queue_reply:
+            self.npc.at_heard_say("Player says, 'Any work?'", from_obj=self.player)
+
+            queue_reply.assert_called_once_with()
+            self.assertNotIn(queue_reply, [call[0][1] for call in reply_later.call_args_list if len(call[0]) > 1])
+
+    def test_open_breaker_answers_with_canned_line(self):
+        """
+        While the LLM service is down, the NPC answers at once from its own dialogue lines.
+        """
+        self.npc.db.dialogue = ["The trains are late again."]
+        breaker = dynquest.genpc.model_breaker()
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+        with patch("dynquest.genpc.threads.deferToThread") as defer:
+            self.npc.at_heard_say("Player says, 'Any news?'", from_obj=self.player)
+
+        defer.assert_not_called()
+        self.assertIn("The trains are late again.", self.player.last_heard)
+        self.assertEqual(list(self.npc.conversation_turns(self.player.dbref)), [])
+
+    def test_busy_service_backs_off(self):
+        """
+        A 429 from the LLM service is answered with a canned line, and NPCs stop asking for its
+        Retry-After without the refusal counting against the breaker.
+        """
+        refusal = MagicMock(status_code=429, headers={"Retry-After": "5"})
+        session = MagicMock()
+        session.post.return_value.__enter__.return_value = refusal
+
+        with patch("dynquest.genpc.model_session", return_value=session), \
+                patch.object(self.npc, "say_sentence") as say:
+            said = self.npc.say_streamed_response({}, fallback="Busy day at the station.")
+
+        self.assertEqual(said, "Busy day at the station.")
+        say.assert_called_once_with("Busy day at the station.")
+
+        breaker = dynquest.genpc.model_breaker()
+        self.assertFalse(breaker.allow())
+        self.assertTrue(breaker.stats()["backing_off"])
+        self.assertEqual(breaker.stats()["recent_failures"], 0)
+
+    def test_greeting_answered_from_pool(self):
+        """
+        A short greeting is answered at once from the pre-generated pool; other lines go to the LLM.
+        """
+        self.npc.store_line_pool(["Tickets, please, and good day to you."], "greeting")
+
+        with patch("dynquest.genpc.threads.deferToThread", return_value=Deferred()) as defer:
+            self.npc.at_heard_say("Player says, 'Well met!'", from_obj=self.player)
+            defer.assert_not_called()
+            self.assertIn("Tickets, please, and good day to you.", self.player.last_heard)
+
+            self.npc.at_heard_say("Player says, 'Hello, when does the ghost train leave?'", from_obj=self.player)
+            defer.assert_called_once()
+
+            # While that reply is pending, a greeting waits its turn instead of overtaking it
+            self.player.last_heard = ""
+            self.npc.at_heard_say("Player says, 'Well met!'", from_obj=self.player)
+            self.assertEqual(self.player.last_heard, "")
+            self.assertTrue(self.npc.reply_pending())
+
+            # A short question is not a greeting: it waits for the LLM instead of a pool line
+            self.player.last_heard = ""
+            self.npc.at_heard_say("Player says, 'Hi, who are you?'", from_obj=self.player)
+            self.assertEqual(self.player.last_heard, "")
+
+        self.assertEqual(list(self.npc.conversation_turns(self.player.dbref))[-1],
+                         {"role": "assistant", "content": "Tickets, please, and good day to you."})
+
+        # Expired pools are not used
+        self.npc.db.line_pools["greeting"]["generated"] -= dynquest.genpc.GenPC.LINE_POOL_TTL + 1
+        self.assertEqual(self.npc.line_pool("greeting"), [])
+
+    def test_greeting_pool_used_again_after_pending_reply(self):
+        self.npc.store_line_pool(["Tickets, please."], "greeting")
+        with patch("dynquest.genpc.threads.deferToThread", side_effect=self.fake_defer):
+            self.npc.at_heard_say("Player says, 'When does the train leave?'", from_obj=self.player)
+            self.npc.at_heard_say("Player says, 'Well met!'", from_obj=self.player)
+            self.started[0][0].callback("At midnight.")
+            self.assertEqual(len(self.started), 2)
+            self.started[1][0].callback("Well met yourself.")
+            self.assertFalse(self.npc.reply_pending())
+
+            self.npc.at_heard_say("Player says, 'Well met!'", from_obj=self.player)
+            self.assertEqual(len(self.started), 2)
+            self.assertIn("Tickets, please.", self.player.last_heard)
+
+    def test_only_bare_greetings_are_greetings(self):
+        is_greeting = dynquest.genpc.GenPC.is_greeting
+        for line in ["Well met!", "hi", "Hello there, Storyteller.", "Good day to you, sir.", "Hey friend!"]:
+            self.assertTrue(is_greeting(f"Player says, '{line}'", names=["Storyteller"]), line)
+
+        for line in ["Hi, who are you?", "Hey, can you help me?", "Hello, where is the mill?",
+                     "Hello, where is the mill", "Hi?", "Hello Bob, how are you"]:
+            self.assertFalse(is_greeting(f"Player says, '{line}'", names=["Storyteller"]), line)
+
+    def test_line_pools_refresh_when_quiet(self):
+        generated = []
+
+        def generate(kind, persona):
+            generated.append(kind)
+            return dynquest.genpc.GenPC.parse_pool_lines(f'1. "{kind} one"\n2. {kind} two\n\n- {kind} one', 4)
+
+        with patch("dynquest.genpc.delay"), \
+                patch.object(self.npc, "generate_line_pool", side_effect=generate), \
+                patch("dynquest.genpc.threads.deferToThread", side_effect=maybeDeferred):
+            self.npc.ndb.last_heard = time.time()
+            self.assertEqual(self.npc.refresh_line_pools(), [])
+
+            self.npc.ndb.last_heard = time.time() - dynquest.genpc.GenPC.LINE_POOL_QUIET_PERIOD - 1
+            self.npc.refresh_line_pools()
+            self.assertEqual(sorted(generated), ["greeting", "idle"])
+            self.assertEqual(self.npc.line_pool("idle"), ["idle one", "idle two"])
+
+            # Fresh pools are not regenerated
+            self.assertEqual(self.npc.refresh_line_pools(), [])
+
+    def test_refused_pool_refresh_leaves_dialogue_alone(self):
+        """
+        A 429 for a background pool request does not make the breaker refuse player dialogue,
+        and pools are not refreshed while the service has asked callers to back off.
+        """
+        refusal = MagicMock(status_code=429, headers={"Retry-After": "5"})
+        session = MagicMock()
+        session.post.return_value = refusal
+
+        with patch("dynquest.genpc.model_session", return_value=session):
+            self.assertRaises(dynquest.genpc.ModelServiceBusy, self.npc.generate_line_pool, "idle", "a ferryman")
+
+        breaker = dynquest.genpc.model_breaker()
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.stats()["recent_failures"], 0)
+
+        breaker.back_off(60)
+        self.npc.ndb.last_heard = 0
+        with patch("dynquest.genpc.delay"), patch("dynquest.genpc.threads.deferToThread") as defer:
+            self.assertEqual(self.npc.refresh_line_pools(), [])
+        defer.assert_not_called()
+
+    def test_line_pools_only_refresh_for_active_npcs(self):
+        """
+        An NPC nobody has spoken to, with no players around, neither refreshes nor keeps checking.
+        """
+        self.npc.ndb.last_heard = 0
+        with patch("dynquest.genpc.delay") as delay, \
+                patch("dynquest.genpc.threads.deferToThread") as defer:
+            self.assertEqual(self.npc.refresh_line_pools(), [])
+            delay.assert_not_called()
+            defer.assert_not_called()
+
+            # A player in the room brings it back, with a staggered first check
+            self.npc.ndb.pool_refresh_scheduled = False
+            with patch.object(type(self.player), "has_account", True):
+                self.npc.at_init()
+            wait = delay.call_args[0][0]
+            self.assertGreaterEqual(wait, dynquest.genpc.GenPC.LINE_POOL_QUIET_PERIOD)
+            self.assertLessEqual(wait, dynquest.genpc.GenPC.LINE_POOL_QUIET_PERIOD + dynquest.genpc.GenPC.LINE_POOL_STAGGER)
+
+    def test_paraphrased_question_reuses_answer(self):
+        """
+        A question close in meaning to one already answered (with the same lore, and no earlier
+        conversation) skips the LLM.
+        """
+        other = create.create_object(TestPlayer, key="Traveler", location=self.room)
+        vectors = {"Who are you?": [1.0, 0.0], "Who might you be?": [0.98, 0.05], "Where is the train?": [0.0, 1.0]}
+        with patch.object(dynquest.genpc.GenPC, "SEMANTIC_CACHE_ENABLED", True), \
+                patch("dynquest.genpc.SEMANTIC_CACHE", SemanticResponseCache(threshold=0.9)) as cache, \
+                patch("dynquest.genpc.embed_async", side_effect=lambda texts: succeed([vectors.get(text, [0.5, 0.5]) for text in texts])), \
+                patch.object(self.npc, "get_relevant_lore", return_value="The station lore."), \
+                patch("dynquest.genpc.threads.deferToThread", side_effect=self.fake_defer):
+            self.npc.at_heard_say("Player says, 'Who are you?'", from_obj=self.player)
+            self.started[0][0].callback("I am the ticket-taker.")
+
+            self.npc.at_heard_say("Traveler says, 'Who might you be?'", from_obj=other)
+            self.assertEqual(len(self.started), 1)
+            self.assertIn("I am the ticket-taker.", other.last_heard)
+
+            self.npc.at_heard_say("Player says, 'Where is the train?'", from_obj=self.player)
+            self.assertEqual(len(self.started), 2)
+            self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_follow_up_in_another_conversation_misses(self):
+        """
+        The same short follow-up is only answered from the cache in the same conversation.
+        """
+        speaker = dynquest.genpc.GenPC.speaker_key(self.player)
+        with patch.object(dynquest.genpc.GenPC, "SEMANTIC_CACHE_ENABLED", True), \
+                patch("dynquest.genpc.SEMANTIC_CACHE", SemanticResponseCache(threshold=0.9)), \
+                patch("dynquest.genpc.embed_async", side_effect=lambda texts: succeed([[1.0, 0.0] for text in texts])), \
+                patch.object(self.npc, "get_relevant_lore", return_value="The station lore."), \
+                patch("dynquest.genpc.threads.deferToThread", side_effect=self.fake_defer):
+            self.npc.remember_turn(speaker, "user", "Tell me about the ferry.")
+            self.npc.remember_turn(speaker, "assistant", "It sank last winter.")
+            self.npc.at_heard_say("Player says, 'And then?'", from_obj=self.player)
+            self.started[0][0].callback("Nobody came back from it.")
+
+            self.npc.remember_turn(speaker, "user", "Tell me about the train.")
+            self.npc.remember_turn(speaker, "assistant", "It is always late.")
+            self.npc.at_heard_say("Player says, 'And then?'", from_obj=self.player)
+            self.assertEqual(len(self.started), 2)
+
+    def test_failed_embedding_replies_without_lore(self):
+        """
+        If the message cannot be embedded off the reactor, the reply goes without lore instead
+        of embedding it on the reactor.
+        """
+        with patch("dynquest.genpc.embed_async", return_value=fail(RuntimeError("worker down"))), \
+                patch.object(self.npc, "load_lore_data", return_value=MagicMock()), \
+                patch("dynquest.genpc.embed") as embed, \
+                patch("dynquest.genpc.threads.deferToThread", return_value=Deferred()) as defer:
+            self.npc.at_heard_say("Player says, 'Who are you?'", from_obj=self.player)
+
+        embed.assert_not_called()
+        self.assertEqual(defer.call_args[0][1]["lore"], "")
+
+    def test_lore_partitions_follow_room_realm(self):
+        self.assertIsNone(self.npc.lore_partitions())
+
+        self.room.db.realm = "realm_brv"
+        self.assertEqual(self.npc.lore_partitions(), ["realm_brv", "global"])
+
+        with patch.object(dynquest.genpc.GenPC, "LORE_INCLUDE_GLOBAL", False):
+            self.assertEqual(self.npc.lore_partitions(), ["realm_brv"])
+
     def test_quest_persistence(self):
         """
         Test that a quest was persisted in the database after a "questworthy" response
@@ -92,4 +454,56 @@ class TestGenPC(EvenniaTest):
     def tearDown(self):
         super().tearDown()
         if self.player.account:
-            self.player.account.delete()
\ No newline at end of file
+            self.player.account.delete()
+
+
+class TestModelSession(EvenniaTestCase):
+
+    def test_pool_is_sized_to_the_reactor_threads(self):
+        with patch("dynquest.genpc._model_session", None):
+            adapter = dynquest.genpc.model_session().get_adapter("http://127.0.0.1:8000/generate")
+        self.assertTrue(adapter._pool_block)
+        self.assertEqual(adapter._pool_maxsize, reactor.getThreadPool().max)
+
+    def test_connections_are_bounded(self):
+        """
+        A call made while every pooled connection is held by a long reply waits for one.
+        """
+        release = threading.Event()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/slow":
+                    release.wait(10)
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(release.set)
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        with patch.object(dynquest.genpc.GenPC, "MODEL_POOL_SIZE", 1), \
+                patch("dynquest.genpc._model_session", None):
+            session = dynquest.genpc.model_session()
+            slow = threading.Thread(target=session.get, args=(url + "/slow",), daemon=True)
+            slow.start()
+            time.sleep(0.2)
+
+            answers = []
+            fast = threading.Thread(target=lambda: answers.append(session.get(url + "/fast", timeout=5).text), daemon=True)
+            fast.start()
+            fast.join(0.5)
+            self.assertEqual(answers, [])
+
+            release.set()
+            fast.join(5)
+            slow.join(5)
+            self.assertEqual(answers, ["ok"])
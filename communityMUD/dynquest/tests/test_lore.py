@@ -0,0 +1,100 @@
+import json
+import os
+import tempfile
+import numpy as np
+from evennia.utils.test_resources import EvenniaTestCase
+from dynquest.lore import GLOBAL_PARTITION, LoreIndex, convert_json_lore, load_lore_store, save_lore_store
+
+
+class TestLoreIndex(EvenniaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(7)
+        self.embeddings = rng.normal(size=(50, 16))
+        self.contents = [f"Lore {i}" for i in range(50)]
+        self.index = LoreIndex(self.contents, self.embeddings)
+
+    def test_rows_are_normalized_float32(self):
+        self.assertEqual(self.index.matrix.dtype, np.float32)
+        self.assertTrue(self.index.matrix.flags["C_CONTIGUOUS"])
+        np.testing.assert_allclose(np.linalg.norm(self.index.matrix, axis=1), 1.0, rtol=1e-5)
+
+    def test_search_matches_full_sort(self):
+        query = self.embeddings[3] + 0.1
+        expected = sorted(
+            range(50),
+            key=lambda i: np.dot(query, self.embeddings[i]) / (np.linalg.norm(query) * np.linalg.norm(self.embeddings[i])),
+            reverse=True
+        )[:5]
+
+        results = self.index.search(query, top_n=5)
+        self.assertEqual([row for row, _ in results], expected)
+        self.assertEqual(self.index.top_contents(query, top_n=1), [f"Lore {expected[0]}"])
+
+    def test_top_n_larger_than_index(self):
+        self.assertEqual(len(self.index.search(self.embeddings[0], top_n=100)), 50)
+
+    def test_partitioned_search(self):
+        realms = ["realm_a" if i % 3 == 0 else "realm_b" if i % 3 == 1 else None for i in range(50)]
+        index = LoreIndex(self.contents, self.embeddings, realms)
+        self.assertEqual(set(index.partitions), {"realm_a", "realm_b", GLOBAL_PARTITION})
+
+        query = self.embeddings[4]      # A realm_b snippet
+        self.assertEqual(index.top_contents(query, 1, partitions=["realm_b"]), ["Lore 4"])
+
+        for row, _ in index.search(query, 10, partitions=["realm_a", GLOBAL_PARTITION]):
+            self.assertIn(index.realms[row], ("realm_a", GLOBAL_PARTITION))
+        self.assertEqual(index.search(query, 3, partitions=["realm_unknown"]), [])
+
+    def test_from_entries_requires_fields(self):
+        with self.assertRaises(ValueError):
+            LoreIndex.from_entries([{"content": "No embedding"}])
+
+
+class TestLoreStore(EvenniaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.base = os.path.join(self.tmpdir.name, "lore")
+        rng = np.random.default_rng(11)
+        self.embeddings = rng.normal(size=(10, 8))
+        self.contents = [f"In Testland: fact {i}" for i in range(10)]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def test_round_trip_is_memory_mapped(self):
+        save_lore_store(self.base, self.contents, self.embeddings, "test-model")
+        index = load_lore_store(self.base)
+
+        self.assertIsInstance(index.matrix, np.memmap)
+        self.assertEqual(index.contents, self.contents)
+        self.assertEqual(index.partitions, {GLOBAL_PARTITION: (0, 10)})
+        self.assertEqual((len(index), index.dim, index.model), (10, 8, "test-model"))
+        self.assertEqual(index.search(self.embeddings[4], 1)[0][0], 4)
+
+        with self.assertRaises(ValueError):
+            load_lore_store(self.base, model_name="other-model")
+
+    def test_partitions_are_stored_contiguously(self):
+        realms = ["realm_b", "realm_a"] * 5
+        save_lore_store(self.base, self.contents, self.embeddings, "test-model", realms)
+        index = load_lore_store(self.base)
+
+        self.assertIsInstance(index.matrix, np.memmap)
+        self.assertEqual(index.partitions, {"realm_a": (0, 5), "realm_b": (5, 10)})
+        self.assertEqual(index.top_contents(self.embeddings[3], 1, partitions=["realm_a"]), ["In Testland: fact 3"])
+
+    def test_convert_json(self):
+        json_path = os.path.join(self.tmpdir.name, "lore.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump([{"content": c, "embedding": e.tolist()} for c, e in zip(self.contents, self.embeddings)], f)
+
+        self.assertEqual(convert_json_lore(json_path, self.base), 10)
+
+        stored = load_lore_store(self.base)
+        direct = LoreIndex(self.contents, self.embeddings)
+        np.testing.assert_allclose(stored.matrix, direct.matrix, rtol=1e-5)
@@ -0,0 +1,99 @@
+import queue
+import threading
+from unittest.mock import MagicMock, patch
+from evennia.utils.test_resources import EvenniaTestCase
+from dynquest.service.early_stop import EarlyStop
+from dynquest.service.postprocess import FILTER_STARTS, FOURTH_WALL_PREFIXES, StreamFilter, process_response
+from dynquest.service.scheduler import BatchScheduler, GenerationRequest, _Sequence
+
+
+def feed_chunks(stream_filter, chunks, finish_reason="stop"):
+    sentences = []
+    for chunk in chunks:
+        sentences.extend(stream_filter.feed(chunk))
+    return sentences + stream_filter.finish(finish_reason)
+
+
+class TestStreamFilter(EvenniaTestCase):
+
+    def test_sentences_across_chunk_boundaries(self):
+        stream = StreamFilter("npc")
+        self.assertEqual(stream.feed("The ferry le"), [])
+        self.assertEqual(stream.feed("aves at dawn. Mind"), ["The ferry leaves at dawn."])
+        # A boundary at the very end of the text waits: it could still grow into a paragraph break
+        self.assertEqual(stream.feed(" the tide!"), [])
+        self.assertEqual(stream.finish("stop"), ["Mind the tide!"])
+
+    def test_out_of_character_paragraph_dropped(self):
+        chunks = ["Aye, it is “cold”. ", "\n\nLet me know if ", "you need more. Anything.", "\n\nFarewell."]
+        self.assertEqual(feed_chunks(StreamFilter("npc"), chunks), ['Aye, it is "cold".', "Farewell."])
+
+    def test_fourth_wall_prefix_stripped(self):
+        self.assertEqual(feed_chunks(StreamFilter("npc"), ['You reply: "Well met. ', 'Sit down."']),
+                         ["Well met.", 'Sit down."'])
+
+    def test_length_finish_drops_unfinished_sentence(self):
+        self.assertEqual(feed_chunks(StreamFilter("npc"), ["One. Two and th"], "length"), ["One."])
+        self.assertEqual(process_response("npc", "One.\n\nTwo and th", "length"), "One.")
+
+    def test_quest_text_passes_through(self):
+        self.assertEqual(feed_chunks(StreamFilter("quest"), ['{"title": ', '"Ledger"}']), ['{"title": ', '"Ledger"}'])
+
+
+class TestEarlyStopStreaming(EvenniaTestCase):
+    """
+    The scheduler's token loop with EarlyStop, streaming through StreamFilter.
+    """
+
+    def setUp(self):
+        super().setUp()
+        eog = patch("dynquest.service.scheduler.llama_cpp.llama_vocab_is_eog", return_value=False)
+        eog.start()
+        self.addCleanup(eog.stop)
+
+    def generate(self, reply, early_stop):
+        """Decodes reply one word per token. Returns the request and the pieces put on its stream."""
+        pieces = [word if not index else " " + word for index, word in enumerate(reply.split(" "))]
+
+        # No llama.cpp context: accept() only needs the detokenizer and the bookkeeping below
+        scheduler = BatchScheduler.__new__(BatchScheduler)
+        scheduler.llm = MagicMock()
+        scheduler.llm._model.detokenize = lambda tokens: pieces[tokens[0]].encode("utf-8")
+        scheduler.vocab = None
+        scheduler.ctx = MagicMock()
+        scheduler.n_ctx = 4096
+        scheduler.active, scheduler.free_slots = [], []
+        scheduler.lock = threading.Lock()
+        scheduler.completed = scheduler.completion_tokens = scheduler.early_stops = 0
+        scheduler.total_queue_time = 0.0
+
+        stream = queue.Queue()
+        request = GenerationRequest([1], max_tokens=len(pieces) + 1, stream=stream, early_stop=early_stop)
+        seq = _Sequence(request, 0, MagicMock())
+        scheduler.active.append(seq)
+
+        for token in range(len(pieces)):
+            scheduler.accept(seq, token)
+            if request.done.is_set():
+                break
+
+        streamed = []
+        while (delta := stream.get_nowait()) is not None:
+            streamed.append(delta)
+        return request, streamed
+
+    def test_stops_at_out_of_character_paragraph(self):
+        policy = EarlyStop(max_paragraphs=3, ooc_openers=FILTER_STARTS, turn_openers=FOURTH_WALL_PREFIXES)
+        reply = "The ferry leaves at dawn.\n\nLet me know if you need anything else. I can also help."
+        request, streamed = self.generate(reply, policy)
+
+        self.assertEqual(request.finish_reason, "stop")
+        self.assertEqual(request.text, "The ferry leaves at dawn.\n\n")
+        # Held back text is never streamed, so the stream holds exactly the kept reply
+        self.assertEqual("".join(streamed), request.text)
+        self.assertEqual(feed_chunks(StreamFilter("npc"), streamed), ["The ferry leaves at dawn."])
+
+    def test_sentence_budget_while_streaming(self):
+        request, streamed = self.generate("One. Two. Three. Four.", EarlyStop(max_sentences=2))
+        self.assertEqual(request.text, "One. Two. ")
+        self.assertEqual(feed_chunks(StreamFilter("npc"), streamed), ["One.", "Two."])
@@ -0,0 +1,42 @@
+from evennia.utils.test_resources import EvenniaTestCase
+from dynquest.service.prefix_cache import PrefixCache
+
+
+class TestPrefixCache(EvenniaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = PrefixCache(max_bytes=10)
+        self.cache.store(("npc", "ferryman"), [1, 2, 3], b"abcd")
+
+    def test_only_strict_prefixes_hit(self):
+        self.assertEqual(self.cache.lookup(("npc", "ferryman"), [1, 2, 3, 4]).state, b"abcd")
+
+        # Same tokens with nothing after them, a changed preamble, or another key
+        self.assertIsNone(self.cache.lookup(("npc", "ferryman"), [1, 2, 3]))
+        self.assertIsNone(self.cache.lookup(("npc", "ferryman"), [1, 2, 9, 4]))
+        self.assertIsNone(self.cache.lookup(("npc", "smith"), [1, 2, 3, 4]))
+
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_rate"]), (1, 3, 0.25))
+
+    def test_least_recently_used_evicted_past_budget(self):
+        self.cache.store(("npc", "smith"), [5, 6], b"efgh")
+        self.cache.lookup(("npc", "ferryman"), [1, 2, 3, 4])
+        self.cache.store(("quest", None), [7], b"ijk")
+
+        self.assertIsNone(self.cache.lookup(("npc", "smith"), [5, 6, 7]))
+        self.assertIsNotNone(self.cache.lookup(("npc", "ferryman"), [1, 2, 3, 4]))
+        self.assertIsNotNone(self.cache.lookup(("quest", None), [7, 8]))
+
+        stats = self.cache.stats()
+        self.assertEqual((stats["entries"], stats["bytes"], stats["evictions"]), (2, 7, 1))
+
+    def test_restore_replaces_and_oversized_is_skipped(self):
+        self.cache.store(("npc", "ferryman"), [1, 2], b"xy")
+        self.assertEqual(self.cache.lookup(("npc", "ferryman"), [1, 2, 3]).tokens, [1, 2])
+        self.assertEqual(self.cache.stats()["bytes"], 2)
+
+        self.cache.store(("npc", "giant"), [1], b"x" * 11)
+        self.assertIsNone(self.cache.lookup(("npc", "giant"), [1, 2]))
+        self.assertEqual(self.cache.stats()["entries"], 1)
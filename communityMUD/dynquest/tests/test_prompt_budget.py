@@ -0,0 +1,72 @@
+from evennia.utils.test_resources import EvenniaTestCase
+from dynquest.service.prompt_budget import PromptBudgetStats, fit_prompt, lore_lines
+
+
+def count_words(messages):
+    """Stands in for the tokenizer: one token per word."""
+    return sum(len(msg["content"].split()) for msg in messages)
+
+
+def drop_words(text, tokens):
+    words = text.split()
+    return " ".join(words[:max(0, len(words) - tokens)])
+
+
+class TestPromptBudget(EvenniaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.instructions = [{"role": "system", "content": "You are a grumpy ferryman"}]     # 5 tokens
+        self.message = {"role": "user", "content": "How much for the crossing"}              # 5 tokens
+        self.turns = [
+            {"role": "user", "content": "one two three"},
+            {"role": "assistant", "content": "four five six"},
+            {"role": "user", "content": "seven eight nine"},
+        ]
+        self.lore = ["The river is wide", "Ferries cost a silver piece each way", "Fog"]
+
+    def fit(self, budget, **kwargs):
+        return fit_prompt(self.instructions, self.message, self.turns, self.lore, budget,
+                          count_tokens=count_words, truncate_text=drop_words, **kwargs)
+
+    def test_everything_fits(self):
+        messages, report = self.fit(100)
+        self.assertEqual(messages[0], self.instructions[0])
+        self.assertEqual(messages[1]["content"], "Lore elements: " + "\n".join(self.lore))
+        self.assertEqual(messages[2:5], self.turns)
+        self.assertEqual(messages[-1], self.message)
+        self.assertEqual(report, {"prompt_tokens": count_words(messages), "turns_dropped": 0,
+                                  "lore_dropped": 0, "truncated": False})
+
+    def test_lore_is_dropped_before_turns(self):
+        # 10 for instructions and message, 9 for the turns, 2 for "Lore elements:" and 1 left over
+        messages, report = self.fit(22)
+        self.assertEqual(messages[-4:-1], self.turns)
+        self.assertEqual(messages[1]["content"], "Lore elements: Fog")
+        self.assertEqual((report["turns_dropped"], report["lore_dropped"]), (0, 2))
+        self.assertLessEqual(report["prompt_tokens"], 22)
+
+    def test_oldest_turns_are_dropped_first(self):
+        messages, report = self.fit(17)
+        self.assertEqual(messages, self.instructions + self.turns[1:] + [self.message])
+        self.assertEqual((report["turns_dropped"], report["lore_dropped"]), (1, 3))
+
+    def test_message_is_truncated_but_suffix_kept(self):
+        messages, report = self.fit(8, suffix=" Answer in JSON")
+        self.assertEqual(messages, self.instructions + [{"role": "user", "content": " Answer in JSON"}])
+        self.assertTrue(report["truncated"])
+
+        messages, report = self.fit(11, suffix=" Answer in JSON")
+        self.assertEqual(messages[-1]["content"], "How much for Answer in JSON")
+        self.assertEqual(report["prompt_tokens"], 11)
+
+    def test_lore_lines_and_stats(self):
+        self.assertEqual(lore_lines("First\n\n  Second  \n"), ["First", "Second"])
+
+        stats = PromptBudgetStats()
+        stats.record(self.fit(100)[1])
+        stats.record(self.fit(17)[1])
+        result = stats.stats()
+        self.assertEqual((result["prompts"], result["trimmed"]), (2, 1))
+        self.assertEqual((result["turns_dropped"], result["lore_dropped"]), (1, 3))
+        self.assertEqual(result["max_prompt_tokens"], 33)
@@ -0,0 +1,47 @@
+from unittest.mock import patch
+from evennia.utils.test_resources import EvenniaTestCase
+from dynquest.service.response_cache import ResponseCache, response_cache_key
+
+
+class TestResponseCache(EvenniaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = ResponseCache(max_bytes=2048, ttl=60, enabled_modes={"quest": True, "npc": False})
+        self.messages = [{"role": "user", "content": "Greetings,  traveller!"}]
+
+    def test_key_normalizes_whitespace(self):
+        key = response_cache_key("npc", "a smith", self.messages, 0.5, 250)
+        spaced = [{"role": "User", "content": " Greetings, traveller!\n"}]
+        self.assertEqual(key, response_cache_key("npc", "a smith ", spaced, 0.5, 250))
+        self.assertNotEqual(key, response_cache_key("npc", "a smith", self.messages, 0.7, 250))
+        self.assertNotEqual(key, response_cache_key("quest", "a smith", self.messages, 0.5, 250))
+
+    def test_enabled_modes(self):
+        self.assertTrue(self.cache.enabled("quest"))
+        self.assertFalse(self.cache.enabled("npc"))
+        self.assertFalse(self.cache.enabled("unknown"))
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get("k"))
+        self.cache.put("k", {"response": "Well met."})
+        self.assertEqual(self.cache.get("k")["response"], "Well met.")
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_ttl_expiry(self):
+        self.cache.put("k", {"response": "Well met."})
+        with patch("dynquest.service.response_cache.time.monotonic", return_value=10 ** 9):
+            self.assertIsNone(self.cache.get("k"))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_lru_eviction_within_budget(self):
+        for i in range(20):
+            self.cache.put(f"k{i}", {"response": "x" * 100})
+        stats = self.cache.stats()
+        self.assertLessEqual(stats["bytes"], stats["max_bytes"])
+        self.assertGreater(stats["evictions"], 0)
+        self.assertIsNotNone(self.cache.get("k19"))
+        self.assertIsNone(self.cache.get("k0"))
@@ -0,0 +1,49 @@
+import time
+from unittest.mock import patch
+from evennia.utils.test_resources import EvenniaTestCase
+from dynquest.semantic_cache import SemanticResponseCache
+
+
+class TestSemanticResponseCache(EvenniaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = SemanticResponseCache(threshold=0.9, ttl=60, max_entries=2)
+        self.cache.put("ticket-taker", [1.0, 0.0, 0.0], "lore", "I take tickets.")
+
+    def test_similar_utterance_hits(self):
+        self.assertEqual(self.cache.lookup("ticket-taker", [0.95, 0.1, 0.0], "lore"), "I take tickets.")
+        self.assertIsNone(self.cache.lookup("ticket-taker", [0.5, 0.5, 0.0], "lore"))
+        self.assertEqual(self.cache.stats()["hit_ratio"], 0.5)
+
+    def test_lore_and_persona_must_match(self):
+        self.assertIsNone(self.cache.lookup("ticket-taker", [1.0, 0.0, 0.0], "other lore"))
+        self.assertIsNone(self.cache.lookup("blacksmith", [1.0, 0.0, 0.0], "lore"))
+
+    def test_conversation_must_match(self):
+        """
+        The same short follow-up in two conversations is not answered from the other one.
+        """
+        ferry = [{"role": "user", "content": "Tell me about the ferry."}, {"role": "assistant", "content": "It sank."}]
+        train = [{"role": "user", "content": "Tell me about the train."}, {"role": "assistant", "content": "It is late."}]
+        self.cache.put("ticket-taker", [0.0, 1.0, 0.0], "lore", "Nobody came back from it.", turns=ferry)
+
+        self.assertIsNone(self.cache.lookup("ticket-taker", [0.0, 1.0, 0.0], "lore", turns=train))
+        self.assertIsNone(self.cache.lookup("ticket-taker", [0.0, 1.0, 0.0], "lore"))
+        self.assertEqual(self.cache.lookup("ticket-taker", [0.0, 1.0, 0.0], "lore", turns=[dict(turn) for turn in ferry]),
+                         "Nobody came back from it.")
+
+    def test_stale_answers_expire(self):
+        with patch("dynquest.semantic_cache.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(self.cache.lookup("ticket-taker", [1.0, 0.0, 0.0], "lore"))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_least_recently_used_evicted(self):
+        self.cache.put("ticket-taker", [0.0, 1.0, 0.0], "lore", "Trains leave at six.")
+        self.cache.lookup("ticket-taker", [1.0, 0.0, 0.0], "lore")
+        self.cache.put("ticket-taker", [0.0, 0.0, 1.0], "lore", "Mind the gap.")
+
+        self.assertEqual(self.cache.lookup("ticket-taker", [1.0, 0.0, 0.0], "lore"), "I take tickets.")
+        self.assertIsNone(self.cache.lookup("ticket-taker", [0.0, 1.0, 0.0], "lore"))
+        self.assertEqual(self.cache.lookup("ticket-taker", [0.0, 0.0, 1.0], "lore"), "Mind the gap.")
+        self.assertEqual(self.cache.stats()["evictions"], 1)
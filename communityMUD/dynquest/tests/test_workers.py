@@ -0,0 +1,60 @@
+import queue
+import threading
+from unittest.mock import MagicMock
+from evennia.utils.test_resources import EvenniaTestCase
+from dynquest.service.scheduler import DeadlineExceeded
+from dynquest.service.workers import Router, WorkerPool
+
+
+class TestWorkerPool(EvenniaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # No worker processes: jobs land in plain queues, results are put on the outbox by hand
+        self.pool = WorkerPool("npc", 2, {})
+        self.pool.inboxes = [queue.Queue(), queue.Queue()]
+        self.pool.outbox = queue.Queue()
+
+    def dispatch(self, *messages):
+        for message in messages:
+            self.pool.outbox.put(message)
+        self.pool.running = True
+        dispatcher = threading.Thread(target=self.pool.dispatch)
+        dispatcher.start()
+        while not self.pool.outbox.empty():
+            dispatcher.join(0.01)
+        self.pool.running = False
+        dispatcher.join()
+
+    def test_jobs_go_to_least_busy_worker(self):
+        first = self.pool.submit({"prompt": [1]})
+        second = self.pool.submit({"prompt": [2]})
+        self.assertEqual(self.pool.inboxes[0].get_nowait()["id"], first.id)
+        self.assertEqual(self.pool.inboxes[1].get_nowait()["id"], second.id)
+        self.assertEqual(self.pool.stats()["in_flight"], [1, 1])
+
+    def test_results_are_routed_to_their_job(self):
+        stream = queue.Queue()
+        job = self.pool.submit({"prompt": [1]}, stream=stream)
+        late = self.pool.submit({"prompt": [2]})
+
+        self.dispatch(("text", job.id, "Aye."), ("ready", 0, None),
+                      ("done", job.id, {"worker": 0, "text": "Aye.", "finish_reason": "stop", "completion_tokens": 2}),
+                      ("done", late.id, {"worker": 1, "error": "too late", "deadline_exceeded": True}))
+
+        self.assertEqual((stream.get_nowait(), stream.get_nowait()), ("Aye.", None))
+        self.assertEqual((job.text, job.finish_reason, job.completion_tokens, job.error), ("Aye.", "stop", 2, None))
+        self.assertIsInstance(late.error, DeadlineExceeded)
+        self.assertEqual((self.pool.stats()["ready"], self.pool.stats()["in_flight"]), (1, [0, 0]))
+
+
+class TestRouter(EvenniaTestCase):
+
+    def test_modes_without_a_pool_use_the_default(self):
+        npc, quest = MagicMock(), MagicMock()
+        router = Router({"npc": npc, "quest": quest})
+
+        router.submit("quest", {"prompt": [1]})
+        router.submit("lore", {"prompt": [2]})
+        quest.submit.assert_called_once_with({"prompt": [1]}, stream=None)
+        npc.submit.assert_called_once_with({"prompt": [2]}, stream=None)
@@ -1,35 +1,36 @@
 from evennia import DefaultScript
-from sentence_transformers import SentenceTransformer
-import json
+from dynquest.embeddings import EMBEDDING_MODEL, EMBEDDING_MODELS
+from dynquest.lore import MATRIX_SUFFIX, META_SUFFIX, save_lore_store
 
 class RealmFactory():
     @classmethod
     def gatherLore(cls):
+        return [snippet for _, snippet in RealmFactory.gatherRealmLore()]
+
+    @classmethod
+    def gatherRealmLore(cls):
+        """
+        Returns (realm_tag, snippet) pairs for every realm's lore, so lore can be indexed per realm.
+        """
         lore = []
-       
+
         for realm in RealmFactory.listRealms():
             print(f"Realm: {realm.realm_name}, {realm.lore}")
             for lorebit in realm.lore:
-                lore.append(f"In {realm.realm_name}: {lorebit}")
+                lore.append((realm.realm_tag, f"In {realm.realm_name}: {lorebit}"))
 
         return lore
     
     @classmethod
     def embedLore(cls):
-        model = SentenceTransformer("all-MiniLM-L6-v2")
-        data = []
-
-        for snippet in RealmFactory.gatherLore():
-            embedding = model.encode(snippet).tolist()
-            data.append({
-                "content": snippet,
-                "embedding": embedding
-            })
+        model_name = EMBEDDING_MODEL
+        model = EMBEDDING_MODELS.get(model_name)
+        realm_tags, lore = zip(*RealmFactory.gatherRealmLore())
+        embeddings = model.encode(list(lore), convert_to_numpy=True)
 
-        with open("severed_realms_embeddings.json", "w") as f:
-            json.dump(data, f, indent=2)
+        save_lore_store("severed_realms_embeddings", list(lore), embeddings, model_name, realms=list(realm_tags))
 
-        print("Embedding complete and saved to brave_river_embeddings.json")
+        print(f"Embedding complete and saved to severed_realms_embeddings{MATRIX_SUFFIX} and severed_realms_embeddings{META_SUFFIX}")
 
     @classmethod
     def listRealms(cls):
@@ -24,4 +24,5 @@ class TestRealmFactory(EvenniaTest):
         """Test that RealmFactory correctly embeds lore in rooms."""
         print(f"Running test: {self._testMethodName}")        
         lore = RealmFactory.embedLore()
-        self.assertTrue(os.path.exists("severed_realms_embeddings.json"), "Expected 'severed_realms_embeddings.json' to be created")
\ No newline at end of file
+        self.assertTrue(os.path.exists("severed_realms_embeddings.npy"), "Expected 'severed_realms_embeddings.npy' to be created")
+        self.assertTrue(os.path.exists("severed_realms_embeddings.meta.json"), "Expected 'severed_realms_embeddings.meta.json' to be created")
\ No newline at end of file
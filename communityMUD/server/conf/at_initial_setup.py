@@ -20,3 +20,7 @@ def at_initial_setup():
     # --- DYNQUEST: Create Quest Builder Script ---
     if not search_script("quest_builder_script"):
         create_script("dynquest.builder.QuestBuilderScript")
+
+    # --- DYNQUEST: Create Quest Analysis Script ---
+    if not search_script("quest_analysis_script"):
+        create_script("dynquest.analysis.QuestAnalysisScript")
@@ -17,6 +17,8 @@ at_server_cold_stop()
 
 """
 
+from django.conf import settings
+
 
 def at_server_init():
     """
@@ -30,7 +32,18 @@ def at_server_start():
     This is called every time the server starts up, regardless of
     how it was shut down.
     """
-    pass
+    # --- DYNQUEST: Make sure quests queued for analysis are drained on existing databases ---
+    from dynquest.analysis import analysis_script
+    analysis_script()
+
+    # --- DYNQUEST: Load the embedding model off the reactor thread ---
+    if getattr(settings, "DYNQUEST_EMBEDDING_WORKER", False):
+        from dynquest.embedding_worker import start_embedding_worker
+        from dynquest.embeddings import EMBEDDING_MODEL
+        start_embedding_worker(EMBEDDING_MODEL)
+    elif getattr(settings, "DYNQUEST_EMBEDDING_WARMUP", False):
+        from dynquest.embeddings import EMBEDDING_MODELS
+        EMBEDDING_MODELS.warm_up()
 
 
 def at_server_stop():
@@ -38,7 +51,9 @@ def at_server_stop():
     This is called just before the server is shut down, regardless
     of it is for a reload, reset or shutdown.
     """
-    pass
+    # --- DYNQUEST: Stop the embedding worker process ---
+    from dynquest.embedding_worker import stop_embedding_worker
+    stop_embedding_worker()
 
 
 def at_server_reload_start():
@@ -39,6 +39,13 @@ INSTALLED_APPS += [
     "dynquest",
 ]
 
+# Run the embedding model in a separate worker process, so encoding never stalls the reactor.
+DYNQUEST_EMBEDDING_WORKER = True
+
+# Without the worker: load the embedding model in the background at server start, rather
+# than when an NPC first needs it. The model is loaded on first use either way.
+DYNQUEST_EMBEDDING_WARMUP = True
+
 
 ######################################################################
 # Settings given in secret_settings.py override those in this file.